@@ -1,15 +1,17 @@
 import numpy as np
 import matplotlib as mpl, matplotlib.pyplot as plt
 import time, os, threading
+from datetime import datetime
 # import modules from other python files
-from data_process import data, live_data
+from data_process import data, live_data, HEADLESS
 from arduino_manager import arduino
 from moment_data_process import data_frame
+from latency import latency_log
 plt.rcParams['axes.grid'] = True
 plt.rcParams["figure.autolayout"] = True
 prop_cycle = plt.rcParams['axes.prop_cycle']
 colors = prop_cycle.by_key()['color']
-mpl.use('TkAgg')
+mpl.use('Agg' if HEADLESS else 'TkAgg')
 # Initialisation of some constants and variables
 port = 'COM6' 
 baudrate = 230400 
@@ -27,7 +29,11 @@ class cart_pendulum():
         arduino,
         data,
         temp_data,
-        data_frame,):
+        data_frame,
+        batch_read = False,
+        lock_in = False,
+        record = False,
+        latency = False,):
         self.arduino = arduino
         self.data = data
         self.temp_datum = temp_data
@@ -37,6 +43,10 @@ class cart_pendulum():
         self.distance = 0
         self.NR_counter = 0
         self.thread_counter = 0
+        self.batch_read = batch_read # whether the reader thread parses whole blocks of lines at once
+        self.lock_in = lock_in # whether the phase comes from the sliding lock-in instead of the fft
+        self.record = record # whether the samples are streamed to the csv file during the run
+        self.latency = latency_log(enabled = latency) # stage timings dumped with the export
         # A dictionary of flags to control the system
         self.flag_list = {
             "command": True, # whether a command is sent to the arduino
@@ -113,14 +123,20 @@ class cart_pendulum():
             self.arduino.send_message("Terminate\n")
         try:
             plt.close("all")
+            if(self.arduino.acquisition):
+                self.arduino.board.stream(None) # the menu is read as text again
             self.arduino.read_single()
             self.arduino.clear()
             self.arduino.board.close()
             time.sleep(0.1)
             if(exp):
+                # the session is closed by the export, whether copy() ran or not
                 self.temp_datum.export_csv(self.module_name, 
                                       NR_phase_amp = NR_phase_amp,
-                                      input_spec_info = input_spec_info,)
+                                      input_spec_info = input_spec_info,
+                                      session = self.data.session)
+                self.data.session = None
+                self.export_latency()
             if(manual_continue):
                 input("\nPress ENTER to reconnect.\n\nOr press CTRL+C then ENTER to exit the program.\n")
                 self.arduino.initiate()
@@ -129,6 +145,23 @@ class cart_pendulum():
 
         self.reset(reset_data = False, swing_request = swing_request)
          
+    def export_latency(self):
+        '''Dumps the latency records of the run next to the csv export. The block and
+        shared readers stamp all the lines of a block with the arrival of the block, so
+        their arrival stage holds the spread within a block as well (block_arrival in
+        the json file).'''
+        if(not self.latency.enabled):
+            return
+        dirc = self.temp_datum.path + '\\' + datetime.now().strftime("%d-%m-latency")
+        try:
+            os.makedirs(dirc)
+        except OSError:
+            pass
+        filename = dirc + '\\' + self.module_name + datetime.now().strftime("-%H-%M-%S") + '.json'
+        self.latency.dump(filename, self.module_name)
+        self.latency.clear()
+        print("\nExported to " + filename + "\n")
+         
     def reset(self, reset_data = True, swing_request = False):
         self.arduino.clear()
         self.reset_flag_list(swing_request = swing_request)
@@ -169,19 +202,31 @@ class cart_pendulum():
         self.arduino.read_all()
         self.command_flag()
     
-    def thread_reader(self, 
-                      appendPos = False, 
-                      appendVel = False, 
+    def thread_reader(self,
+                      appendPos = False,
+                      appendVel = False,
                       thread_check = False):
+        if(self.record):
+            self.data.open_session(self.module_name)
+        self.latency.block_arrival = self.arduino.acquisition or self.batch_read
+        if(self.arduino.acquisition):
+            self.thread_shared_reader(appendPos, appendVel, thread_check)
+            return
+        if(self.batch_read):
+            self.thread_block_reader(appendPos, appendVel, thread_check)
+            return
         while(not self.temp_datum.flag_close_event):
             self.arduino.read_single(prt = False, in_waiting = True)
+            received = time.perf_counter()
             if(self.arduino.receive.rstrip() == "Kill switch hit."):
                 self.temp_datum.flag_close_event = True
                 break
             try:
                 self.df.update_data(self.arduino.receive.rstrip().split(','), \
                     appendPos = appendPos, appendVel = appendVel)
+                parsed = time.perf_counter()
                 self.data.append_data(self.df, appendPos = appendPos, appendVel = appendVel)
+                self.latency.samples(self.df.time, received, parsed, time.perf_counter())
                 if(thread_check):
                     print("time_sys: %.3f time_read: %.3f thread_counter: %d" % \
                         ((time.time() - self.data.sys_start_time), (self.df.time - self.data.start_time), self.thread_counter))
@@ -189,6 +234,77 @@ class cart_pendulum():
             except ValueError:
                 self.arduino.board.reset_input_buffer()
                 pass
+
+    def thread_block_reader(self,
+                            appendPos = False,
+                            appendVel = False,
+                            thread_check = False):
+        '''Batch version of thread_reader(), drains the serial buffer in one read and
+        appends the parsed block at once instead of line by line'''
+        while(not self.temp_datum.flag_close_event):
+            lines = self.arduino.read_block(in_waiting = True)
+            received = time.perf_counter()
+            flag_kill = "Kill switch hit." in lines
+            if(flag_kill):
+                # Samples before the kill switch message are still valid, the menu
+                # lines after it go back to the arduino class for reconnect()
+                kill = lines.index("Kill switch hit.")
+                self.arduino.remainder = "".join(i + "\n" for i in lines[kill + 1:]).encode('ASCII') \
+                    + self.arduino.remainder
+                lines = lines[:kill]
+            self.df.update_block(lines, appendPos = appendPos, appendVel = appendVel)
+            parsed = time.perf_counter()
+            self.data.append_block(self.df, appendPos = appendPos, appendVel = appendVel)
+            if(len(self.df.block) > 0):
+                self.latency.samples(self.df.block[:, 0], received, parsed, time.perf_counter())
+            if(thread_check and len(self.df.block) > 0):
+                print("time_sys: %.3f time_read: %.3f block_size: %d thread_counter: %d" % \
+                    ((time.time() - self.data.sys_start_time), (self.df.time - self.data.start_time), \
+                        len(self.df.block), self.thread_counter))
+                self.thread_counter += 1
+            if(flag_kill):
+                self.arduino.receive = "Kill switch hit."
+                self.temp_datum.flag_close_event = True
+                break
+    
+    def thread_shared_reader(self,
+                             appendPos = False,
+                             appendVel = False,
+                             thread_check = False):
+        '''Version of thread_reader() with the acquisition process of acquisition.py,
+        the samples are already parsed into the shared ring and only copied from it'''
+        num_col = 2
+        if(appendPos):
+            num_col = 3
+        if(appendVel):
+            num_col = 5
+        self.arduino.board.stream(num_col)
+        # lines received before the switch are still parsed here
+        lines = self.arduino.read_block(in_waiting = False)
+        received = time.perf_counter()
+        self.df.block = np.zeros((0, num_col))
+        if(len(lines) > 0):
+            self.df.update_block(lines, appendPos = appendPos, appendVel = appendVel)
+        while(not self.temp_datum.flag_close_event):
+            if(len(self.df.block) > 0):
+                parsed = time.perf_counter()
+                self.data.append_block(self.df, appendPos = appendPos, appendVel = appendVel)
+                self.latency.samples(self.df.block[:, 0], received, parsed, time.perf_counter())
+                if(thread_check):
+                    print("time_sys: %.3f time_read: %.3f block_size: %d thread_counter: %d" % \
+                        ((time.time() - self.data.sys_start_time), (self.df.time - self.data.start_time), \
+                            len(self.df.block), self.thread_counter))
+                    self.thread_counter += 1
+            if("Kill switch hit." in self.arduino.board.stream_lines):
+                self.arduino.board.stream_lines = []
+                self.arduino.receive = "Kill switch hit."
+                self.temp_datum.flag_close_event = True
+                break
+            block = self.arduino.board.fetch(self.arduino.read_timeout)
+            received = time.perf_counter()
+            self.df.block = block[:, :num_col]
+            if(len(block) > 0):
+                self.df.update_data(block[-1], appendPos = appendPos, appendVel = appendVel)
     
     def thread_writer(self):
         while(not self.temp_datum.flag_close_event):
@@ -325,15 +441,19 @@ class cart_pendulum():
                     self.reconnect(exp = True, NR_phase_amp = False)
                 else:
                     if(self.flag_list["thread_init"]):
+                        self.data.flag_lock_in = self.lock_in
                         reader = threading.Thread(target = self.thread_reader, 
                                                 args = (True, False, False))
                         reader.start()
                         self.flag_list["thread_init"] = False
                     
                     if(not self.temp_datum.flag_close_event):
+                        self.latency.frame()
                         self.temp_datum.copy(self.data, True)
+                        self.latency.lap("copy")
                         self.temp_datum.init_plot(self.module_name)
                         self.temp_datum.real_time_plot(self.module_name, scan = True)
+                        self.latency.lap("plot")
                     else:
                         self.reconnect(exp = True)
                     
@@ -341,6 +461,7 @@ class cart_pendulum():
                         self.temp_datum.NR_phase_calc(self.data.omega, scan = True, interpolation = True)
                     else:
                         self.temp_datum.NR_update(scan = True, interpolation = True)
+                    self.latency.lap("phase")
                     self.NR_counter += 1
         
     def pid(self):
@@ -442,6 +563,7 @@ class cart_pendulum():
                 else:
                     manual = False # turn up manual control of the amplitude
                     if(self.flag_list["thread_init"]):
+                        self.data.flag_lock_in = self.lock_in
                         reader = threading.Thread(target = self.thread_reader, 
                                                 args = (True, False, False))
                         reader.start()
@@ -451,9 +573,12 @@ class cart_pendulum():
                         self.flag_list["thread_init"] = False
                     
                     if(not self.temp_datum.flag_close_event):
+                        self.latency.frame()
                         self.temp_datum.copy(self.data, True)
+                        self.latency.lap("copy")
                         self.temp_datum.init_plot(self.module_name, NR_scan)
                         self.temp_datum.real_time_plot(self.module_name, NR_scan)
+                        self.latency.lap("plot")
                     else:
                         if(not NR_scan and manual):
                             writer.join()
@@ -461,9 +586,11 @@ class cart_pendulum():
                     
                     if(self.NR_counter >= self.temp_datum.wait_to_stable):
                         amp, self.phase = self.temp_datum.NR_update(NR_scan, interpolation, manual) 
+                        self.latency.lap("phase")
                         if(not manual):
                             # After attempting many times, this is the correct way to update the phase
                             self.arduino.send_message(str(amp) + "," + str(self.phase + np.pi) + "\n")
+                            self.latency.sent()
                             # self.arduino.send_message(str(amp) + "," + str(self.phase) + "\n")
                         elif(manual and not NR_scan):
                             pass
@@ -471,6 +598,7 @@ class cart_pendulum():
                     else:
                         if(self.data.omega_list is None):
                             self.temp_datum.NR_phase_calc(self.data.omega, NR_scan, interpolation)
+                            self.latency.lap("phase")
                         else:
                             pass
                         self.NR_counter += 1
@@ -533,15 +661,19 @@ class cart_pendulum():
                     break
                 
                 if(self.flag_list["thread_init"]):
+                    self.data.flag_lock_in = self.lock_in
                     reader = threading.Thread(target = self.thread_reader, 
                                             args = (True, False, False))
                     reader.start()
                     self.flag_list["thread_init"] = False
                 
                 if(not self.temp_datum.flag_close_event):
+                    self.latency.frame()
                     self.temp_datum.copy(self.data, True)
+                    self.latency.lap("copy")
                     self.temp_datum.init_plot(self.module_name)
                     self.temp_datum.real_time_plot(self.module_name, scan = True)
+                    self.latency.lap("plot")
                 else:
                     self.reconnect(exp = True, 
                                    send_terminate = True, 
@@ -553,6 +685,7 @@ class cart_pendulum():
                     break
                 
                 self.temp_datum.NR_phase_calc(self.data.omega, scan = True, interpolation = True)
+                self.latency.lap("phase")
     
     def create_folder(self):
         self.cwd = os.getcwd()
@@ -615,17 +748,26 @@ if(__name__ == "__main__"):
     fft_lengths = 512 # Good values are 2**n (same as 2^n), possible to choose other numbers
     sampling_divs = 0.04 # The minimum sampling division set in Arduino is 50 ms
     wait_to_stables = 1 # NR stage parameter, but also controls the updating rate of phase plot
+    batch_reads = False # Read and parse all the waiting serial lines at once, keeps up with high sampling rates
+    lock_ins = False # Phase from a sliding lock-in updated per sample instead of the fft of the window
+    record_sessions = False # Stream the samples to the csv file during the run, not only at the end
+    snapshot_periods = None # Seconds between PNG snapshots of the figure when run with PENDULUM_HEADLESS=1, None for no figure
+    latencies = False # Record the latency of every stage of the loop, dumped as histograms next to the csv export
+    simulate_boards = None # e.g. {"speed": 1., "natural_freq": 1.} to run against the simulated board of arduino_simulator.py
+    acquisitions = False # Read and parse the serial port in a separate process, the plotting can stall without delaying the samples
         
     #  Initialisation of the arduino board and the data class
-    arduino_board = arduino(port, baudrate) # initiate the arduino class
+    arduino_board = arduino(port, baudrate, simulate = simulate_boards, acquisition = acquisitions) # initiate the arduino class
     df = data_frame() # a moment data frame class
     datum = data(fft_length = fft_lengths, 
                 sampling_div = sampling_divs, 
                 wait_to_stable = wait_to_stables) # a data class for storing data
     temp_datum = live_data(fft_length = fft_lengths, 
                 sampling_div = sampling_divs, 
-                wait_to_stable = wait_to_stables) # variable for non-blocking plot
-    cartER = cart_pendulum(arduino_board, datum, temp_datum, df)
+                wait_to_stable = wait_to_stables,
+                snapshot_period = snapshot_periods) # variable for non-blocking plot
+    cartER = cart_pendulum(arduino_board, datum, temp_datum, df, batch_read = batch_reads,
+                           lock_in = lock_ins, record = record_sessions, latency = latencies)
 
     cartER.main()
     print("\nProgram ends.")
@@ -0,0 +1,299 @@
+'''Acquisition in a separate process. The process owns the serial port: it reads and
+parses the lines and appends the samples to a ring buffer in shared memory, where
+the console copies them out without any lock (the write index is published after
+the samples). The other lines and the messages to the board go through a pipe, and
+acquisition_port has the serial.Serial interface used by the arduino class, so
+reading the menu and sending the commands work as before. The plotting of the
+console can then stall without delaying the reading of the port.'''
+import numpy as np
+import multiprocessing, threading, time
+from multiprocessing import shared_memory
+from moment_data_process import data_frame
+
+NUM_COL = 5 # time, angle, position, angular_velocity, position_velocity
+RING_LENGTH = 4 * 8192 # samples kept in shared memory, minutes of samples at 20 Hz
+POLL_TIME = 0.005 # timeout of the reads of the acquisition process, in seconds
+KILL_MESSAGE = "Kill switch hit."
+
+class shared_ring():
+
+    '''Ring buffer of samples (one row per sample) in shared memory, with a single
+    writer. header[0] is the number of samples written, updated only after the
+    samples themselves, so a reader never sees a sample before it is complete.'''
+
+    def __init__(self, length = RING_LENGTH, name = None):
+        create = name is None
+        self.length = length
+        self.memory = shared_memory.SharedMemory(name = name, create = create,
+                                                 size = 8 * (1 + length * NUM_COL))
+        self.name = self.memory.name
+        self.header = np.ndarray((1,), dtype = np.int64, buffer = self.memory.buf)
+        self.data = np.ndarray((length, NUM_COL), dtype = float, buffer = self.memory.buf, offset = 8)
+        if(create):
+            self.header[0] = 0
+
+    @property
+    def index(self):
+        return int(self.header[0])
+
+    def write(self, block):
+        '''Appends a block of samples, with NUM_COL columns or less'''
+        block = block[-self.length:]
+        slots = (self.index + np.arange(len(block))) % self.length
+        self.data[slots, :block.shape[1]] = block
+        self.data[slots, block.shape[1]:] = 0.
+        self.header[0] += len(block) # publishes the samples
+
+    def read(self, start):
+        '''Returns the samples written since the index start (a copy) and the index to
+        read from next time. Samples overwritten before they are read are skipped.'''
+        index = self.index
+        start = max(start, index - self.length)
+        block = self.data[np.arange(start, index) % self.length]
+        overwritten = self.index - self.length - start # written over during the copy
+        if(overwritten > 0):
+            block = block[overwritten:]
+        return block, index
+
+    def close(self, unlink = False):
+        del self.header, self.data # the views have to go before the memory
+        self.memory.close()
+        if(unlink):
+            self.memory.unlink()
+
+def parse_block(lines, num_col):
+    '''Samples of the lines as data_frame.update_block() parses them'''
+    df = data_frame()
+    df.update_block(lines, appendPos = num_col >= 3, appendVel = num_col >= 5)
+    return df.block
+
+def run_acquisition(settings, ring_name, connection):
+    '''Main function of the acquisition process. In text mode every received byte
+    is passed to the console. In stream mode the sample lines go to the ring, the
+    other lines are passed as stream lines, and the kill switch message switches
+    back to text mode.'''
+    from arduino_manager import open_board
+    ring = shared_ring(name = ring_name)
+    try:
+        board = open_board(**settings)
+    except IOError as error:
+        connection.send(('error', str(error)))
+        ring.close()
+        return
+    num_col = None # text mode
+    remainder = b"" # unfinished line, only complete lines are passed on
+    try:
+        while(True):
+            while(connection.poll()):
+                command, argument = connection.recv()
+                if(command == 'write'):
+                    board.write(argument)
+                elif(command == 'stream'):
+                    # the samples from the returned index on are in the ring
+                    num_col = argument
+                    connection.send(('stream', ring.index))
+                elif(command == 'reset_input'):
+                    board.reset_input_buffer()
+                    remainder = b""
+                elif(command == 'reset_output'):
+                    board.reset_output_buffer()
+                elif(command == 'close'):
+                    return
+            chunk = board.read(max(board.in_waiting, 1))
+            if(len(chunk) == 0):
+                continue
+            complete, _, remainder = (remainder + chunk).rpartition(b"\n")
+            if(len(complete) == 0):
+                continue
+            if(num_col is None):
+                connection.send(('text', complete + b"\n"))
+                continue
+            text = b""
+            if(KILL_MESSAGE.encode('ASCII') in complete):
+                # the lines after the kill switch message are the menu, read as text
+                complete, kill, after = complete.partition(KILL_MESSAGE.encode('ASCII'))
+                complete += kill
+                if(b"\n" in after):
+                    text = after.split(b"\n", 1)[1] + b"\n"
+                num_col_stream, num_col = num_col, None
+            else:
+                num_col_stream = num_col
+            lines = complete.decode('ASCII', 'replace').splitlines()
+            block = parse_block(lines, num_col_stream)
+            if(len(block) > 0):
+                ring.write(block)
+            others = [line for line in lines if line and not line.startswith("DEBUG") \
+                and not line[0].isdigit() and not line[0] == '-']
+            if(len(others) > 0):
+                connection.send(('lines', others))
+            if(len(text) > 0):
+                connection.send(('text', text))
+    except (IOError, EOFError) as error:
+        try:
+            connection.send(('error', str(error)))
+        except (IOError, EOFError):
+            pass
+    finally:
+        try:
+            board.close()
+        except IOError:
+            pass
+        ring.close()
+
+class acquisition_port():
+
+    '''Console side of the acquisition process, a stand-in of the serial port. The
+    text read by read(), readline() and in_waiting is what the process passes on;
+    stream(num_col) switches the process to parsing the samples into the ring,
+    fetch() returns the new ones and stream_lines the other lines of the stream.'''
+
+    def __init__(
+        self,
+        settings, # keyword arguments of arduino_manager.open_board()
+        timeout = None, # read timeout in seconds, as serial.Serial
+        length = RING_LENGTH,
+        start_method = None, # e.g. 'spawn', the only one on Windows, the default of the system otherwise
+        ):
+        self.timeout = timeout
+        self.ring = shared_ring(length)
+        context = multiprocessing.get_context(start_method)
+        self.connection, child = context.Pipe()
+        settings = dict(settings, timeout = POLL_TIME)
+        self.process = context.Process(target = run_acquisition,
+                                               args = (settings, self.ring.name, child),
+                                               daemon = True)
+        self.process.start()
+        self.text = bytearray()
+        self.stream_lines = []
+        self.read_index = 0
+        self.num_col = None
+        self.switched = False
+        # the reader thread and the main thread share the pipe, one lock per direction
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.error = None
+        self.is_open = True
+
+    def receive(self, wait = 0.):
+        '''Collects what the process sent, waiting up to wait seconds for it'''
+        if(not self.is_open):
+            raise IOError("Attempting to use a port that is not open")
+        messages = []
+        with self.lock:
+            try:
+                if(not self.connection.poll(wait)):
+                    return self.check_error()
+                while(self.connection.poll()):
+                    messages.append(self.connection.recv())
+            except EOFError:
+                # the process has ended, as a port of a disconnected board
+                messages.append(('error', "The acquisition process has ended."))
+            for kind, content in messages:
+                if(kind == 'text'):
+                    self.text += content
+                elif(kind == 'lines'):
+                    self.stream_lines += content
+                elif(kind == 'stream'):
+                    self.read_index = content
+                    self.switched = True
+                    if(self.num_col is None):
+                        # the lines of the stream not taken by the reader are read as text
+                        self.text += "".join(i + "\r\n" for i in self.stream_lines).encode('ASCII')
+                        self.stream_lines = []
+                elif(kind == 'error'):
+                    self.error = content
+        self.check_error()
+
+    def check_error(self):
+        '''Raises the IOError of the process once its text is read'''
+        if(self.error is not None and len(self.text) == 0):
+            raise IOError(self.error)
+
+    def wait(self, ready):
+        '''Receives until ready() is true or the timeout runs out'''
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        self.receive()
+        while(not ready()):
+            remaining = POLL_TIME if deadline is None else min(deadline - time.perf_counter(), POLL_TIME)
+            if(remaining <= 0):
+                break
+            self.receive(remaining)
+
+    @property
+    def in_waiting(self):
+        self.receive()
+        return len(self.text)
+
+    def read(self, size = 1):
+        self.wait(lambda: len(self.text) >= size)
+        data = bytes(self.text[:size])
+        del self.text[:size]
+        return data
+
+    def readline(self):
+        self.wait(lambda: b"\n" in self.text)
+        end = self.text.find(b"\n") + 1
+        if(end == 0):
+            end = len(self.text)
+        data = bytes(self.text[:end])
+        del self.text[:end]
+        return data
+
+    def send(self, command, argument = None):
+        if(not self.is_open):
+            raise IOError("Attempting to use a port that is not open")
+        with self.send_lock:
+            self.connection.send((command, argument))
+
+    def write(self, data):
+        self.send('write', bytes(data))
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.send('reset_input')
+        self.receive()
+        self.text.clear()
+
+    def reset_output_buffer(self):
+        self.send('reset_output')
+
+    def flush(self):
+        pass
+
+    def stream(self, num_col):
+        '''Parses the sample lines with num_col columns into the ring from now on,
+        None for text again. Waits for the process to switch, the lines it passed
+        on before are left in the text buffer.'''
+        if(num_col is not None):
+            self.stream_lines = []
+        self.num_col = num_col
+        self.switched = False
+        self.send('stream', num_col)
+        while(not self.switched):
+            self.receive(POLL_TIME)
+
+    def fetch(self, wait = POLL_TIME):
+        '''New samples of the stream (one row per sample, NUM_COL columns), waits up
+        to wait seconds if there are none yet'''
+        deadline = time.perf_counter() + wait
+        while(self.ring.index == self.read_index and time.perf_counter() < deadline):
+            self.receive(POLL_TIME)
+        self.receive()
+        with self.lock:
+            block, self.read_index = self.ring.read(self.read_index)
+        return block
+
+    def close(self):
+        if(not self.is_open):
+            return
+        try:
+            self.send('close')
+        except (IOError, EOFError):
+            pass
+        self.is_open = False
+        self.process.join(1.)
+        if(self.process.is_alive()):
+            self.process.terminate()
+        with self.lock, self.send_lock:
+            self.connection.close()
+            self.ring.close(unlink = True)
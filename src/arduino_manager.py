@@ -1,6 +1,24 @@
 import numpy as np
 import serial
 import serial.tools.list_ports
+from arduino_simulator import simulated_board
+from serial_capture import tee_port, replay_board
+from acquisition import acquisition_port
+
+def open_board(port, baudrate, timeout = None, dsrdtr = None, simulate = None, capture = None,
+               replay = None, replay_speed = 1.):
+    '''Opens the serial port, or its stand-in, as set up in the arduino class'''
+    if(replay is not None):
+        board = replay_board(replay, speed = replay_speed, timeout = timeout)
+    elif(simulate):
+        # in-process board of arduino_simulator.py instead of the serial port
+        options = simulate if isinstance(simulate, dict) else {}
+        board = simulated_board(timeout = timeout, **options)
+    else:
+        board = serial.Serial(port, baudrate, timeout = timeout, dsrdtr = dsrdtr)
+    if(capture is not None):
+        board = tee_port(board, capture)
+    return board
 
 class arduino():
     
@@ -12,15 +30,31 @@ class arduino():
         baudrate,
         timeout = None, 
         dsrdtr = None, 
+        blocking_read = True, # wait for data with timed blocking reads instead of polling
+        read_timeout = 0.1, # timeout of a single blocking read, in seconds
+        simulate = None, # True or a dict of simulated_board options to run without the rig
+        capture = None, # file name to record the raw serial traffic to, see serial_capture.py
+        replay = None, # capture file played back instead of the board
+        replay_speed = 1., # speed of the playback, None for no waiting
+        acquisition = False, # read and parse in a separate process (see acquisition.py), or the start method of that process
     ):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.dsrdtr = dsrdtr
+        self.blocking_read = blocking_read
+        self.read_timeout = read_timeout
+        self.simulate = simulate
+        self.capture = capture
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.acquisition = acquisition
+        self.wakeup_count = 0 # number of times the waiting loop woke up, to check the CPU usage
         self.message = ""
         self.receive = ""
         self.command = ""
         self.omega = ""
+        self.remainder = b"" # unfinished line left over from the last read_block()
         self.ardprompt = "Arduino> "  # printed at start of each response from Arduino, to show what comes from it rather than from python
     
     def clear(self):
@@ -29,6 +63,7 @@ class arduino():
         self.receive = ""
         self.command = ""
         self.omega = ""
+        self.remainder = b""
         try:
             self.board.reset_input_buffer()
             self.board.reset_output_buffer()
@@ -64,15 +99,27 @@ class arduino():
                     temp_flag = False
         self.port = arduino_ports[num]
     
+    def board_settings(self):
+        '''Arguments of open_board() but the timeout'''
+        return {"port": self.port, "baudrate": self.baudrate, "dsrdtr": self.dsrdtr,
+                "simulate": self.simulate, "capture": self.capture, "replay": self.replay,
+                "replay_speed": self.replay_speed}
+
     def initiate(self):
         '''Start up routine of the arduino'''
-        self.find_port()
-        self.board = serial.Serial(
-            self.port,
-            self.baudrate,
-            timeout = self.timeout,
-            dsrdtr = self.dsrdtr
-        )
+        if(self.blocking_read):
+            # readline() may then return a partial line, completed by read_line()
+            timeout = self.read_timeout
+        else:
+            timeout = self.timeout
+        if(self.replay is None and not self.simulate):
+            self.find_port()
+        if(self.acquisition):
+            # the port is opened by the acquisition process of acquisition.py
+            start_method = self.acquisition if isinstance(self.acquisition, str) else None
+            self.board = acquisition_port(self.board_settings(), timeout = timeout, start_method = start_method)
+        else:
+            self.board = open_board(timeout = timeout, **self.board_settings())
         self.board.write('connection\n'.encode('ASCII'))
         self.read_single()
         
@@ -152,26 +199,66 @@ class arduino():
             else:
                 print("\nInvalid input, please enter an integer between 1 and 10")
         
+    def wait_for_data(self):
+        '''Block the program until new bytes are received. With blocking_read the
+        thread sleeps inside timed serial reads of read_timeout seconds and the
+        received byte is kept in self.remainder, otherwise in_waiting is polled.
+        Returns at once if self.remainder already holds a complete line.'''
+        if(b"\n" in self.remainder):
+            return
+        if(self.blocking_read):
+            while(self.board.in_waiting == 0):
+                byte = self.board.read(1)
+                self.wakeup_count += 1
+                if(len(byte) > 0):
+                    self.remainder += byte
+                    return
+        else:
+            while(self.board.in_waiting == 0):
+                self.wakeup_count += 1
+    
+    def read_line(self):
+        '''Read a complete line, prefixed by the unfinished line in self.remainder.
+        Timed out readline() calls are joined until the line ending arrives.'''
+        line, end, self.remainder = self.remainder.partition(b"\n")
+        if(len(end) > 0):
+            # complete lines left over by the block reader
+            return line + end
+        while(not line.endswith(b"\n")):
+            line += self.board.readline()
+        return line
+        
     def read_single(self, prt = True, in_waiting = True):
         '''Read a single line from the arduino, in_waiting for blocking the program 
         until a line is received'''
         if(in_waiting):
-            while(self.board.in_waiting == 0):
-                pass        
-        self.receive = self.board.readline().decode('ASCII')
+            self.wait_for_data()
+        self.receive = self.read_line().decode('ASCII')
         while (self.receive.startswith("DEBUG")):
             if(prt):
                 print(self.ardprompt+self.receive)  # show which text came from arduino 'A> '+
-            self.receive = self.board.readline().decode('ASCII')
+            self.receive = self.read_line().decode('ASCII')
         if(prt):
             print(self.ardprompt+self.receive)  # show which text came from arduino 'A> '+
         
+    def read_block(self, in_waiting = True):
+        '''Drain everything waiting in the serial buffer with a single read and
+        split it into complete lines. The unfinished tail is kept in self.remainder
+        and completed by the next read. Returns a list of lines without line endings'''
+        if(in_waiting):
+            self.wait_for_data()
+        chunk = self.remainder + self.board.read(self.board.in_waiting)
+        complete, _, self.remainder = chunk.rpartition(b"\n")
+        if(len(complete) == 0):
+            return []
+        lines = complete.decode('ASCII').splitlines()
+        self.receive = lines[-1]
+        return lines
+        
     def read_all(self):
         '''Read all lines from the arduino'''
-        while(self.board.in_waiting == 0):
-            # print('waiting')
-            pass
-        while(self.board.in_waiting):
-            self.receive = self.board.readline().decode('utf-8')
+        self.wait_for_data()
+        while(self.board.in_waiting or len(self.remainder)):
+            self.receive = self.read_line().decode('utf-8')
             print(self.ardprompt+self.receive)
       
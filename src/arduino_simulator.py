@@ -0,0 +1,475 @@
+'''Simulated Arduino board to run the console without the rig. simulated_board has
+the part of the serial.Serial interface used by the arduino class, and runs a copy
+of the command menu of Pendulum_Arduino.ino in a background thread. The samples
+come from a pendulum hanging from a cart that is driven like the stepper motor.'''
+import numpy as np
+import threading, time, math
+
+GRAVITY = 9.81
+METRES_PER_STEP = 5e-5 # cart travel of one motor step
+RAIL_STEPS = 6000 # distance between the limit switches, in steps
+SAFE_STEPS = 50 # safe distance to both switches, as in the sketch
+SPEED_LIMIT = 4000. # maximum cart speed, in steps/s
+RUN_SPEED = 2000. # speed of the centring moves, in steps/s
+SAFE_SPEED = 500. # speed towards the switches while centring, in steps/s
+ANGLE_RESOLUTION = 2 * np.pi / 4096 # resolution of the AS5600 angle sensor
+LOOP_TIME = 0.002 # period of the control loop of the pid stage, in seconds
+MESSAGE_GAP = 0.02 # wall clock seconds after each printed message, the console reads them one at a time
+FREQ_SIZE = 10 # maximum number of driving frequencies
+
+class board_closed(Exception):
+    '''Raised inside the board thread when the port is closed'''
+
+class simulated_board():
+
+    '''In-process stand-in of the Arduino board and its serial port. The board
+    thread follows the sketch: connection, menu, reset/center/measure/freq_scan/pid/NR
+    stages, the "Kill switch hit." message when the cart reaches a switch, and the
+    amp,phase messages of the NR stage. The simulated time runs speed times faster
+    than the wall clock (as fast as possible with speed = None).'''
+
+    def __init__(
+        self,
+        timeout = None, # read timeout in seconds, as serial.Serial
+        natural_freq = 1.0, # natural frequency of the pendulum, in Hz
+        damping = 0.1, # damping factor gamma, the amplitude decays as exp(-gamma * t / 2)
+        sample_div = 0.05, # seconds between two printed samples, 50 ms in the sketch
+        speed = 1., # simulated seconds per wall clock second, None for no waiting
+        dt = 1e-3, # integration step, in seconds
+        release_angle = 2.2, # angle the pendulum is released from in the measure stage, in rad
+        debug = False, # interleave the DEBUG messages of the sketch (debug > 0)
+        ):
+        self.timeout = timeout
+        self.natural_freq = natural_freq
+        self.damping = damping
+        self.sample_div = sample_div
+        self.speed = speed
+        self.dt = dt
+        self.release_angle = release_angle
+        self.debug = debug
+        self.length = GRAVITY / (2 * np.pi * natural_freq) ** 2 # length of the equivalent simple pendulum
+        self.output = bytearray() # board to host
+        self.input = bytearray() # host to board
+        self.condition = threading.Condition()
+        self.is_open = True
+        # State of the model
+        self.clock = 0. # board time, millis() / 1000
+        self.angle = 0. # pendulum angle from the hanging position, in rad
+        self.angular_velocity = 0.
+        self.position = 0. # cart position from the rail centre, in steps
+        self.velocity = 0. # cart velocity, in steps/s
+        self.target = 0. # target position of the stepper motor
+        self.step_speed = SPEED_LIMIT # speed limit of the current move
+        self.wall_start = time.perf_counter()
+        # Variables of the sketch
+        self.center_count = 0
+        self.distance = 0
+        self.pid_param = [600., 400., 2.5, -0.05, 0., -0.01] # Kp, Ki, Kd, Kp_pos, Ki_pos, Kd_pos
+        self.reset()
+        self.thread = threading.Thread(target = self.program, daemon = True)
+        self.thread.start()
+
+    # serial.Serial interface used by the arduino class
+
+    def check_open(self):
+        if(not self.is_open):
+            raise IOError("Attempting to use a port that is not open")
+
+    @property
+    def in_waiting(self):
+        self.check_open()
+        with self.condition:
+            return len(self.output)
+
+    def write(self, data):
+        with self.condition:
+            self.input += data
+            self.condition.notify_all()
+        return len(data)
+
+    def wait_output(self, ready):
+        '''Waits until ready() is true, the timeout runs out or the port is closed'''
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while(not ready() and self.is_open):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if(remaining is not None and remaining <= 0):
+                break
+            self.condition.wait(remaining)
+
+    def read(self, size = 1):
+        self.check_open()
+        with self.condition:
+            self.wait_output(lambda: len(self.output) >= size)
+            data = bytes(self.output[:size])
+            del self.output[:size]
+        return data
+
+    def readline(self):
+        self.check_open()
+        with self.condition:
+            self.wait_output(lambda: b"\n" in self.output)
+            end = self.output.find(b"\n") + 1
+            if(end == 0):
+                end = len(self.output)
+            data = bytes(self.output[:end])
+            del self.output[:end]
+        return data
+
+    def reset_input_buffer(self):
+        with self.condition:
+            self.output.clear()
+
+    def reset_output_buffer(self):
+        with self.condition:
+            self.input.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        '''Closing the port resets the real board, the simulated one stops'''
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+
+    # Model
+
+    def step(self):
+        '''Moves the cart towards the target and integrates the pendulum by dt'''
+        limit = self.step_speed * self.dt
+        move = min(max(self.target - self.position, -limit), limit)
+        self.position += move
+        velocity = move / self.dt
+        acceleration = (velocity - self.velocity) / self.dt * METRES_PER_STEP
+        self.velocity = velocity
+        self.angular_velocity += self.dt * (- GRAVITY / self.length * math.sin(self.angle) \
+            - self.damping * self.angular_velocity - acceleration / self.length * math.cos(self.angle))
+        self.angle += self.dt * self.angular_velocity
+        self.clock += self.dt
+
+    def advance(self, duration, drive = None):
+        '''Runs the model for duration seconds, drive(time) gives the target of the cart.
+        Returns True if a limit switch is hit.'''
+        end = self.clock + duration - 0.5 * self.dt
+        while(self.clock < end):
+            if(drive is not None):
+                self.target = drive(self.clock)
+            self.step()
+            if(abs(self.position) >= 0.5 * RAIL_STEPS):
+                return True
+        self.pace()
+        return False
+
+    def pace(self):
+        '''Waits until the wall clock catches up with the simulated time'''
+        if(not self.is_open):
+            raise board_closed()
+        if(self.speed is not None):
+            delay = self.wall_start + self.clock / self.speed - time.perf_counter()
+            if(delay > 0):
+                time.sleep(delay)
+
+    def delay(self, duration):
+        '''delay() of the sketch, the cart keeps moving to its target'''
+        self.advance(duration)
+
+    def move_to(self, target, speed):
+        '''Blocking move of the cart at a constant speed'''
+        self.step_speed = speed
+        self.target = target
+        while(abs(self.position - target) > 0.5):
+            self.advance(self.sample_div)
+        self.step_speed = SPEED_LIMIT
+
+    def read_angle(self):
+        '''Cumulative angle of the sensor, zeroed at the first reading of a stage'''
+        angle = round(self.angle / ANGLE_RESOLUTION) * ANGLE_RESOLUTION
+        if(self.flag_init_angle):
+            self.init_angle = angle
+            self.flag_init_angle = False
+        return angle - self.init_angle
+
+    # Serial communication of the board
+
+    def println(self, *lines):
+        '''Prints a message of one or more lines'''
+        with self.condition:
+            if(not self.is_open):
+                raise board_closed()
+            self.output += "".join(line + "\r\n" for line in lines).encode('ASCII')
+            self.condition.notify_all()
+        time.sleep(MESSAGE_GAP)
+
+    def print_sample(self, line):
+        '''Prints a line of samples without waiting'''
+        with self.condition:
+            self.output += (line + "\r\n").encode('ASCII')
+            self.condition.notify_all()
+
+    def available(self):
+        with self.condition:
+            return b"\n" in self.input
+
+    def read_msg(self):
+        '''Waits for a message, the time goes on meanwhile'''
+        if(self.debug):
+            self.println("DEBUG: Checking if serial is available in read_msg...")
+        while(not self.available()):
+            with self.condition:
+                if(not self.is_open):
+                    raise board_closed()
+                self.condition.wait(self.sample_div if self.speed is None else self.sample_div / self.speed)
+            if(self.speed is not None):
+                wall_clock = (time.perf_counter() - self.wall_start) * self.speed
+                self.advance(max(wall_clock - self.clock, 0.))
+        return self.read_ready_msg()
+
+    def read_ready_msg(self):
+        '''Reads the next message, trimmed'''
+        with self.condition:
+            end = self.input.find(b"\n") + 1
+            message = bytes(self.input[:end]).decode('ASCII', 'replace').strip()
+            del self.input[:end]
+        if(self.debug):
+            self.println("DEBUG: Received message: " + message)
+        return message
+
+    # Program of the sketch
+
+    def reset(self):
+        '''reset() of the sketch'''
+        self.amp = 0.
+        self.amp_0 = 50.
+        self.omega = 0.
+        self.phase = 0.
+        self.omega_list = []
+        self.flag_init_angle = True
+        self.init_angle = 0.
+
+    def program(self):
+        '''setup() and loop() of the sketch'''
+        try:
+            self.read_msg()
+            self.println("Successfully Connected")
+            self.delay(0.5)
+            while(True):
+                self.println("Cart pendulum functions: ",
+                             "Enter 0 to reset the arduino board.",
+                             "Enter 1 to begin centring the cart.",
+                             "Enter 2 to begin measuring the natural frequency and quality factor.",
+                             "Enter 3 to begin the frequency scan.",
+                             "Enter 4 to begin the PID control of the inverted pendulum.",
+                             "Enter 5 to begin the normalised resonance.")
+                self.read_cmd()
+        except board_closed:
+            pass
+
+    def read_cmd(self):
+        '''read_cmd() of the sketch followed by the chosen stage'''
+        message = self.read_msg()
+        stages = {
+            0: ("Resetting...", self.reset),
+            1: ("Beginning centring.", self.center),
+            2: ("Beginning measuring the natural frequency and quality factor.", self.measure),
+            3: ("Beginning the frequency scan.", self.drive),
+            4: ("Beginning PID control.", self.pid),
+            5: ("Beginning the normalised resonance.", self.drive),
+        }
+        if(message.isdigit() or message == ""):
+            command = int(message) if message != "" else 0 # toInt() of an empty string
+            if(command in stages):
+                self.println(stages[command][0])
+                stages[command][1]()
+                self.reset()
+                return
+        elif(message == "connection"):
+            self.delay(0.5)
+            self.println("Successfully Connected")
+            self.delay(0.5)
+            return
+        elif(message == "Terminate"):
+            self.println("Terminating...")
+            self.reset()
+        self.delay(0.5)
+        self.println("Unidentified command. Please try again.")
+        self.delay(0.5)
+
+    def cart_reset(self, kill = True):
+        '''cart_reset() of the sketch, the cart goes back to the centre'''
+        if(kill):
+            self.println("Kill switch hit.")
+            self.delay(0.5)
+        self.delay(0.5)
+        self.move_to(0., RUN_SPEED)
+
+    def center(self):
+        '''Touches both switches and stops in the middle of the rail'''
+        self.move_to(- 0.5 * RAIL_STEPS + 1, SAFE_SPEED)
+        self.delay(0.5)
+        self.move_to(- 0.5 * RAIL_STEPS + SAFE_STEPS, SAFE_SPEED)
+        self.move_to(0.5 * RAIL_STEPS - 1, SAFE_SPEED)
+        self.delay(0.5)
+        self.move_to(0.5 * RAIL_STEPS - SAFE_STEPS, SAFE_SPEED)
+        self.move_to(0., RUN_SPEED)
+        self.delay(0.5)
+        self.distance = RAIL_STEPS - 2
+        self.center_count += 1
+        self.println("%d,%d" % (self.center_count, self.distance))
+
+    def measure(self):
+        '''Prints the angle of the released pendulum until the port is closed'''
+        self.read_angle()
+        self.delay(1.)
+        self.angle, self.angular_velocity = self.release_angle, 0.
+        while(True):
+            self.advance(self.sample_div)
+            angle = self.read_angle()
+            if(self.debug):
+                self.print_sample("DEBUG: in middle of loop() after checking switches")
+            self.print_sample("%.6f,%.4f" % (self.clock, angle))
+
+    def is_float(self, text, neg = False):
+        '''isFloat() of the sketch, an empty string is a float'''
+        body = text[1:] if (neg and text.startswith('-')) else text
+        return body.replace('.', '', 1).isdigit() or body == "" or body == "."
+
+    def to_float(self, text):
+        '''toFloat() of the sketch'''
+        try:
+            return float(text)
+        except ValueError:
+            return 0.
+
+    def drive(self):
+        '''freq_scan() and NR() of the sketch, the cart is driven at the received
+        frequencies, the NR messages "amp,phase" add the active sinusoid'''
+        while(True):
+            self.println("Input a frequency value for driving the cart (in Hz):")
+            message = self.read_msg()
+            if(self.is_float(message)):
+                self.omega = self.to_float(message) * 2 * np.pi
+                self.omega_list = [self.omega]
+                self.println("Starting with driving frequency: " + message + " Hz")
+                break
+            elif(message == "Terminate"):
+                self.println("Terminate the process.")
+                self.cart_reset()
+                return
+            elif("," in message and message.count(",") < FREQ_SIZE \
+                and all(self.is_float(i) for i in message.split(","))):
+                self.omega_list = [2 * np.pi * self.to_float(i) for i in message.split(",")]
+                self.println("Starting with these frequencies (in Hz): " + \
+                    "".join("%.4f " % (i / 2 / np.pi) for i in self.omega_list if i != 0))
+                break
+            else:
+                self.println("Invalid input, please try again.")
+        while(True):
+            self.println("Current amplitude: %.1f steps." % self.amp_0,
+                         "Type in the amplitude for the following sinusoidal oscillation, in steps:")
+            message = self.read_msg()
+            if(self.is_float(message)):
+                self.amp_0 = self.to_float(message)
+                self.println("Starting with amplitude: %.1f steps." % self.amp_0)
+                break
+            elif(message == "Terminate"):
+                self.println("Terminate the process.")
+                self.cart_reset()
+                return
+            else:
+                self.println("Invalid input, please try again.")
+        omega_list = np.array(self.omega_list)
+        drive = lambda t: self.amp_0 * np.sum(np.sin(omega_list * t)) \
+            + self.amp * math.sin(self.omega * t + self.phase)
+        while(True):
+            if(self.advance(self.sample_div, drive)):
+                self.cart_reset()
+                return
+            if(self.debug):
+                self.print_sample("DEBUG: in middle of loop() after checking switches")
+            self.print_sample("%.3f,%.4f,%.2f" % (self.clock, self.read_angle(), round(self.position)))
+            if(self.available()):
+                self.NR_receive(self.read_ready_msg())
+
+    def NR_receive(self, message):
+        '''Reads "amp,phase", other messages are ignored'''
+        if(message.count(",") != 1):
+            return
+        amp, phase = message.split(",")
+        self.amp = self.to_float(amp)
+        self.phase = self.to_float(phase)
+
+    def pid_print(self):
+        Kp, Ki, Kd, Kp_pos, Ki_pos, Kd_pos = self.pid_param
+        self.println("Current parameters are:",
+                     "Angle PID control: Kp = %.4f Ki = %.4f Kd = %.4f" % (Kp, Ki, Kd),
+                     "Cart PID control: Kp_pos = %.4f Ki_pos = %.4f Kd_pos = %.4f" % (Kp_pos, Ki_pos, Kd_pos))
+
+    def pid(self):
+        '''pid() of the sketch without the swing-up, the control runs every LOOP_TIME'''
+        while(True):
+            self.println("Do you want to turn up swing up strategy? type in (y/n)")
+            message = self.read_msg()
+            if(message == "y" or message == "n"):
+                self.println("Continue with swing-up strategy." if message == "y" \
+                    else "Continue without swing-up strategy.")
+                self.delay(0.5)
+                break
+            elif(message == "Terminate"):
+                self.println("Terminate the process.")
+                self.cart_reset()
+                return
+            else:
+                self.delay(0.5)
+                self.println("Invalid command, please try again.")
+                self.delay(0.5)
+        while(True):
+            self.pid_print()
+            self.println("",
+                         "Resume (ENTER r) or ENTER six numbers split by commas without spaces",
+                         "For example: 600,400,2.5,-0.05,0,-0.01",
+                         "In this order:Kp_ang,Ki_ang,Kd_ang,Kp_pos,Ki_pos,Kd_pos",
+                         "[Scroll up to see previous values]",
+                         "Before press ENTER, make sure the pendulum is stable at either the down or upright position!")
+            message = self.read_msg()
+            values = message.split(",")
+            if(message == "r" or (len(values) == 6 and all(self.is_float(i, True) for i in values))):
+                if(message != "r"):
+                    self.pid_param = [self.to_float(i) for i in values]
+                self.pid_print()
+                self.println("Start inversion control.")
+                self.delay(0.05)
+                break
+            elif(message == "Terminate"):
+                self.println("Terminate the process.")
+                self.cart_reset()
+                return
+            else:
+                self.delay(0.5)
+                self.println("Invalid input, please Try Again")
+                self.delay(0.5)
+        Kp, Ki, Kd, Kp_pos, Ki_pos, Kd_pos = self.pid_param
+        angle_eq = self.read_angle()
+        history = [] # (time, angle deviation, position) of the last 100 loops for the integrals
+        next_sample = self.clock
+        while(True):
+            if(self.advance(LOOP_TIME)):
+                self.cart_reset()
+                return
+            deviation = self.read_angle() - angle_eq
+            history = history[-99:] + [(self.clock, deviation, self.position)]
+            integrals = np.zeros(2)
+            if(len(history) == 100):
+                samples = np.array(history)
+                integrals = np.sum(samples[1:, 1:] * np.diff(samples[:, 0])[:, None], axis = 0) \
+                    / (samples[-1, 0] - samples[0, 0])
+            if(self.clock >= next_sample):
+                next_sample += self.sample_div
+                self.print_sample("%.5f,%.4f,%.1f,%.4f,%.4f" % (self.clock, deviation, round(self.position),
+                                                              self.angular_velocity, self.velocity))
+            steps = int(Kp * deviation + Ki * integrals[0] + Kd * self.angular_velocity \
+                - Kp_pos * self.position - Ki_pos * integrals[1] - Kd_pos * self.velocity)
+            self.target = self.position + steps
+            if(self.target <= - int(self.distance / 2) + SAFE_STEPS \
+                or self.target >= int(self.distance / 2) - SAFE_STEPS):
+                self.cart_reset()
+                return
@@ -3,7 +3,7 @@ import matplotlib as mpl, matplotlib.pyplot as plt
 import time, os, threading, csv
 from datetime import datetime
 # import modules from other python files
-from data_process import data, live_data
+from data_process import data, live_data, HEADLESS
 from arduino_manager import arduino
 from moment_data_process import data_frame
 from Pendulum_Control_Console import cart_pendulum
@@ -11,7 +11,7 @@ plt.rcParams['axes.grid'] = True
 plt.rcParams["figure.autolayout"] = True
 prop_cycle = plt.rcParams['axes.prop_cycle']
 colors = prop_cycle.by_key()['color']
-mpl.use('TkAgg')
+mpl.use('Agg' if HEADLESS else 'TkAgg')
 # Initialisation of some constants and variables
 port = 'COM6' 
 baudrate = 230400
@@ -22,16 +22,25 @@ if(__name__ == "__main__"):
     fft_lengths = 1024
     sampling_divs = 0.04
     wait_to_stables = 1
+    batch_reads = False
+    lock_ins = False
+    record_sessions = False
+    latencies = False
+    snapshot_periods = None
+    simulate_boards = None
+    acquisitions = False
     #  Initialisation of the arduino board and the data class
-    arduino_board = arduino(port, baudrate)
+    arduino_board = arduino(port, baudrate, simulate = simulate_boards, acquisition = acquisitions)
     df = data_frame()
     datum = data(fft_length = fft_lengths, 
                 sampling_div = sampling_divs, 
                 wait_to_stable = wait_to_stables)
     temp_datum = live_data(fft_length = fft_lengths, 
                 sampling_div = sampling_divs, 
-                wait_to_stable = wait_to_stables) # variable for thread plotting
-    cartER = cart_pendulum(arduino_board, datum, temp_datum, df)
+                wait_to_stable = wait_to_stables,
+                snapshot_period = snapshot_periods) # variable for thread plotting
+    cartER = cart_pendulum(arduino_board, datum, temp_datum, df, batch_read = batch_reads,
+                           lock_in = lock_ins, record = record_sessions, latency = latencies)
     
     cartER.path = os.getcwd()
     
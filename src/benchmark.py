@@ -0,0 +1,206 @@
+'''Benchmarks of the hot paths of the live processing (data_process), the export and
+the analysis (final_data_analysis/csv_process) on synthetic pendulum runs, for
+several buffer and fft lengths. The results are saved as json, so two commits can
+be compared by running the same command on both.
+
+python benchmark.py [--output benchmark.json] [--repeat 5] [--quick]'''
+import os, sys
+os.environ.setdefault('PENDULUM_HEADLESS', '1') # no window for the figures
+import numpy as np
+import time, json, argparse, platform, subprocess, tempfile, shutil, contextlib, io, glob
+import matplotlib.pyplot as plt
+from data_process import data
+from moment_data_process import data_frame
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'final_data_analysis'))
+from csv_process import data_analysis
+
+SAMPLING_DIV = 0.05 # sampling division of the board, in seconds
+OMEGA = 1. # driving frequency in Hz
+AMP_0 = 50. # driving amplitude in steps
+NUM_FREQ = 10 # number of frequencies of the multiple frequency benchmarks
+BUFFER_LENGTHS = (8192, 4 * 8192)
+FFT_LENGTHS = (256, 512, 1024)
+
+def synthetic_run(num_samples, omega_list = (OMEGA,), seed = 0):
+    '''Samples of a driven pendulum as printed by the board, one row per sample with
+    the columns time, angle, position, angular_velocity and cart_velocity. The time
+    starts at 1000 s, the samples are up to 2 ms later than the sampling division
+    as on the board.'''
+    rng = np.random.default_rng(seed)
+    time = 1000. + np.cumsum(SAMPLING_DIV + rng.uniform(0., 2e-3, num_samples))
+    samples = np.zeros((num_samples, 5))
+    samples[:, 0] = time
+    for omega in omega_list:
+        phase = 2 * np.pi * omega * time
+        samples[:, 1] += 0.3 * np.sin(phase - 0.7) / len(omega_list)
+        samples[:, 2] += AMP_0 * np.sin(phase)
+    samples[:, 1] = np.round(samples[:, 1] + rng.normal(0, 1e-3, num_samples), 4)
+    samples[:, 2] = np.round(samples[:, 2])
+    return samples
+
+def time_call(function, repeat, number = 1):
+    '''Seconds per call of function(), the statistics over repeat runs of number calls'''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {"min_s": min(times), "median_s": float(np.median(times)), "mean_s": float(np.mean(times)),
+            "repeat": repeat, "number": number}
+
+def filled_data(buffer_length, fft_length, samples, omega_list = None, scan = False):
+    '''Headless data class holding the samples, as during a NR run or a freq_scan'''
+    datum = data(fft_length, SAMPLING_DIV, headless = True, buffer_length = buffer_length)
+    datum.omega = OMEGA
+    datum.amp_0 = AMP_0
+    if(omega_list is not None):
+        datum.omega_list = np.asarray(omega_list)
+        datum.omega_num = len(omega_list)
+        datum.omega = omega_list[-1]
+    datum.init_phase_lists(scan)
+    df = data_frame()
+    df.block = samples[:, :3]
+    df.update_data(samples[-1])
+    datum.append_block(df)
+    datum.update_reference(active = not scan)
+    return datum
+
+class benchmark():
+
+    '''Runs the benchmarks and collects the results'''
+
+    def __init__(self, repeat = 5, quick = False):
+        self.repeat = repeat
+        self.buffer_lengths = BUFFER_LENGTHS[:1] if quick else BUFFER_LENGTHS
+        self.fft_lengths = FFT_LENGTHS[:2] if quick else FFT_LENGTHS
+        self.results = []
+        self.dirc = tempfile.mkdtemp()
+
+    def add(self, name, params, function, number = 1):
+        result = {"name": name, "params": params}
+        result.update(time_call(function, self.repeat, number))
+        self.results.append(result)
+        print("%-28s %-44s %10.1f us" % (name, json.dumps(params), 1e6 * result["median_s"]))
+
+    def live(self, buffer_length, fft_length):
+        '''append_data and the computations of the NR and freq_scan main loops'''
+        params = {"buffer_length": buffer_length, "fft_length": fft_length}
+        samples = synthetic_run(buffer_length)
+        # append_data one sample at a time, into a buffer filled up to the end
+        datum = filled_data(buffer_length, fft_length, samples[:-1000])
+        df = data_frame()
+        rows = iter(samples[-1000:])
+        def append():
+            df.update_data(next(rows))
+            datum.append_data(df)
+        self.add("append_data", params, append, number = 1000 // self.repeat)
+        datum = filled_data(buffer_length, fft_length, samples)
+        self.add("fft_index_list", params, datum.fft_index_list, number = 20)
+        self.add("fft", params, datum.fft, number = 20)
+        self.add("NR_phase_calc", params, lambda: datum.NR_phase_calc(OMEGA, False), number = 20)
+        self.add("NR_update", params, lambda: datum.NR_update(False, True, False), number = 20)
+        scan = filled_data(buffer_length, fft_length, samples, scan = True)
+        plot_slice = scan.buffer.latest_slice(scan.plot_length)
+        scan.delay_fit(plot_slice)
+        def delay_fit():
+            # one new sample since the last call, as in the live loop
+            scan.delay_index -= 1
+            scan.delay_fit(plot_slice)
+        self.add("delay_fit", params, delay_fit, number = 20)
+        omega_list = list(np.linspace(0.8, 1.2, NUM_FREQ))
+        multi = filled_data(buffer_length, fft_length, synthetic_run(buffer_length, omega_list),
+                            omega_list = omega_list, scan = True)
+        self.add("NR_update_multi", dict(params, num_freq = NUM_FREQ),
+                 lambda: multi.NR_update(True, True), number = 20)
+
+    def export(self, buffer_length):
+        '''export_csv of a full buffer, returns the csv file name'''
+        params = {"buffer_length": buffer_length}
+        datum = filled_data(buffer_length, 512, synthetic_run(buffer_length), scan = True)
+        datum.path = os.path.join(self.dirc, 'export')
+        def export():
+            with contextlib.redirect_stdout(io.StringIO()):
+                datum.export_csv("freq_scan", input_spec_info = False)
+        self.add("export_csv", params, export)
+        paths = [i for i in glob.glob(os.path.join(self.dirc, '**', '*.csv'), recursive = True) \
+            if 'freq_scan-' in os.path.basename(i) and 'fft' not in os.path.basename(i)]
+        # the csv folder is joined with '\\' as in csv_process, on any system
+        return sorted(paths)[-1].rsplit('\\', 1)
+
+    def analysis(self, buffer_length, csv_dir, file_name):
+        '''csv_process on the exported file, csv and binary copy'''
+        params = {"buffer_length": buffer_length}
+        analysis = data_analysis()
+        analysis.interactive = False
+        analysis.dirc = csv_dir
+        basename = os.path.splitext(csv_dir + '\\' + file_name)[0]
+        self.add("read_csv_binary", params, lambda: analysis.read_csv(file_name))
+        os.rename(basename + '.json', basename + '.json.off')
+        self.add("read_csv_text", params, lambda: analysis.read_csv(file_name))
+        os.rename(basename + '.json.off', basename + '.json')
+        analysis.read_csv(file_name)
+        original = analysis.data.copy()
+        def clean_data():
+            analysis.data = original.copy()
+            analysis.clean_data(file_name)
+        self.add("clean_data", params, clean_data)
+        analysis.data = original.copy()
+        analysis.temp_data = analysis.clean_data(file_name)
+        analysis.properties['omega'] = str(OMEGA)
+        analysis.sampling_div = SAMPLING_DIV
+        analysis.fft_length = 512
+        figure, axes = plt.subplots(1, 2)
+        analysis.ax0 = axes[0].twinx()
+        def scan_fft_plot():
+            analysis.phase_list = []
+            analysis.scan_fft_plot(axes)
+        self.add("scan_fft_plot", dict(params, fft_length = 512), scan_fft_plot)
+        plt.close(figure)
+        time, angle = analysis.temp_data[0], analysis.temp_data[1]
+        def scan_fit():
+            with contextlib.redirect_stdout(io.StringIO()): # report_fit() prints every fit
+                analysis.scan_fit(time, angle, (0, np.max(abs(angle)) + 0.3))
+        self.add("scan_fit", params, scan_fit)
+
+    def run(self):
+        try:
+            for buffer_length in self.buffer_lengths:
+                for fft_length in self.fft_lengths:
+                    self.live(buffer_length, fft_length)
+                csv_dir, file_name = self.export(buffer_length)
+                self.analysis(buffer_length, csv_dir, file_name)
+                shutil.rmtree(self.dirc)
+                self.dirc = tempfile.mkdtemp()
+        finally:
+            shutil.rmtree(self.dirc, ignore_errors = True)
+
+    def summary(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True,
+                                    text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except OSError:
+            commit = ""
+        return {
+            "commit": commit,
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "repeat": self.repeat,
+            "results": self.results,
+        }
+
+if(__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description = "Benchmarks of the live processing and the analysis")
+    parser.add_argument("--output", default = "benchmark.json", help = "json file of the results")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--quick", action = "store_true", help = "smallest buffer and fft lengths only")
+    args = parser.parse_args()
+
+    bench = benchmark(repeat = args.repeat, quick = args.quick)
+    bench.run()
+    with open(args.output, 'w') as file:
+        json.dump(bench.summary(), file, indent = 1)
+        file.close()
+    print("\nSaved to " + args.output)
@@ -4,18 +4,27 @@ import matplotlib.pyplot as plt
 import time, os, csv
 from datetime import datetime
 from scipy.fft import fft, fftfreq
-from scipy.optimize import curve_fit
+from ring_buffer import ring_buffer
+from session_log import session_log
+from run_format import save_run
+from signal_process import uniform_index_list, lock_in, rectify_phase, interpolated_phase, sine_fit
 plt.rcParams['axes.grid'] = True
 plt.rcParams["figure.autolayout"] = True
 prop_cycle = plt.rcParams['axes.prop_cycle']
 colors = prop_cycle.by_key()['color']
-mpl.use('TkAgg')
+# Set PENDULUM_HEADLESS=1 to run without any window, e.g. for unattended scans
+HEADLESS = os.environ.get('PENDULUM_HEADLESS', '0') == '1'
+mpl.use('Agg' if HEADLESS else 'TkAgg')
 
 # Initialisation of some constants and variables
 port = 'COM6' 
 baudrate = 230400 
 MAX_COUNT = 10 # Number of points waited to plot a frame
 ANGLE_ROTATION = 55 # Rotation of the y-label
+AUTOSCALE_HEADROOM = 0.2 # Extra room left when rescaling, so the axes are not rescaled every frame
+HEADLESS_FRAME_TIME = 0.1 # Pace of the main loop in headless mode, drawing paces it otherwise
+# Columns of the ring buffer, the first five are the recorded data
+BUFFER_FIELDS = ('time', 'angle', 'position', 'angular_velocity', 'position_velocity', 'pos_const', 'pos_active')
 
 class data_phy():
     '''Put all the physics in this class so that people can look at it'''
@@ -30,11 +39,8 @@ class data_phy():
         self.start_time = 0. # Arduino internal time might not start at zero
         self.sampling_div = sampling_div
         self.avg_spacing = 0. # Average time spacing between the data points
-        self.time = np.zeros(2 * buffer_length)
-        self.angle = np.zeros(2 * buffer_length)
-        self.angular_velocity = np.zeros(2 * buffer_length)
-        self.position = np.zeros(2 * buffer_length)
-        self.position_velocity = np.zeros(2 * buffer_length)
+        # Circular buffer of all the columns, the latest plot_length * 8 points can be viewed directly
+        self.link_buffer(ring_buffer(buffer_length, BUFFER_FIELDS, window = plot_length * 8))
         self.omega = 2. # driven frequency in Hz
         self.amp = 100. # amplitude of the active driven force
         self.amp_0 = 50.0 # This is used to characterise the constant oscillation
@@ -67,35 +73,33 @@ class data_phy():
         self.pos_active = None
         self.setSpeed_param = None
         self.phase_list_active = None
+        self.flag_lock_in = False # whether the reader thread updates a sliding lock-in
+        self.lock_in = None
+        self.delay_fitter = None # incremental fit used by delay_fit()
+        self.delay_index = 0 # number of samples already given to the delay_fitter
+        self.reference_index = 0 # number of samples with the reference waveforms filled
+    
+    def link_buffer(self, buffer):
+        '''Uses the given ring_buffer and exposes its rows as the data arrays,
+        the arrays are indexed by the slots of the buffer'''
+        self.buffer = buffer
+        self.time = buffer['time']
+        self.angle = buffer['angle']
+        self.angular_velocity = buffer['angular_velocity']
+        self.position = buffer['position']
+        self.position_velocity = buffer['position_velocity']
   
     def fft_index_list(self):
         '''Since the sampled data might not be evenly spaced, we need to find the
         almost evenly spaced data points (spacing indicated by self.sampling_div) 
         to do the fft. This function returns the a list of indices and the average 
         spacing between the data points.'''
-        current_time = self.time[self.temp_index + self.buffer_length]
-        # Use time_stamp to keep track of the previous recorded time and its index
-        time_stamp = current_time
-        index = self.fft_length - 2
-        index_list = np.zeros(self.fft_length, dtype = int)
-        index_list[self.fft_length - 1] = current_time # The last element is the current time, choose as default
-        
-        # Search for data points that are at least self.sampling_div apart
-        for i in range(self.temp_index + self.buffer_length, self.temp_index + 1, -1):
-            if index < 0: 
-                self.index_list = index_list
-                # Calculate the average spacing between the data points, since the data points might 
-                # not be evenly spaced
-                avg_spacing = (current_time - time_stamp) / (self.fft_length - index - 2)
-                return self.index_list, avg_spacing
-            if(time_stamp - self.time[i] >= self.sampling_div):
-                index_list[index] = i
-                time_stamp = self.time[i]
-                index -= 1
-        if index >= 0:
-            avg_spacing = (current_time - time_stamp) / (self.fft_length - index - 2)
-            self.index_list = index_list[index + 1 : self.fft_length]
-            return self.index_list, avg_spacing
+        # self.index is the snapshot taken by live_data.copy(), the reader thread
+        # might have appended more samples to the shared buffer since then
+        time = self.buffer.unroll('time', self.index)
+        index_list, avg_spacing = uniform_index_list(time, self.fft_length, self.sampling_div)
+        self.index_list = self.buffer.physical(index_list, self.index)
+        return self.index_list, avg_spacing
     
     def fft(self):
         '''Does the fft when there are enough data points. Returns True if the fft
@@ -128,8 +132,12 @@ class data_phy():
     def NR_phase_calc(self, omega, scan, interpolation = True):
         '''Calculates the phase with linear interpolation since the desired frequency
         might not be in the fft_freq array. Returns True if the phase is calculated,
-        False otherwise.'''
-        if (self.fft()):
+        False otherwise. With the sliding lock-in running, the phase is read from it
+        directly at omega without any fft.'''
+        if(self.lock_in is not None):
+            if(not self.lock_in_phase(omega, scan)):
+                return False
+        elif (self.fft()):
             close_ind = np.argmin(np.abs(self.fft_freq - omega))
             if(not scan):
                 if interpolation:
@@ -185,11 +193,6 @@ class data_phy():
                         - np.angle(self.fft_pos_const[close_ind]) + np.pi)
                     self.phase_active = self.phase_rectify(np.angle(self.fft_pos_active[close_ind]) \
                         - np.angle(self.fft_pos_const[close_ind]) + np.pi)
-                self.phase_list.pop(0)
-                self.phase_list.append((self.time[self.temp_index], self.phase / np.pi))
-                self.phase_list_active.pop(0)
-                self.phase_list_active.append((self.time[self.temp_index], self.phase_active / np.pi))
-                return True
             else:
                 if interpolation:
                     if self.fft_freq[close_ind] < omega:
@@ -220,12 +223,47 @@ class data_phy():
                 else:
                     self.phase = self.phase_rectify(np.angle(self.fft_angle[close_ind]) \
                         - np.angle(self.fft_pos[close_ind]) + np.pi)
-                if(self.omega_list is None):
-                    self.phase_list.pop(0)
-                    self.phase_list.append((self.time[self.temp_index], self.phase / np.pi))
-                return True
         else:
             return False
+        if(not scan):
+            self.phase_list.pop(0)
+            self.phase_list.append((self.time[self.temp_index], self.phase / np.pi))
+            self.phase_list_active.pop(0)
+            self.phase_list_active.append((self.time[self.temp_index], self.phase_active / np.pi))
+        elif(self.omega_list is None):
+            self.phase_list.pop(0)
+            self.phase_list.append((self.time[self.temp_index], self.phase / np.pi))
+        return True
+    
+    def init_lock_in(self):
+        '''Starts the sliding lock-in at the driving frequencies, over the same time
+        window as the fft. The channels are angle, position and pos_const.'''
+        if(self.omega_list is None):
+            freq = self.omega
+        else:
+            freq = self.omega_list
+        self.lock_in = lock_in(freq, self.fft_length * self.sampling_div, 
+                               num_channel = 3, length = self.buffer_length)
+    
+    def update_lock_in(self, time, angle, position):
+        '''Feeds new samples (time relative to start_time) to the sliding lock-in'''
+        pos_const = self.amp_0 * np.sin(2 * np.pi * self.omega * (time + self.start_time))
+        self.lock_in.update(time, np.column_stack((angle, position, pos_const)))
+    
+    def lock_in_phase(self, omega, scan):
+        '''Reads the phase at omega from the sliding lock-in, same convention as
+        the fft phase. Returns True if there are enough data points.'''
+        if(self.time[self.temp_index] <= 5 * self.sampling_div):
+            return False
+        column = np.argmin(np.abs(self.lock_in.freq - omega))
+        angle, position, pos_const = self.lock_in.spectrum()[:, column]
+        if(not scan):
+            self.phase = self.phase_rectify(np.angle(angle) - np.angle(pos_const) + np.pi)
+            self.phase_active = self.phase_rectify(np.angle(position - pos_const) \
+                - np.angle(pos_const) + np.pi)
+        else:
+            self.phase = self.phase_rectify(np.angle(angle) - np.angle(position) + np.pi)
+        return True
         
     def NR_update(self, scan = False, interpolation = True, manual = True):
         '''Calculates multiple phases at this function, or returns the amp and 
@@ -256,12 +294,33 @@ class data_phy():
             else:
                 return 0, 0
         else:
-            for index, omega in enumerate(self.omega_list):
-                if(self.NR_phase_calc(omega, interpolation)):
+            # All the frequencies are extracted from a single set of spectra
+            phases = self.multi_phase_calc(interpolation)
+            if(phases is not None):
+                for index, phase in enumerate(phases):
                     self.multi_phase_list[index].pop(0)
-                    self.multi_phase_list[index].append((self.time[self.temp_index], self.phase / np.pi))
+                    self.multi_phase_list[index].append((self.time[self.temp_index], phase / np.pi))
+                self.phase = phases[-1]
             return 0., 0.
     
+    def multi_phase_calc(self, interpolation = True):
+        '''Calculates the scan phases at every frequency in omega_list in one go,
+        either from the sliding lock-in or from one fft of the window. Returns None
+        if there are not enough data points.'''
+        if(self.lock_in is not None):
+            if(self.time[self.temp_index] <= 5 * self.sampling_div):
+                return None
+            spectrum = self.lock_in.spectrum()
+            columns = np.argmin(np.abs(self.lock_in.freq[None, :] - \
+                np.asarray(self.omega_list)[:, None]), axis = 1)
+            return rectify_phase(np.angle(spectrum[0, columns]) - \
+                np.angle(spectrum[1, columns]) + np.pi)
+        elif(self.fft()):
+            return interpolated_phase(self.fft_freq, self.fft_angle, self.fft_pos, 
+                                      self.omega_list, interpolation)
+        else:
+            return None
+    
     def phase_rectify(self, phase):
         '''Shifts the phase to be between 0.5 * pi and -1.5*pi, which is symmetric abour -0.5*pi'''
         phase = phase - 2 * np.pi * int(phase / (2 * np.pi))
@@ -272,23 +331,43 @@ class data_phy():
         else:
             return phase
     
-    def delay_fit(self, low, high):
-        '''Find the delay time between the two waves in the freq_scan module'''
-        delay_time = 0.
-        
-        def delay_func(time, delay):
-            return self.amp_0 * np.sin(2 * np.pi * self.omega * (time + self.start_time + delay))
-        
-        popt, pcov = curve_fit(delay_func, 
-                               self.time[low : high], 
-                               self.position[low : high],
-                               p0 = 0.007,
-                               maxfev = 20000)
+    def update_reference(self, active = True):
+        '''Fills the pos_const (and pos_active) columns of the buffer for the samples
+        appended since the last call only, then exposes them as self.pos_const and
+        self.pos_active. They share the slots of the other columns, so fft() picks
+        them with the same index_list.'''
+        end = self.buffer.index # the reader thread writes the data before the index
+        if(end < self.reference_index):
+            self.reference_index = 0
+        start = max(self.reference_index, end - self.buffer.length)
+        if(end > start):
+            slots = np.arange(start, end) % self.buffer.length
+            pos_const = self.amp_0 * np.sin(2 * np.pi * self.omega * \
+                (self.time[slots] + self.start_time))
+            self.buffer.write('pos_const', slots, pos_const)
+            self.buffer.write('pos_active', slots, self.position[slots] - pos_const)
+            self.reference_index = end
+        self.pos_const = self.buffer['pos_const']
+        if(active):
+            self.pos_active = self.buffer['pos_active']
+    
+    def delay_fit(self, plot_slice):
+        '''Find the delay time between the two waves in the freq_scan module, plot_slice
+        is the slice of the buffer being plotted. The linear sin/cos fit only takes
+        the samples that arrived since the last call.'''
+        time = self.time[plot_slice]
+        position = self.position[plot_slice]
+        new = self.index - self.delay_index
+        if(self.delay_fitter is None or self.delay_fitter.omega != self.omega \
+            or new < 0 or new >= len(time)):
+            self.delay_fitter = sine_fit(self.omega, 8 * self.plot_length)
+            new = len(time)
+        if(new > 0):
+            self.delay_fitter.update(time[-new:] + self.start_time, position[-new:])
+        self.delay_index = self.index
         # the idea here is that the proposed position of the cart at this moment 
         # is the position of the cart at the next moment
-        delay_time = popt[0]
-        delay_error = np.sqrt(np.diag(pcov))[0]
-        return delay_time, delay_error
+        return self.delay_fitter.delay(len(time))
     
 class data(data_phy):
     
@@ -302,8 +381,14 @@ class data(data_phy):
         wait_to_stable = 1,
         buffer_length = 4 * 8192,
         plot_length = 64,
+        headless = HEADLESS, # compute everything without figures
+        snapshot_period = None, # seconds between PNG snapshots in headless mode, None for no figure
         ):
         super().__init__(fft_length, sampling_div, wait_to_stable, buffer_length, plot_length)
+        self.headless = headless
+        self.snapshot_period = snapshot_period
+        self.snapshot_time = 0.
+        self.session = None
     
     def append_data(
         self,
@@ -315,29 +400,74 @@ class data(data_phy):
         if(self.index == 0):
             self.start_time = data_frame.time
             self.sys_start_time = time.time()
-        temp_index = self.index % self.buffer_length
-        self.time[temp_index] = data_frame.time - self.start_time
-        self.time[temp_index + self.buffer_length] = data_frame.time - self.start_time
-        self.angle[temp_index] = data_frame.angle
-        self.angle[temp_index + self.buffer_length] = data_frame.angle
+        values = [data_frame.time - self.start_time, data_frame.angle]
+        fields = ['time', 'angle']
         if(appendPos):
-            self.position[temp_index] = data_frame.position
-            self.position[temp_index + self.buffer_length] = data_frame.position
+            values.append(data_frame.position)
+            fields.append('position')
         if(appendVel):
-            self.angular_velocity[temp_index] = data_frame.angular_velocity
-            self.angular_velocity[temp_index + self.buffer_length] = data_frame.angular_velocity
-            self.position_velocity[temp_index] = data_frame.position_velocity
-            self.position_velocity[temp_index + self.buffer_length] = data_frame.position_velocity
-        self.index += 1
-        self.temp_index = temp_index
+            values += [data_frame.angular_velocity, data_frame.position_velocity]
+            fields += ['angular_velocity', 'position_velocity']
+        self.buffer.append(values, fields)
+        self.index = self.buffer.index
+        self.temp_index = self.buffer.temp_index
+        if(self.session is not None):
+            row = np.zeros(5)
+            row[self.buffer.rows(fields)] = values
+            self.session.write(row)
+        if(self.flag_lock_in and appendPos):
+            if(self.lock_in is None):
+                self.init_lock_in()
+            self.update_lock_in(values[0], values[1], values[2])
+
+    def append_block(
+        self,
+        data_frame,
+        appendPos = True,
+        appendVel = False
+    ):
+        '''Appends a whole block of samples parsed by data_frame.update_block()
+        to the circular buffer with vectorised writes'''
+        block = data_frame.block
+        if(len(block) == 0):
+            return
+        if(self.index == 0):
+            self.start_time = block[0, 0]
+            self.sys_start_time = time.time()
+        # The block columns follow the order of the buffer fields
+        values = block.copy()
+        values[:, 0] -= self.start_time
+        self.buffer.extend(values, self.buffer.fields[:values.shape[1]])
+        self.index = self.buffer.index
+        self.temp_index = self.buffer.temp_index
+        if(self.session is not None):
+            self.session.write(np.pad(values, ((0, 0), (0, 5 - values.shape[1]))))
+        if(self.flag_lock_in and appendPos):
+            if(self.lock_in is None):
+                self.init_lock_in()
+            self.update_lock_in(values[:, 0], values[:, 1], values[:, 2])
+
+    def open_session(self, module_name):
+        '''Starts streaming the samples to a csv file with the layout of export_csv(),
+        so a run is kept if the program stops and is not limited by the buffer length.
+        export_csv() then only closes the file.'''
+        dirc = self.path + '\\' + datetime.now().strftime("%d-%m-csv")
+        try:
+            os.makedirs(dirc)
+        except OSError:
+            pass
+        filename = dirc + '\\' + module_name + datetime.now().strftime("-%H-%M-%S") + '.csv'
+        # csv_process expects the samples from the 7th row on (9th for pid), the rows
+        # not known yet are left blank
+        num_header = 8 if module_name == "pid" else 6
+        self.session = session_log(filename, self.csv_header(module_name, ""), num_header)
     
     def clear_data(self):
         '''Clears the data in the circular buffer, standard routine'''
-        self.time = np.zeros(2 * self.buffer_length)
-        self.angle = np.zeros(2 * self.buffer_length)
-        self.angular_velocity = np.zeros(2 * self.buffer_length)
-        self.position = np.zeros(2 * self.buffer_length)
-        self.position_velocity = np.zeros(2 * self.buffer_length)
+        if(self.session is not None):
+            self.session.close()
+        self.session = None
+        self.link_buffer(ring_buffer(self.buffer_length, BUFFER_FIELDS, window = self.plot_length * 8))
         self.index = 0
         self.temp_index = 0
         self.counter = 0
@@ -358,6 +488,11 @@ class data(data_phy):
         self.pos_active = None
         self.setSpeed_param = None
         self.phase_list_active = None
+        self.flag_lock_in = False
+        self.lock_in = None
+        self.delay_fitter = None
+        self.delay_index = 0
+        self.reference_index = 0
         
     def clear_figure(self):
         '''Clears the figure, standard routine'''
@@ -366,11 +501,31 @@ class data(data_phy):
         self.flag_subplot_init = True
         self.flag_close_event = False
     
+    def init_phase_lists(self, scan):
+        '''Initialises the phase and amplitude histories of the NR and freq_scan modules'''
+        if(self.omega_list is None):
+            self.phase_list = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
+        else: 
+            self.phase_list = None
+            self.multi_phase_list = []
+            for i in range(self.omega_num):
+                self.multi_phase_list.append([(0., 0.)] * self.plot_length* (self.wait_to_stable + 1) * 10)
+        self.amp_list = [(0., 0.)] * self.plot_length * 10
+        if(not scan):
+            self.phase_list_active = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
+    
     def init_plot(self, module_name, scan = True):
         '''Initialises the plot in terms of different stages'''
         if(self.flag_fig_init):
             self.flag_fig_init = False
-            plt.ion() # Turn on interactive mode, important for the non-blocking plot
+            if(self.headless and self.snapshot_period is None):
+                # No figure at all, only the histories used by the computations
+                if(self.flag_subplot_init and module_name in ("NR", "freq_scan", "auto_freq_scan")):
+                    self.init_phase_lists(scan)
+                self.flag_subplot_init = False
+                return
+            if(not self.headless):
+                plt.ion() # Turn on interactive mode, important for the non-blocking plot
             if(module_name == "measure"):
                 if(self.flag_subplot_init):
                     self.figure, self.ax_list = plt.subplots(1, 2, figsize = (8, 5))
@@ -388,22 +543,16 @@ class data(data_phy):
                 self.ax_list[1].set_xlabel('Frequency/Hz')
                 self.ax_list[1].set_xlim(0, self.omega)
                 self.ax_list[1].set_ylabel('Arbitrary Unit')
+                self.txt_rate = self.ax_list[1].text(0.5, 1.03, '', transform = self.ax_list[1].transAxes)
+                self.txt_res = self.ax_list[1].text(0.5, 1.12, '', transform = self.ax_list[1].transAxes)
+                self.fixed_x_axes = [self.ax_list[1]]
                 
             elif(module_name == "NR"):
                 if(self.flag_subplot_init):
                     self.figure, self.ax_list = plt.subplots(2, 2, figsize=(8, 5))
                     self.flag_subplot_init = False
                     self.figure.suptitle('NR')
-                    if(self.omega_list is None):
-                        self.phase_list = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
-                    else: 
-                        self.phase_list = None
-                        self.multi_phase_list = []
-                        for i in range(self.omega_num):
-                            self.multi_phase_list.append([(0., 0.)] * self.plot_length* (self.wait_to_stable + 1) * 10)
-                    self.amp_list = [(0., 0.)] * self.plot_length * 10
-                    if(not scan):
-                        self.phase_list_active = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
+                    self.init_phase_lists(scan)
                 self.line_angle, = self.ax_list[0, 0].plot([], [], 'b-')
                 self.line_pos, = self.ax_list[1, 0].plot([], [], 'r-')
                 self.line_pos_const, = self.ax_list[1, 0].plot([], [], 'g--')
@@ -463,22 +612,16 @@ class data(data_phy):
                 self.ax_list[1, 1].set_xlabel('Time/s')
                 self.ax_list[1, 1].set_ylabel('Phase/pi')
                 ax2.set_ylabel('Amplitude/steps')
+                self.txt_rate = self.ax_list[0, 1].text(0.5, 1.03, '', transform = self.ax_list[0, 1].transAxes)
+                self.txt_res = self.ax_list[0, 1].text(0.5, 1.12, '', transform = self.ax_list[0, 1].transAxes)
+                self.fixed_x_axes = [self.ax_list[0, 1], ax1]
             
             elif(module_name == "freq_scan" or module_name == "auto_freq_scan"):
                 if(self.flag_subplot_init):
                     self.figure, self.ax_list = plt.subplots(2, 2, figsize=(8, 5))
                     self.flag_subplot_init = False
                     self.figure.suptitle('NR')
-                    if(self.omega_list is None):
-                        self.phase_list = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
-                    else: 
-                        self.phase_list = None
-                        self.multi_phase_list = []
-                        for i in range(self.omega_num):
-                            self.multi_phase_list.append([(0., 0.)] * self.plot_length* (self.wait_to_stable + 1) * 10)
-                    self.amp_list = [(0., 0.)] * self.plot_length * 10
-                    if(not scan):
-                        self.phase_list_active = [(0., 0.)] * self.plot_length * (self.wait_to_stable + 1) * 10
+                    self.init_phase_lists(scan)
                 self.line_angle, = self.ax_list[0, 0].plot([], [], 'b-')
                 self.line_pos, = self.ax_list[1, 0].plot([], [], 'r-')
                 self.line_pos_const, = self.ax_list[1, 0].plot([], [], 'g--')
@@ -538,6 +681,9 @@ class data(data_phy):
                 self.ax_list[1, 1].set_xlabel('Time/s')
                 self.ax_list[1, 1].set_ylabel('Phase/pi')
                 ax2.set_ylabel('Amplitude/steps')
+                self.txt_rate = self.ax_list[0, 1].text(0.5, 1.03, '', transform = self.ax_list[0, 1].transAxes)
+                self.txt_res = self.ax_list[0, 1].text(0.5, 1.12, '', transform = self.ax_list[0, 1].transAxes)
+                self.fixed_x_axes = [self.ax_list[0, 1], ax1]
             
             elif(module_name == "pid"):
                 if(self.flag_subplot_init):
@@ -563,6 +709,9 @@ class data(data_phy):
                 self.ax_list[0, 1].set_ylabel('Angular Velocity/(rad/s)')
                 self.ax_list[1, 1].set_xlabel('Time/s')
                 self.ax_list[1, 1].set_ylabel('Cart Velocity/(steps/s)')
+                self.txt_rate = self.ax_list[0, 1].text(0.5, 1.05, '', transform = self.ax_list[0, 1].transAxes)
+                self.txt_res = None
+                self.fixed_x_axes = []
                 
             elif(module_name == "setSpeed"):
                 if(self.flag_subplot_init):
@@ -580,102 +729,195 @@ class data(data_phy):
                 self.ax_list[0].set_ylabel('Position/steps')
                 self.ax_list[1].set_xlabel('Time/s')
                 self.ax_list[1].set_ylabel('Cart Velocity/(steps/s)')
+                self.txt_rate = None
+                self.txt_res = None
+                self.fixed_x_axes = []
                 
             # Configure the events
             self.figure.canvas.mpl_connect('close_event', self.handle_close)
+            self.init_blit()
             self.figure.canvas.manager.set_window_title(module_name)
-            self.figure.canvas.draw_idle()
-            plt.tight_layout()
-            plt.show(block = False)
+            if(not self.headless):
+                self.figure.canvas.draw_idle()
+                plt.tight_layout()
+                plt.show(block = False)
 
+    def init_blit(self):
+        '''Marks the lines and texts as animated so that a frame only redraws them on
+        top of the cached background. The background is cached after every full
+        draw of the figure (first show, resizing, rescaling).'''
+        self.animated = []
+        for lines in self.ax_new_list.values():
+            if(isinstance(lines, (tuple, list))):
+                self.animated += list(lines)
+            else:
+                self.animated.append(lines)
+        self.animated += [txt for txt in (self.txt_rate, self.txt_res) if txt is not None]
+        for artist in self.animated:
+            artist.set_animated(True)
+        # The rotation also applies to the tick labels created later
+        for ax in self.ax_new_list:
+            ax.tick_params(axis = 'y', labelrotation = ANGLE_ROTATION)
+        self.background = None
+        self.flag_redraw = True
+        self.title = None
+        self.figure.canvas.mpl_connect('draw_event', self.cache_background)
+    
+    def cache_background(self, _):
+        '''Stores the figure without the animated artists, then draws them on top'''
+        if(self.figure.canvas.is_saving()):
+            return
+        self.background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self.animated:
+            self.figure.draw_artist(artist)
+    
+    def update_texts(self):
+        '''Updates the pre-created sampling rate and resolution texts'''
+        try:
+            if(self.txt_rate is not None):
+                self.txt_rate.set_text('sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz')
+            if(self.txt_res is not None):
+                self.txt_res.set_text('resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz')
+        except ZeroDivisionError:
+            pass
+    
+    def set_title(self, title):
+        '''Sets the suptitle, the background is only redrawn when it changes'''
+        if(title != self.title):
+            self.title = title
+            self.figure.suptitle(title)
+            self.flag_redraw = True
+    
+    def fix_xlim(self, ax, right):
+        '''Sets the x limits of an axis that is not autoscaled (the fft axes)'''
+        if(ax.get_xlim() != (0, right)):
+            ax.set_xlim(0, right)
+            self.flag_redraw = True
+    
+    def rescale(self, ax, lines):
+        '''Rescales the axis only when the data leave the current limits (or only fill
+        a small part of them), with some headroom so the next frames still fit.
+        Returns True if the limits are changed.'''
+        if(not isinstance(lines, (tuple, list))):
+            lines = [lines]
+        data = [np.asarray(line.get_data(), dtype = float) for line in lines]
+        data = [i for i in data if i.size > 0]
+        if(len(data) == 0):
+            return False
+        data = np.concatenate(data, axis = 1)
+        x_min, y_min = np.nanmin(data, axis = 1)
+        x_max, y_max = np.nanmax(data, axis = 1)
+        changed = False
+        if(ax not in self.fixed_x_axes):
+            low, high = ax.get_xlim()
+            if(x_min < low or x_max > high):
+                ax.set_xlim(x_min, x_max + AUTOSCALE_HEADROOM * max(x_max - x_min, 1e-3))
+                changed = True
+        low, high = ax.get_ylim()
+        margin = AUTOSCALE_HEADROOM * max(y_max - y_min, 1e-3)
+        if(y_min < low or y_max > high or 4 * (y_max - y_min + 2 * margin) < high - low):
+            ax.set_ylim(y_min - margin, y_max + margin)
+            changed = True
+        return changed
+    
+    def headless_update(self, module_name):
+        '''The computations of real_time_plot() without any figure, the phases and the
+        NR feedback are computed by the caller as usual'''
+        if(module_name == "measure"):
+            self.fft()
+        elif(module_name == "freq_scan" or module_name == "auto_freq_scan"):
+            self.update_reference(active = False)
+            self.fft()
+        elif(module_name == "NR"):
+            self.update_reference()
+            self.fft()
+        self.counter += 1
+    
+    def save_snapshot(self):
+        '''Saves the current figure as a PNG (overwritten every snapshot_period) in
+        headless mode'''
+        if(time.time() - self.snapshot_time < self.snapshot_period):
+            return
+        self.snapshot_time = time.time()
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            pass
+        self.figure.savefig(self.path + '\\' + self.module_name + '-snapshot.png')
+    
+    def blit_frame(self):
+        '''Shows the new frame. Only the animated artists are drawn onto the cached
+        background, unless the limits or the titles have changed.'''
+        canvas = self.figure.canvas
+        for ax, lines in self.ax_new_list.items():
+            if(self.rescale(ax, lines)):
+                self.flag_redraw = True
+        if(self.headless):
+            self.save_snapshot()
+            return
+        if(self.flag_redraw or self.background is None or not canvas.supports_blit):
+            self.flag_redraw = False
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            for artist in self.animated:
+                self.figure.draw_artist(artist)
+            canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+    
     def real_time_plot(self, module_name, scan = False):
         '''Plots the data in real time, non-blocking. Can be improved by combining the 
         similar parts in the if and else statements.'''
         self.module_name = module_name
+        if(self.headless):
+            time.sleep(HEADLESS_FRAME_TIME)
+            if(self.snapshot_period is None):
+                self.headless_update(module_name)
+                return
         if(module_name == "measure"):
             self.fft()
             if(self.index < self.plot_length * 8):
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.buffer_length + 1
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.index)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind], 
-                                        self.angle[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice], 
+                                        self.angle[plot_slice])
                     self.line_fft.set_data(self.fft_freq, 
                                          abs(self.fft_angle))
-                    try:
-                        txt1 = self.ax_list[1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                            transform = self.ax_list[1].transAxes)
-                        txt2 = self.ax_list[1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                            transform = self.ax_list[1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                            
-                    self.ax_list[1].set_xlim(0, 2 * self.omega)
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                    except UnboundLocalError:
-                        pass
+                    self.fix_xlim(self.ax_list[1], 2 * self.omega)
+                    self.blit_frame()
                         
                 self.counter += 1
                 
             else:
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.temp_index + 1 + self.buffer_length - self.plot_length * 8
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.plot_length * 8)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind], 
-                                        self.angle[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice], 
+                                        self.angle[plot_slice])
                     self.line_fft.set_data(self.fft_freq, 
                                          abs(self.fft_angle))
-                    try: 
-                        txt1 = self.ax_list[1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                            transform = self.ax_list[1].transAxes)
-                        txt2 = self.ax_list[1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                            transform = self.ax_list[1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                            
-                    self.ax_list[1].set_xlim(0, 2 * self.omega)
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                    except UnboundLocalError:
-                        pass
+                    self.fix_xlim(self.ax_list[1], 2 * self.omega)
+                    self.blit_frame()
                     
                 self.counter += 1
         
         elif(module_name == "freq_scan" or module_name == "auto_freq_scan"):
+            self.update_reference(active = False)
             self.fft()
-            self.pos_const = self.amp_0 * np.sin(2 * np.pi * \
-                self.omega * (self.time + self.start_time))
             delay_time, delay_error = 0., 0.
             if(self.index < self.plot_length):
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.buffer_length + 1
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.index)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
                     self.line_fft_ang.set_data(self.fft_freq, 
                                                 abs(self.fft_angle))
                     self.line_fft_pos.set_data(self.fft_freq,
@@ -683,9 +925,9 @@ class data(data_phy):
                     
                     if(self.omega_list is None):
                         if(self.index > 20 and scan):
-                            delay_time, delay_error = self.delay_fit(low_ind, high_ind)
-                        self.line_pos_const.set_data(self.time[low_ind:high_ind], 
-                                                     self.pos_const[low_ind:high_ind])
+                            delay_time, delay_error = self.delay_fit(plot_slice)
+                        self.line_pos_const.set_data(self.time[plot_slice], 
+                                                     self.pos_const[plot_slice])
                         self.line_phase.set_data(*zip(*self.phase_list))
                     else:
                         for index, line in enumerate(self.line_phase_list):
@@ -695,52 +937,29 @@ class data(data_phy):
                     if(not scan):
                         self.line_phase_active.set_data(*zip(*self.phase_list_active))
                     
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        txt2 = self.ax_list[0, 1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        # if(self.index > 20 and scan):
-                        #     txt3 = self.ax_list[1, 0].text(0.1, 0.1, 'delay time: ' + str(1000*delay_time)[:6] + 'ms' \
-                                # + u"\u00B1" + str(1000*delay_error)[:5] + 'ms', transform = self.ax_list[1, 0].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
                     if(self.omega_list is None):
-                        self.figure.suptitle(module_name + ' Driving Freq: ' + str(self.omega) + 'Hz')
+                        self.set_title(module_name + ' Driving Freq: ' + str(self.omega) + 'Hz')
                     else:
-                        self.figure.suptitle(module_name + ' Driving Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
+                        self.set_title(module_name + ' Driving Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                        
                     if(self.omega_list is None):
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega)
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega)
                     else:
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega_list[-1])
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                        # txt3.remove()
-                    except UnboundLocalError:
-                        pass
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega_list[-1])
+                    self.blit_frame()
                     
                 self.counter += 1
                 
             else:
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.temp_index + 1 + self.buffer_length - self.plot_length
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.plot_length)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
                     self.line_fft_ang.set_data(self.fft_freq, 
                                                 abs(self.fft_angle))
                     self.line_fft_pos.set_data(self.fft_freq,
@@ -748,10 +967,10 @@ class data(data_phy):
                     
                     if(self.omega_list is None):
                         if(scan):
-                            delay_time, delay_error = self.delay_fit(low_ind, high_ind)
+                            delay_time, delay_error = self.delay_fit(plot_slice)
                         self.line_phase.set_data(*zip(*self.phase_list))
-                        self.line_pos_const.set_data(self.time[low_ind:high_ind], 
-                                                     self.pos_const[low_ind:high_ind])
+                        self.line_pos_const.set_data(self.time[plot_slice], 
+                                                     self.pos_const[plot_slice])
                     else:
                         for index, line in enumerate(self.line_phase_list):
                             line.set_data(*zip(*self.multi_phase_list[index]))
@@ -760,58 +979,33 @@ class data(data_phy):
                     if(not scan):
                         self.line_phase_active.set_data(*zip(*self.phase_list_active))
                     
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        txt2 = self.ax_list[0, 1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        # if(scan):
-                        #     txt3 = self.ax_list[1, 0].text(0.1, 0.1, 'delay time: ' + str(1000*delay_time)[:6] + 'ms' \
-                                # + u"\u00B1" + str(1000*delay_error)[:5] + 'ms', transform = self.ax_list[1, 0].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
                     if(self.omega_list is None):
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
                     else:
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                
                     if(self.omega_list is None):
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega)
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega)
                     else:
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega_list[-1])
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                        # txt3.remove()
-                    except UnboundLocalError:
-                        pass
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega_list[-1])
+                    self.blit_frame()
                     
                 self.counter += 1
                 
         elif(module_name == "NR"):
+            self.update_reference()
             self.fft()
-            self.pos_const = self.amp_0 * np.sin(2 * np.pi * \
-                self.omega * (self.time + self.start_time))
-            self.pos_active = self.position - self.pos_const
             delay_time, delay_error = 0., 0.
             if(self.index < self.plot_length):
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.buffer_length + 1
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.index)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
                     self.line_fft_ang.set_data(self.fft_freq, 
                                                 abs(self.fft_angle))
                     self.line_fft_pos.set_data(self.fft_freq,
@@ -819,9 +1013,9 @@ class data(data_phy):
                     
                     if(self.omega_list is None):
                         if(self.index > 20 and scan):
-                            delay_time, delay_error = self.delay_fit(low_ind, high_ind)
-                        self.line_pos_const.set_data(self.time[low_ind:high_ind], 
-                                                     self.pos_const[low_ind:high_ind])
+                            delay_time, delay_error = self.delay_fit(plot_slice)
+                        self.line_pos_const.set_data(self.time[plot_slice], 
+                                                     self.pos_const[plot_slice])
                         self.line_phase.set_data(*zip(*self.phase_list))
                     else:
                         for index, line in enumerate(self.line_phase_list):
@@ -831,48 +1025,29 @@ class data(data_phy):
                     if(not scan):
                         self.line_phase_active.set_data(*zip(*self.phase_list_active))
                     
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        txt2 = self.ax_list[0, 1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
                     if(self.omega_list is None):
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
                     else:
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                        
                     if(self.omega_list is None):
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega)
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega)
                     else:
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega_list[-1])
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                    except UnboundLocalError:
-                        pass
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega_list[-1])
+                    self.blit_frame()
                     
                 self.counter += 1
                 
             else:
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.temp_index + 1 + self.buffer_length - self.plot_length
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.plot_length)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
                     self.line_fft_ang.set_data(self.fft_freq, 
                                                 abs(self.fft_angle))
                     self.line_fft_pos.set_data(self.fft_freq,
@@ -880,10 +1055,10 @@ class data(data_phy):
                     
                     if(self.omega_list is None):
                         if(scan):
-                            delay_time, delay_error = self.delay_fit(low_ind, high_ind)
+                            delay_time, delay_error = self.delay_fit(plot_slice)
                         self.line_phase.set_data(*zip(*self.phase_list))
-                        self.line_pos_const.set_data(self.time[low_ind:high_ind], 
-                                                     self.pos_const[low_ind:high_ind])
+                        self.line_pos_const.set_data(self.time[plot_slice], 
+                                                     self.pos_const[plot_slice])
                     else:
                         for index, line in enumerate(self.line_phase_list):
                             line.set_data(*zip(*self.multi_phase_list[index]))
@@ -892,164 +1067,96 @@ class data(data_phy):
                     if(not scan):
                         self.line_phase_active.set_data(*zip(*self.phase_list_active))
                     
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.03, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                        txt2 = self.ax_list[0, 1].text(0.5, 1.12, 'resolution: ' + str(round(1 / len(self.index_list) / self.avg_spacing,3)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.update_texts()
                     
                     if(self.omega_list is None):
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + str(self.omega) + 'Hz')
                     else:
-                        self.figure.suptitle(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
+                        self.set_title(module_name + ' Driven Freq: ' + ', '.join("%.3f" % i for i in self.omega_list) + 'Hz')
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                
                     if(self.omega_list is None):
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega)
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega)
                     else:
-                        self.ax_list[0, 1].set_xlim(0, 2 * self.omega_list[-1])
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                        txt2.remove()
-                    except UnboundLocalError:
-                        pass
+                        self.fix_xlim(self.ax_list[0, 1], 2 * self.omega_list[-1])
+                    self.blit_frame()
                     
                 self.counter += 1
                 
         elif(module_name == "pid"):
             if(self.index < self.plot_length and self.index > 1):
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.buffer_length + 1
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.index)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
-                    self.line_angle_vel.set_data(self.time[low_ind:high_ind],
-                                            self.angular_velocity[low_ind:high_ind])
-                    self.line_pos_vel.set_data(self.time[low_ind:high_ind],
-                                            self.position_velocity[low_ind:high_ind])
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.05, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
+                    self.line_angle_vel.set_data(self.time[plot_slice],
+                                            self.angular_velocity[plot_slice])
+                    self.line_pos_vel.set_data(self.time[plot_slice],
+                                            self.position_velocity[plot_slice])
+                    self.update_texts()
                     if(self.pid_param == 'r'):
-                        self.figure.suptitle('PID parameters (reusing previous values)')
+                        self.set_title('PID parameters (reusing previous values)')
                     else:
-                        self.figure.suptitle('PID parameters(' + self.pid_param + ')')
+                        self.set_title('PID parameters(' + self.pid_param + ')')
                     
-                    for axes in self.ax_list:
-                        for ax in axes:
-                            ax.relim()
-                            ax.autoscale_view()
-                            for label in ax.get_yticklabels():
-                                label.set_rotation(ANGLE_ROTATION)
-                        
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                    except UnboundLocalError:
-                        pass
+                    self.blit_frame()
                     
                 self.counter += 1
                 
             else:
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.temp_index + 1 + self.buffer_length - self.plot_length
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.plot_length)
                     
-                    self.line_angle.set_data(self.time[low_ind:high_ind],
-                                        self.angle[low_ind:high_ind])
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                           self.position[low_ind:high_ind])
-                    self.line_angle_vel.set_data(self.time[low_ind:high_ind],
-                                            self.angular_velocity[low_ind:high_ind])
-                    self.line_pos_vel.set_data(self.time[low_ind:high_ind],
-                                            self.position_velocity[low_ind:high_ind])
-                    try:
-                        txt1 = self.ax_list[0, 1].text(0.5, 1.05, 'sampling rate: ' + str(round(0.5 / self.avg_spacing,1)) + 'Hz',
-                                                transform = self.ax_list[0, 1].transAxes)
-                    except ZeroDivisionError:
-                        pass
+                    self.line_angle.set_data(self.time[plot_slice],
+                                        self.angle[plot_slice])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                           self.position[plot_slice])
+                    self.line_angle_vel.set_data(self.time[plot_slice],
+                                            self.angular_velocity[plot_slice])
+                    self.line_pos_vel.set_data(self.time[plot_slice],
+                                            self.position_velocity[plot_slice])
+                    self.update_texts()
                     
                     if(self.pid_param == 'r'):
-                        self.figure.suptitle('PID parameters (reusing previous values)')
+                        self.set_title('PID parameters (reusing previous values)')
                     else:
-                        self.figure.suptitle('PID parameters(' + self.pid_param + ')')
+                        self.set_title('PID parameters(' + self.pid_param + ')')
                     
-                    for axes in self.ax_list:
-                        for ax in axes:
-                            ax.relim()
-                            ax.autoscale_view()
-                            for label in ax.get_yticklabels():
-                                label.set_rotation(ANGLE_ROTATION)
-                        
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
-                    try:
-                        txt1.remove()
-                    except UnboundLocalError:
-                        pass
+                    self.blit_frame()
                     
                 self.counter += 1            
         
         elif(module_name == "setSpeed"):
             if(self.index < self.plot_length):
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.buffer_length + 1
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.index)
                     
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                             self.position[low_ind:high_ind])
-                    self.line_pos_vel.set_data(self.time[low_ind:high_ind],
-                                               self.position_velocity[low_ind:high_ind])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                             self.position[plot_slice])
+                    self.line_pos_vel.set_data(self.time[plot_slice],
+                                               self.position_velocity[plot_slice])
                     
                     if(self.setSpeed_param is not None):
-                        self.figure.suptitle(self.setSpeed_param)
+                        self.set_title(self.setSpeed_param)
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                            
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
+                    self.blit_frame()
                     
                 self.counter += 1
             else:
                 if(self.counter % MAX_COUNT == 0):
-                    low_ind = self.temp_index + self.buffer_length + 1 - self.plot_length
-                    high_ind = self.temp_index + self.buffer_length + 1
+                    plot_slice = self.buffer.latest_slice(self.plot_length)
                     
-                    self.line_pos.set_data(self.time[low_ind:high_ind],
-                                             self.position[low_ind:high_ind])
-                    self.line_pos_vel.set_data(self.time[low_ind:high_ind],
-                                               self.position_velocity[low_ind:high_ind])
+                    self.line_pos.set_data(self.time[plot_slice],
+                                             self.position[plot_slice])
+                    self.line_pos_vel.set_data(self.time[plot_slice],
+                                               self.position_velocity[plot_slice])
                     
                     if(self.setSpeed_param is not None):
-                        self.figure.suptitle(self.setSpeed_param)
+                        self.set_title(self.setSpeed_param)
                     
-                    for ax in self.ax_new_list:
-                        ax.relim()
-                        ax.autoscale_view()
-                        for label in ax.get_yticklabels():
-                            label.set_rotation(ANGLE_ROTATION)
-                            
-                    self.figure.canvas.draw()
-                    self.figure.canvas.flush_events()
+                    self.blit_frame()
                     
                 self.counter += 1
         
@@ -1070,13 +1177,40 @@ class data(data_phy):
         self.figure.canvas.flush_events()
         plt.close("all")
 
+    def csv_header(self, module_name, special_info):
+        '''Returns the header rows of the data csv file'''
+        header = [["special_info", special_info]]
+        if(module_name == "pid"):
+            header.append(["Kp", "Ki", "Kd", "Kp_pos", "Ki_pos", "Kd_pos"])
+            try:
+                header.append([self.pid_param.split(',')[i] for i in range(6)])
+            except (AttributeError, IndexError):
+                pass
+        header.append(["start_time", str(self.start_time)])
+        if(self.omega_list is None):
+            header.append(["omega", str(self.omega)])
+        else:
+            header.append(["multiple_omega", *(str(i) for i in self.omega_list)])
+        try:
+            header.append(["amplitude", str(self.amp_list[-1][1]), "amp_0", str(self.amp_0)])
+            if(self.omega_list is None):
+                header.append(["phase/pi", str(self.phase_list[-1][1])])
+            else:
+                header.append(["multiple_phase/pi", *(str(i[-1][1]) for i in self.multi_phase_list)])
+        except (AttributeError, IndexError, TypeError):
+            pass
+        header.append(["time", "angle", "position", "angular_velocity", "cart_velocity"])
+        return header
+    
     def export_csv(
         self, 
         module_name,
         NR_phase_amp = False,
         input_spec_info = True,
+        session = None, # open session_log of the run, self.session by default
         ):
-        '''Exports the data to a csv file'''
+        '''Exports the data to a csv file. With a session recording the run, its file
+        is completed instead of writing a new one.'''
         try:
             dirc = self.path + '\\' + datetime.now().strftime("%d-%m-csv")
             dirc_fft = self.path + '\\' + datetime.now().strftime("%d-%m-fft-csv")
@@ -1097,35 +1231,26 @@ class data(data_phy):
         except UnboundLocalError:
             pass
         special_info = ""
-        with open(filename + '.csv', 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            if(input_spec_info):
-                special_info = input("Title to add to the csv file (if any)\n\n")
-            writer.writerow(["special_info", special_info])
-            if(module_name == "pid"):
-                try:
-                    writer.writerow(["Kp", "Ki", "Kd", "Kp_pos", "Ki_pos", "Kd_pos"])
-                    writer.writerow([self.pid_param.split(',')[i] for i in range(6)])
-                except (AttributeError, IndexError):
-                    pass
-            writer.writerow(["start_time", str(self.start_time)])
-            if(self.omega_list is None):
-                writer.writerow(["omega", str(self.omega)])
-            else:
-                writer.writerow(["multiple_omega", *(str(i) for i in self.omega_list)])
-            try:
-                writer.writerow(["amplitude", str(self.amp_list[-1][1]), "amp_0", str(self.amp_0)])
-                if(self.omega_list is None):
-                    writer.writerow(["phase/pi", str(self.phase_list[-1][1])])
-                else:
-                    writer.writerow(["multiple_phase/pi", *(str(i[-1][1]) for i in self.multi_phase_list)])
-            except (AttributeError, IndexError):
-                pass
-            writer.writerow(["time", "angle", "position", "angular_velocity", "cart_velocity"])
-            for i in range(len(self.time)):
-                writer.writerow([self.time[i], self.angle[i], self.position[i],\
-                    self.angular_velocity[i], self.position_velocity[i]])
-            csvfile.close()
+        if(input_spec_info):
+            special_info = input("Title to add to the csv file (if any)\n\n")
+        if(session is None):
+            session = self.session
+        if(session is not None):
+            # The samples are already on disk, only the header is completed
+            session.close(self.csv_header(module_name, special_info))
+            filename = session.basename
+            if(session is self.session):
+                self.session = None
+        else:
+            header = self.csv_header(module_name, special_info)
+            # Only the valid samples, in chronological order
+            samples = self.buffer.unroll()[self.buffer.rows(BUFFER_FIELDS[:5])]
+            with open(filename + '.csv', 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerows(header)
+                np.savetxt(csvfile, samples.T, fmt = '%.12g', delimiter = ',', newline = '\r\n')
+                csvfile.close()
+            save_run(filename, header, samples.T) # binary copy read by data_analysis
         if(module_name != "pid" and module_name != "setSpeed"):
             with open(filename_fft + '.csv', 'w', newline = '') as csvfile:
                 writer = csv.writer(csvfile)
@@ -1218,19 +1343,18 @@ class live_data(data):
         fft_length,
         sampling_div,
         wait_to_stable,
+        headless = HEADLESS,
+        snapshot_period = None,
         ):
-        super().__init__(fft_length, sampling_div, wait_to_stable)
+        super().__init__(fft_length, sampling_div, wait_to_stable, 
+                         headless = headless, snapshot_period = snapshot_period)
         
     def copy(self, data, NR = False):
         '''Copy the data from the data class to the live_data class.
         This method is important because then the plotting will be
         independent of the parallel data reading thread as indicted
         in the thread_reader() in cart_pendulum class.'''
-        self.time = data.time
-        self.angle = data.angle
-        self.angular_velocity = data.angular_velocity
-        self.position = data.position
-        self.position_velocity = data.position_velocity
+        self.link_buffer(data.buffer)
         self.index = data.index
         self.temp_index = data.temp_index
         self.counter = data.counter
@@ -1257,4 +1381,5 @@ class live_data(data):
         data.pos_active = self.pos_active
         self.omega_num = data.omega_num
         self.omega_list = data.omega_list
-        self.setSpeed_param = data.setSpeed_param
\ No newline at end of file
+        self.setSpeed_param = data.setSpeed_param
+        self.lock_in = data.lock_in
\ No newline at end of file
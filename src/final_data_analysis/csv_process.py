@@ -4,14 +4,34 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import pandas as pd
-import os, csv, tkinter
+import os, sys, csv, json, time as timer, tempfile, argparse, hashlib, tkinter
 from statistics import mean, stdev
 from scipy.fft import fft, fftfreq
 from scipy.signal import find_peaks
 from scipy.optimize import curve_fit
+from concurrent.futures import ProcessPoolExecutor
 plt.rcParams['axes.grid'] = True
 plt.rcParams["figure.autolayout"] = True
-mpl.use('TkAgg')
+# Set PENDULUM_HEADLESS=1 to import without any window, e.g. for the benchmarks
+mpl.use('Agg' if os.environ.get('PENDULUM_HEADLESS', '0') == '1' else 'TkAgg')
+# The signal processing routines are shared with the live code in the parent folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from signal_process import uniform_index_list, rolling_phase
+from run_format import load_run
+
+SCAN_DATA_HEADER = ['file_name', 'parent_dir', 'driving_freq', 'amp_0', 'response_amp',
+                    'response_amp_err', 'driving_amp', 'driving_amp_err', 'phase', 'phase_err']
+MEASURE_DATA_HEADER = ['file_name', 'parent_dir', 'omega_peak', 'omega_peak_err', 'omega_fit',
+                       'omega_fit_err', 'gamma_fit', 'gamma_fit_err']
+# Settings of the batch mode, overridden by the config file given with --config
+BATCH_CONFIG = {
+    "sampling_div": 0.05,
+    "scan": {"start_time": 30, "end_time": None, "rolling_time": 40}, # same as the auto_scan
+    "measure": {"start_time": 5, "end_time": None}, # end_time None for the end of the run
+    "files": {}, # settings for single files, e.g. {"measure-12-00-00.csv": {"start_time": 10}}
+    "cache": True, # reuse the results of the files analysed before with the same settings
+}
+CACHE_VERSION = 1 # increase when the analysis changes, so that the cached results are recomputed
 
 def damp_sin(time, gamma, omega, phi, amp, offset):
     '''Fit to the natural frequency measurement plot'''
@@ -21,6 +41,179 @@ def sinusoid(time, omega, phi, amp, offset):
     '''Fit to the amplitude response scan plot'''
     return amp * np.sin(2 * np.pi * omega * time + phi) + offset
 
+def damp_sin_jac(time, gamma, omega, phi, amp, offset):
+    '''Analytic jacobian of damp_sin() with respect to its parameters'''
+    decay = np.exp(- 0.5 * gamma * time)
+    theta = 2 * np.pi * omega * time + phi
+    sin, cos = decay * np.sin(theta), decay * np.cos(theta)
+    return np.column_stack((- 0.5 * time * amp * sin, 2 * np.pi * time * amp * cos,
+                            amp * cos, sin, np.ones_like(time)))
+
+def sinusoid_jac(time, omega, phi, amp, offset):
+    '''Analytic jacobian of sinusoid() with respect to its parameters'''
+    theta = 2 * np.pi * omega * time + phi
+    cos = np.cos(theta)
+    return np.column_stack((2 * np.pi * time * amp * cos, amp * cos, np.sin(theta), np.ones_like(time)))
+
+def peak_freq(time, y, f_range):
+    '''Frequency of the highest fft peak within f_range, the samples are interpolated
+    on a uniform grid and the peak is refined with a parabola through the 3 bins'''
+    grid = np.linspace(time[0], time[-1], len(time))
+    spectrum = np.abs(np.fft.rfft(np.interp(grid, time, y) - np.mean(y), 4 * len(grid)))
+    freq = np.fft.rfftfreq(4 * len(grid), grid[1] - grid[0])
+    inside = np.flatnonzero((freq >= f_range[0]) & (freq <= f_range[1]))
+    if(len(inside) == 0):
+        return 0.5 * (f_range[0] + f_range[1])
+    peak = inside[np.argmax(spectrum[inside])]
+    if(0 < peak < len(freq) - 1):
+        left, centre, right = spectrum[peak - 1 : peak + 2]
+        curvature = left - 2 * centre + right
+        if(curvature < 0):
+            return freq[peak] + 0.5 * (left - right) / curvature * (freq[1] - freq[0])
+    return freq[peak]
+
+def sine_seed(time, y, omega, gamma = 0.):
+    '''Linear least squares amplitude, phase in [0, 2 pi) and offset of
+    y = amp * exp(-0.5 * gamma * time) * sin(2 * pi * omega * time + phi) + offset'''
+    decay = np.exp(- 0.5 * gamma * time)
+    theta = 2 * np.pi * omega * time
+    basis = np.column_stack((decay * np.sin(theta), decay * np.cos(theta), np.ones_like(time)))
+    (a, b, offset), _, _, _ = np.linalg.lstsq(basis, y, rcond = None)
+    return np.hypot(a, b), np.arctan2(b, a) % (2 * np.pi), offset
+
+def decay_seed(time, y, omega, offset):
+    '''Damping factor from the slope of the log of the largest deviation in every
+    period, None if there are less than 3 periods'''
+    period = np.floor((time - time[0]) * omega).astype(int)
+    if(period[-1] < 3):
+        return None
+    peaks = np.zeros(period[-1])
+    np.maximum.at(peaks, period[period < period[-1]], np.abs(y - offset)[period < period[-1]])
+    centre = time[0] + (np.arange(period[-1]) + 0.5) / omega
+    valid = peaks > 0
+    slope = np.polyfit(centre[valid], np.log(peaks[valid]), 1)[0]
+    return - 2 * slope
+
+def seeded_fit(func, jac, time, y, p0, bounds, maxfev):
+    '''curve_fit() with the analytic jacobian from p0 moved inside the bounds.
+    Returns the optimised parameters, the covariance matrix, the number of
+    function evaluations and the time taken in seconds.'''
+    lower, upper = np.array(bounds[0], dtype = float), np.array(bounds[1], dtype = float)
+    margin = 1e-6 * (upper - lower)
+    p0 = np.clip(p0, lower + margin, upper - margin)
+    start = timer.perf_counter()
+    popt, pcov, infodict, _, _ = curve_fit(func, time, y, p0 = p0, jac = jac,
+                                           bounds = (lower, upper), maxfev = maxfev,
+                                           full_output = True)
+    return popt, pcov, infodict['nfev'], timer.perf_counter() - start
+
+def load_batch_config(config_file = None):
+    '''Returns BATCH_CONFIG updated with the json config file, if any'''
+    config = json.loads(json.dumps(BATCH_CONFIG)) # deep copy
+    if(config_file is not None):
+        with open(config_file, 'r') as file:
+            user_config = json.load(file)
+            file.close()
+        for key, value in user_config.items():
+            if(isinstance(value, dict) and key in config):
+                config[key].update(value)
+            else:
+                config[key] = value
+    return config
+
+def batch_settings(config, data_type, file):
+    '''Settings of a single file: the defaults of its data type updated with its own'''
+    settings = {"sampling_div": config["sampling_div"]}
+    settings.update(config[data_type])
+    settings.update(config["files"].get(file, {}))
+    return settings
+
+def write_rows(csv_dir, header, rows, parent_dir):
+    '''Replaces the rows of parent_dir in the csv file (created with the header if
+    needed) with the given rows, the rows of the other folders are kept. The new
+    content goes to a temporary file first, which then replaces the csv file, so the
+    file is never left half written.'''
+    old_rows = []
+    if(os.path.isfile(csv_dir)):
+        with open(csv_dir, 'r', newline = '') as csvfile:
+            old_rows = list(csv.reader(csvfile))
+            csvfile.close()
+    if(len(old_rows) == 0):
+        old_rows = [header]
+    old_rows = old_rows[:1] + [row for row in old_rows[1:] if len(row) < 2 or row[1] != parent_dir]
+    handle, temp_dir = tempfile.mkstemp(suffix = '.csv', dir = os.path.dirname(csv_dir))
+    with os.fdopen(handle, 'w', newline = '') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerows(old_rows + rows)
+        csvfile.close()
+    os.replace(temp_dir, csv_dir)
+
+def cache_key(path, settings):
+    '''Key of the cached results of a file: hash of its content and of its binary
+    copy (read_binary() reads that one when it exists), the analysis settings and
+    CACHE_VERSION'''
+    digest = hashlib.sha256()
+    basename = os.path.splitext(path)[0]
+    for extension in ('.csv', '.bin', '.json'):
+        if(not os.path.exists(basename + extension)):
+            continue
+        digest.update(extension.encode('utf-8'))
+        with open(basename + extension, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+            file.close()
+    digest.update(json.dumps([CACHE_VERSION, settings], sort_keys = True).encode('utf-8'))
+    return digest.hexdigest()
+
+def save_cache(cache_dir, key, row, spectra):
+    '''Saves the row (None for a skipped file) and the spectra of a file to
+    cache_dir\\key.npz, through a temporary file'''
+    handle, temp_dir = tempfile.mkstemp(suffix = '.npz', dir = cache_dir)
+    with os.fdopen(handle, 'wb') as file:
+        np.savez(file, row = json.dumps(row, default = lambda value: value.item()), **spectra)
+        file.close()
+    os.replace(temp_dir, cache_dir + '\\' + key + '.npz')
+
+def load_cache(cache_dir, key):
+    '''Returns the cached row and spectra of a file, None if there are none'''
+    try:
+        with np.load(cache_dir + '\\' + key + '.npz') as cached:
+            spectra = {name: cached[name] for name in cached.files if name != 'row'}
+            return json.loads(str(cached['row'])), spectra
+    except (OSError, ValueError, KeyError):
+        return None
+
+def batch_task(task):
+    '''Analyses a single file without any figure or prompt, runs in a worker process
+    of data_analysis.batch(). Returns the row of scan_data.csv or measure_data.csv (None
+    if the file is skipped) and the spectra computed on the way.'''
+    dirc, file, data_type, settings = task
+    analysis = data_analysis()
+    analysis.interactive = False
+    analysis.dirc = dirc
+    analysis.properties.update({'file_name':file})
+    try:
+        if(not analysis.read_csv(file)):
+            return None, {}
+        analysis.temp_data = analysis.clean_data(file)
+        analysis.sampling_div = settings["sampling_div"]
+        end_time = settings["end_time"]
+        if(end_time is None or end_time > analysis.temp_data[0][-1]):
+            end_time = analysis.temp_data[0][-1]
+        if(data_type == 'scan'):
+            exp_data = analysis.scan_batch(settings["start_time"], end_time, settings["rolling_time"])
+        else:
+            exp_data = analysis.measure_batch(settings["start_time"], end_time)
+    except (FileNotFoundError, ValueError, RuntimeError, KeyError, IndexError) as error:
+        print("Skipping " + file + ": " + repr(error))
+        return None, {}
+    if(exp_data is None):
+        print("Skipping " + file + ": no result in the time range")
+        return None, analysis.spectra
+    if(data_type == 'scan'):
+        return analysis.scan_data_row(exp_data, file), analysis.spectra
+    return analysis.measure_data_row(exp_data, file), analysis.spectra
+
 class data_analysis():
     
     '''Analysis class to analyse the data
@@ -60,13 +253,12 @@ class data_analysis():
     5. check_csv_type():
         check whether all the csv files are of the same type, returns
         True if all the csv files are of the same type, False otherwise
-    6. load_data(row, file):
+    6. load_data(num_header):
         Args:
-            row: a row of data from the csv file
-            file: the csv file name
+            num_header: the number of header rows to skip
         Yields:
-            load the data into the data array, delete the files if negative
-            time stamp is detected
+            load all the samples at once into a data array of the right
+            size, delete the file if negative time stamp is detected
     7. clean_data(file):
         Yields:
             rotate the circular buffer to the correct starting time stamp
@@ -140,6 +332,10 @@ class data_analysis():
         save the measure data to a csv file
     20. main():
         the main function of the data analysis class
+    21. batch(dirc, config_file = None, workers = None):
+        analyse all the files of dirc in a process pool, without any figure
+        or prompt, with the time ranges of the config file (see BATCH_CONFIG),
+        and add the results to scan_data.csv or measure_data.csv at once
         '''
     
     def __init__(self):
@@ -175,6 +371,9 @@ class data_analysis():
         self.phase_list = []
         self.amp_list = []
         self.extratitle = ''  # or ' - close window to continue...' but this would then be printed too
+        self.interactive = True # False in the batch mode, no prompt is waited for
+        self.fit_report = [] # (file name, fit, function evaluations, seconds) of every fit
+        self.spectra = {} # spectra of the batch mode, saved in the cache
         
     def clear_flag(self):
         '''Clear the flag'''
@@ -193,10 +392,12 @@ class data_analysis():
         self.ax0 = None
         self.txt_list = None
         
-    def load_csv(self):
+    def load_csv(self, dirc = None):
         '''Load the csv file'''
         self.clear_data()
-        self.dirc = input('Please input the directory of the csv file: ')
+        if(dirc is None):
+            dirc = input('Please input the directory of the csv file: ')
+        self.dirc = dirc
         self.parent_name_list = os.path.basename(self.dirc).split('-')
         for file in os.listdir(self.dirc):
             if file.endswith('.csv'):
@@ -213,50 +414,93 @@ class data_analysis():
         else:
             return True
     
-    def read_csv(self, file_name, flag_pid = False):
-        '''Read a single csv file and return the properties and data'''
+    def read_binary(self, file_name):
+        '''Reads the binary copy (.bin with a .json sidecar, see run_format) of a csv
+        file if it exists, returns None otherwise. The samples are memory-mapped
+        instead of parsed.'''
         path = self.dirc + '\\' + file_name
+        basename = os.path.splitext(path)[0]
+        if(not os.path.exists(basename + '.json')):
+            return None
         self.path = path
-        with open(path, 'r') as file:
-            reader = csv.reader(file)
-            try: 
-                for index, row in enumerate(reader):
-                    if(flag_pid):
-                        if(index == 2):
-                            # Read the pid parameters
-                            pid_headers = ['Kp', 'Ki', 'Kd', 'Kp_pos', 'Ki_pos', 'Kd_pos']
-                            for index, param in row:
-                                self.properties.update({pid_headers[index]:param})
-                            continue
-                        if(row[0].startswith('Kp')):
-                            continue
-                        for header in self.header:
-                            if(row[0].startswith(header)):
-                                self.properties.update({header:row[1]})
-                                break
-                        if(row[0].startswith('time')):
-                            continue
-                        if(index >= 8):
-                            self.load_data(row, file)
-                    else:
-                        for header in self.header:
-                            if(row[0] == 'multiple_omega' or row[0] == 'multiple_phase'):
-                                self.properties.update({header:(row[i] for i in range(1, len(row)))})
-                                print(self.properties[header])
-                                # TODO: multiple frequency assessment
-                                return False
-                            if(row[0].startswith(header)):
-                                self.properties.update({header:row[1]})
-                                if(len(row)>3 and row[2] in self.header):
-                                    self.properties.update({row[2]:row[3]})
-                                break
-                        if(row[0].startswith('time')):
-                            continue
-                        if(index >= 6):
-                            self.load_data(row, file)
-            except ValueError:
+        header, samples = load_run(basename)
+        if(not self.read_header(header)):
+            return False
+        if(len(samples) > 0 and samples[:, 0].min() < 0):
+            print("Detected negative time stamp at " + self.path + " Deleting file...")
+            if(self.interactive):
+                input("Press ENTER to continue")
+            del samples # the mapping has to go before the file
+            self.remove_run()
+            return False
+        if(len(samples) > 0):
+            self.data = samples.T # view on the mapped file, nothing is copied
+            self.count = len(samples)
+        return True
+
+    def remove_run(self):
+        '''Deletes the csv file at self.path together with its binary copy, which
+        read_binary() would read otherwise'''
+        self.data = np.zeros((5, 0)) # may be a view on the mapped binary copy
+        self.count = 0
+        basename = os.path.splitext(self.path)[0]
+        for extension in ('.csv', '.bin', '.json'):
+            if(os.path.exists(basename + extension)):
+                os.remove(basename + extension)
+
+    def read_header(self, rows):
+        '''Updates the properties from the header rows, stops at the row naming the
+        columns. Returns False for multiple frequency files, True otherwise.'''
+        flag_pid_values = False
+        for row in rows:
+            if(len(row) == 0):
+                continue
+            if(flag_pid_values):
+                # Row of values following the pid parameter names
+                self.properties.update(dict(zip(pid_headers, row)))
+                flag_pid_values = False
+                continue
+            if(row[0] == 'Kp'):
+                pid_headers = [name for name in row if name != ""]
+                flag_pid_values = True
+                continue
+            if(row[0].startswith('multiple')):
+                # TODO: multiple frequency assessment
                 return False
+            if(row[0].startswith('time')):
+                break
+            for header_name in self.header:
+                if(row[0].startswith(header_name)):
+                    if(len(row) > 1):
+                        self.properties.update({header_name:row[1]})
+                    if(len(row) > 3 and row[2] in self.header):
+                        self.properties.update({row[2]:row[3]})
+                    break
         return True
+
+    def read_csv(self, file_name, flag_pid = False):
+        '''Read a single csv file and return the properties and data. The header is
+        parsed row by row, the samples below it are read in one go.'''
+        flag_binary = self.read_binary(file_name)
+        if(flag_binary is not None):
+            return flag_binary
+        path = self.dirc + '\\' + file_name
+        self.path = path
+        num_header = 0
+        with open(path, 'r') as file:
+            header = []
+            for row in csv.reader(file):
+                header.append(row)
+                num_header += 1
+                if(len(row) > 0 and row[0].startswith('time')):
+                    break
+            file.close()
+        if(not self.read_header(header)):
+            return False
+        try:
+            return self.load_data(num_header)
+        except ValueError:
+            return False
     
     def check_csv_type(self):
         '''Check whether all the csv files are of the same type'''
@@ -271,41 +515,58 @@ class data_analysis():
             print('Multiple data type detected!')
             return False
     
-    def load_data(self, row, file):
-        '''Load a single row of data'''
-        if(float(row[0]) < 0):
+    def load_data(self, num_header):
+        '''Load all the samples below the num_header header rows'''
+        try:
+            samples = pd.read_csv(self.path, skiprows = num_header, header = None,
+                                  usecols = range(5), dtype = float, engine = 'c').to_numpy()
+        except pd.errors.EmptyDataError:
+            samples = np.zeros((0, 5))
+        if(len(samples) > 0 and samples[:, 0].min() < 0):
             print("Detected negative time stamp at " + self.path + " Deleting file...")
-            input("Press ENTER to continue")
-            file.close()
-            os.remove(self.path)
-            return
-        if(row[0] != '0.0'):
-            for i in range(5):
-                self.data[i][self.count] = float(row[i])
-            self.count += 1
+            if(self.interactive):
+                input("Press ENTER to continue")
+            self.remove_run()
+            return False
+        samples = self.drop_empty_slots(samples)
+        if(len(samples) > 0):
+            self.data = np.ascontiguousarray(samples.T)
+            self.count = len(samples)
+        return True
                 
+    def drop_empty_slots(self, samples):
+        '''Older exports hold the whole doubled buffer, the unfilled slots are rows of
+        zeros in both halves. The same rows are dropped from both halves, so they stay
+        two copies for clean_data(), and the first sample is kept even if it is all
+        zeros (time 0 relative to start_time). Other files only lose trailing rows of
+        zeros.'''
+        half = len(samples) // 2
+        empty = np.all(samples == 0, axis = 1)
+        if(len(samples) % 2 == 0 and half > 0 and np.array_equal(samples[:half], samples[half:])):
+            valid = ~empty[:half]
+            valid[0] = True
+            return np.concatenate((samples[:half][valid], samples[half:][valid]))
+        filled = np.flatnonzero(~empty)
+        end = filled[-1] + 1 if len(filled) > 0 else min(len(samples), 1)
+        return samples[:end]
+
     def clean_data(self, file):
         '''Returns an array with correct starting time stamp'''
-        temp_index = 0
-        time_stamp = self.data[0][0]
-        flag = True
-        for i in range(len(self.data[0])):
-            if(flag):
-                if(self.data[0][i] >= time_stamp):
-                    time_stamp = self.data[0][i]
-                else:
-                    flag = False
-                    temp_index = i
-                    time_stamp = self.data[0][i]
-                    for j in range(len(self.data[0])):
-                        self.data[0][j] -= time_stamp
-                    break
-                    
-        if(temp_index == 0 and time_stamp == 0):
+        time = self.data[0][:self.count]
+        wrap = np.flatnonzero(np.diff(time) < 0) # where the circular buffer restarts
+        if(len(wrap) == 0 and (self.count == 0 or time[-1] == 0)):
             print('Empty file found at ' + self.dirc + '\\' + file + " Deleting file...")
-            input("Press ENTER to continue")
-            os.remove(self.path)
+            if(self.interactive):
+                input("Press ENTER to continue")
+            self.remove_run()
             raise FileNotFoundError
+        if(len(wrap) == 0):
+            # Chronological file, nothing to unwrap, only starts the time at zero
+            time -= time[0]
+            return self.data[:, :self.count]
+        # The buffer is saved twice, half of it from the restart is one full copy
+        temp_index = wrap[0] + 1
+        time -= time[temp_index]
         return self.data[:, temp_index : temp_index + int(self.count / 2)]
     
     def restore_figure(self, start_index = 0, end_index = -1):
@@ -333,29 +594,7 @@ class data_analysis():
     def fft_index_list(self, time, fft_length, sampling_div):
         '''return the list and average time spacing based on the 
         given sampling_div and fft_length'''
-        current_time = time[len(time) - 1]
-        time_stamp = current_time
-        index = fft_length - 2
-        index_list = np.zeros(fft_length, dtype = int)
-        index_list[fft_length - 1] = current_time
-        
-        for i in range(len(time) - 1, 0, -1):
-            if index < 0: 
-                index_list = index_list
-                avg_spacing = (current_time - time_stamp) / (fft_length - index - 2)
-                return index_list, avg_spacing
-            if(time_stamp - time[i] >= sampling_div):
-                index_list[index] = i
-                time_stamp = time[i]
-                index -= 1
-        if index >= 0:
-            avg_spacing = (current_time - time_stamp) / (fft_length - index - 2)
-            index_list = index_list[index + 1 : fft_length]
-            return index_list, avg_spacing
-        else:
-            index_list = index_list
-            avg_spacing = (current_time - time_stamp) / (fft_length - index - 2)
-            return index_list, avg_spacing
+        return uniform_index_list(time, fft_length, sampling_div)
     
     def general_fft(self, time, angle, position, fft_length, sampling_div):
         '''Return the normalised frequency spectrum of the input angle
@@ -420,34 +659,49 @@ class data_analysis():
     def scan_fit(self, time, angle,
                  amp_range):
         '''Fit the sinusoidal function to the data, and return the 
-        optimized parameters and the covariance matrix'''
-        popt, pcov = curve_fit(sinusoid, time, angle,
-                               p0 = [float(self.properties['omega']), np.pi, 
-                                     0.5*(amp_range[0] + amp_range[1]), 0.],
-                               bounds = ((0., 0, amp_range[0], -0.6),
-                                         (4., 2 * np.pi, amp_range[1], 0.6)),
-                               maxfev = 2000000000)
+        optimized parameters and the covariance matrix. The fit starts from the
+        driving frequency with the linear least squares amplitude, phase and offset.'''
+        omega = float(self.properties['omega'])
+        amp, phi, offset = sine_seed(time, angle, omega)
+        popt, pcov, nfev, seconds = seeded_fit(sinusoid, sinusoid_jac, time, angle,
+                                               p0 = [omega, phi, amp, offset],
+                                               bounds = ((0., 0, amp_range[0], -0.6),
+                                                         (4., 2 * np.pi, amp_range[1], 0.6)),
+                                               maxfev = 2000)
+        self.report_fit('scan_fit', nfev, seconds)
         return popt, pcov
 
+    def report_fit(self, name, nfev, seconds):
+        '''Prints and keeps the number of function evaluations and the time of a fit'''
+        self.fit_report.append((self.properties.get('file_name', ''), name, nfev, seconds))
+        print('%s: %d function evaluations in %.1f ms' % (name, nfev, 1e3 * seconds))
+
+    def time_range(self, start_time, end_time):
+        '''Indices of the last sample not later than start_time and of the first
+        sample not earlier than end_time (-1 if there is none)'''
+        time = self.temp_data[0]
+        start_index = max(np.searchsorted(time, start_time, side = 'right') - 1, 0)
+        end_index = np.searchsorted(time, end_time, side = 'left')
+        if(end_index >= len(time)):
+            end_index = -1
+        return start_index, end_index
+
+    def scan_phase(self, start_index = 0, end_index = -1):
+        '''Phase (in pi) over the rolling window before every sample later than 5 s,
+        computed in one batch. Returns the times and the phases.'''
+        time = self.temp_data[0]
+        ends = np.arange(len(time))[start_index:end_index]
+        ends = ends[time[ends] - time[0] > 5]
+        phases = rolling_phase(time, self.temp_data[1], self.temp_data[2],
+                               float(self.properties['omega']),
+                               self.fft_length, self.sampling_div, ends) / np.pi
+        return time[ends], phases
+
     def scan_fft_plot(self, axs, start_index = 0, end_index = -1):
         '''Plot phase curve and fft on the axes objects'''
-        for i in range(len(self.temp_data[0][start_index:end_index])):
-            if(self.temp_data[0][i + start_index] - self.temp_data[0][0] > 5):
-                fft_angle, fft_position, fft_freq, avg = self.general_fft(
-                    self.temp_data[0][:i + start_index],
-                    self.temp_data[1][:i + start_index],
-                    self.temp_data[2][:i + start_index],
-                    self.fft_length,
-                    self.sampling_div
-                )
-                phase = self.phase_calc(
-                    fft_freq,
-                    float(self.properties['omega']),
-                    fft_angle,
-                    fft_position
-                )
-                self.phase_list.append(phase)
-                axs[1].plot(self.temp_data[0][i + start_index], phase, 'bo', markersize = 2)
+        time, phases = self.scan_phase(start_index, end_index)
+        self.phase_list.extend(phases)
+        axs[1].plot(time, phases, 'bo', markersize = 2)
         if(len(self.temp_data[0]) == 0):
             return
         fft_angle, fft_position, fft_freq, avg = self.general_fft(
@@ -477,13 +731,7 @@ class data_analysis():
         if(self.temp_data[0][0] >= start_time):
             print("Invalid input of time range")
             return
-        for i in range(len(self.temp_data[0])):
-            if(self.temp_data[0][i] <= start_time):
-                start_index = i
-            if(self.temp_data[0][i] >= end_time):
-                end_index = i
-                break
-            end_index = -1
+        start_index, end_index = self.time_range(start_time, end_time)
         
         self.figure, axes = self.restore_figure(start_index, end_index)
         axes[0, 1].clear()
@@ -541,6 +789,34 @@ class data_analysis():
             popt_position[2], np.sqrt(pcov_position[2, 2]), \
                 avg_phase, err_phase
           
+    def scan_batch(self, start_time, end_time, rolling_time):
+        '''Same results as scan_process() without any figure'''
+        self.phase_list = []
+        self.fft_length = int(rolling_time / self.sampling_div)
+        if(self.temp_data[0][0] >= start_time):
+            return None
+        start_index, end_index = self.time_range(start_time, end_time)
+        phase_time, phases = self.scan_phase(start_index, end_index)
+        self.phase_list.extend(phases)
+        time = self.temp_data[0][start_index:end_index]
+        angle = self.temp_data[1][start_index:end_index]
+        position = self.temp_data[2][start_index:end_index]
+        fft_angle, fft_position, fft_freq, _ = self.general_fft(time, angle, position,
+                                                                self.fft_length, self.sampling_div)
+        half = int((len(fft_freq)+1)/2)
+        self.spectra = {'phase_time': phase_time, 'phase': phases, 'fft_freq': fft_freq[:half],
+                        'fft_angle': abs(fft_angle[:half])}
+        if(np.ndim(fft_position) > 0): # 0 when the cart did not move
+            self.spectra['fft_position'] = abs(fft_position[:half])
+        popt_angle, pcov_angle = self.scan_fit(time, angle,
+                                               amp_range = (0, np.max(abs(angle)) + 0.3))
+        popt_position, pcov_position = self.scan_fit(time, position,
+                                                     amp_range = (np.max(abs(position)) - 5,
+                                                                  np.max(abs(position)) + 5))
+        return popt_angle[2], np.sqrt(pcov_angle[2, 2]), \
+            popt_position[2], np.sqrt(pcov_position[2, 2]), \
+                mean(self.phase_list), stdev(self.phase_list)
+
     def scan_plot(self, file, block = True, auto_scan = False):
         '''Plot two graphs:
         1. The angle-time graph with best fit line and parameters
@@ -622,11 +898,22 @@ class data_analysis():
                         flag_request = False
                 except (ValueError, AssertionError):
                     print('Invalid input, please try again or press n to skip file')
+                except RuntimeError:
+                    print('The fit did not converge, please adjust the time range or press n to skip file')
+
+    def scan_data_row(self, exp_data, file):
+        '''Row of scan_data.csv'''
+        return [file,
+                os.path.split(self.dirc)[1],
+                float(self.properties['omega']),
+                float(self.properties['amp_0']),
+                exp_data[0], exp_data[1],
+                exp_data[2], exp_data[3],
+                exp_data[4], exp_data[5]]
 
     def save_scan_data(self, exp_data, file):
         '''Save the scan data to a csv file'''
         parent_dir = os.path.dirname(self.dirc)
-        current_dir_name = os.path.split(self.dirc)[1]
         csv_dir = parent_dir + '\\scan_data.csv' # Free to change the name of the csv file
         flag = True
         
@@ -636,23 +923,8 @@ class data_analysis():
         with open(csv_dir, 'a', newline = '') as csvfile:
             writer = csv.writer(csvfile)
             if(flag):
-                writer.writerow(['file_name',
-                                 'parent_dir',
-                                 'driving_freq',
-                                 'amp_0',
-                                 'response_amp', 
-                                 'response_amp_err', 
-                                 'driving_amp', 
-                                 'driving_amp_err', 
-                                 'phase', 
-                                 'phase_err'])
-            writer.writerow([file,
-                             current_dir_name,
-                             float(self.properties['omega']), 
-                             float(self.properties['amp_0']), 
-                             exp_data[0], exp_data[1], 
-                             exp_data[2], exp_data[3], 
-                             exp_data[4], exp_data[5]])
+                writer.writerow(SCAN_DATA_HEADER)
+            writer.writerow(self.scan_data_row(exp_data, file))
             csvfile.close()
             
     def measure_fit(self, time, angle,
@@ -661,19 +933,24 @@ class data_analysis():
                     phi_range = (0, 2 * np.pi), # search range for phase, in rad
                     amp_range = (1.7, 3), # search range for amplitude
                     offset_range = (-0.4, 0.4), # search range for offset
-                    maxfev = 200000000, # maximum number of iterations
+                    maxfev = 2000, # maximum number of function evaluations
                     ):
         '''Fit the decaying sinusoidal exponential to the data,
-        and return the optimized parameters and the covariance matrix'''
-        popt, pcov = curve_fit(damp_sin, time, angle, 
-                            p0 = [0.5*(gamma_range[0] + gamma_range[1]), 
-                                  0.5*(f_range[0] + f_range[1]), 
-                                  0.5*(phi_range[0] + phi_range[1]), 
-                                  0.5*(amp_range[0] + amp_range[1]), 
-                                  0.5*(offset_range[0] + offset_range[1])], 
-                            bounds = ((gamma_range[0], f_range[0], phi_range[0], amp_range[0], offset_range[0]), 
-                                    (gamma_range[1], f_range[1], phi_range[1], amp_range[1], offset_range[1])),
-                                    maxfev = maxfev)
+        and return the optimized parameters and the covariance matrix. The fit
+        starts from the fft peak frequency, the damping factor of the log envelope
+        and the linear least squares amplitude, phase and offset.'''
+        omega = peak_freq(time, angle, f_range)
+        gamma = decay_seed(time, angle, omega, np.mean(angle))
+        if(gamma is None):
+            gamma = 0.5*(gamma_range[0] + gamma_range[1])
+        gamma = np.clip(gamma, *gamma_range)
+        amp, phi, offset = sine_seed(time, angle, omega, gamma)
+        popt, pcov, nfev, seconds = seeded_fit(damp_sin, damp_sin_jac, time, angle,
+            p0 = [gamma, omega, phi, amp, offset],
+            bounds = ((gamma_range[0], f_range[0], phi_range[0], amp_range[0], offset_range[0]), 
+                      (gamma_range[1], f_range[1], phi_range[1], amp_range[1], offset_range[1])),
+            maxfev = maxfev)
+        self.report_fit('measure_fit', nfev, seconds)
         return popt, pcov    
     
     def measure_init(self, 
@@ -753,19 +1030,33 @@ class data_analysis():
         if(self.temp_data[0][0] >= start_time):
             print("Invalid time range input")
             return None
-        for i in range(len(self.temp_data[0])):
-            if(self.temp_data[0][i] <= start_time):
-                start_index = i
-            if(self.temp_data[0][i] >= end_time):
-                end_index = i
-                break
-            end_index = -1
+        start_index, end_index = self.time_range(start_time, end_time)
         exp_data = self.measure_init(restore = True, process = True, start_index = start_index, end_index = end_index)
         plt.show(block = True)
         for txt in self.txt_list:
             txt.remove()
         return exp_data
     
+    def measure_batch(self, start_time, end_time):
+        '''Same results as measure_process() without any figure'''
+        self.fft_length = int((end_time - start_time) / self.sampling_div)
+        if(self.temp_data[0][0] >= start_time):
+            return None
+        start_index, end_index = self.time_range(start_time, end_time)
+        time = self.temp_data[0][start_index:end_index]
+        angle = self.temp_data[1][start_index:end_index]
+        fft_angle, _, fft_freq, _ = self.general_fft(
+            time, angle, self.temp_data[2][start_index:end_index],
+            self.fft_length, self.sampling_div)
+        half = int((len(fft_freq)+1)/2)
+        self.spectra = {'fft_freq': fft_freq[:half], 'fft_angle': abs(fft_angle[:half])}
+        peaks, _ = find_peaks(self.spectra['fft_angle'], height = 0.8)
+        if(len(peaks) != 1):
+            return None
+        popt, pcov = self.measure_fit(time, angle)
+        res = (1/(self.temp_data[0][end_index-1] - self.temp_data[0][start_index]))
+        return peaks[0], 0.5*res, popt[1], np.sqrt(pcov[1, 1]), popt[0], np.sqrt(pcov[0, 0])
+
     def measure_plot(self, file, block = True):
         '''Plot two graphs:
         1. The angle-time graph
@@ -810,11 +1101,16 @@ class data_analysis():
                         msg = input('Please enter y or n: ')
             except (ValueError, AssertionError):
                 print('Invalid input, please try again')
+            except RuntimeError:
+                print('The fit did not converge, please adjust the time range')
     
+    def measure_data_row(self, exp_data, file):
+        '''Row of measure_data.csv'''
+        return [file, os.path.split(self.dirc)[1], *exp_data[:6]]
+
     def save_measure_data(self, exp_data, file):
         '''Save the measure data to a csv file'''
         parent_dir = os.path.dirname(self.dirc)
-        current_dir_name = os.path.split(self.dirc)[1]
         csv_dir = parent_dir + '\\measure_data.csv'
         flag = True
         
@@ -824,22 +1120,8 @@ class data_analysis():
         with open(csv_dir, 'a', newline = '') as csvfile:
             writer = csv.writer(csvfile)
             if(flag):
-                writer.writerow(['file_name',
-                                 'parent_dir',
-                                 'omega_peak',
-                                 'omega_peak_err',
-                                 'omega_fit',
-                                 'omega_fit_err',
-                                 'gamma_fit',
-                                 'gamma_fit_err'])
-            writer.writerow([file,
-                             current_dir_name,
-                             exp_data[0],
-                             exp_data[1],
-                             exp_data[2],
-                             exp_data[3],
-                             exp_data[4],
-                             exp_data[5]])
+                writer.writerow(MEASURE_DATA_HEADER)
+            writer.writerow(self.measure_data_row(exp_data, file))
             csvfile.close()
     
     def main(self):
@@ -879,11 +1161,60 @@ class data_analysis():
             
         else:
             return
+
+    def batch(self, dirc, config_file = None, workers = None):
+        '''Analyses all the files of dirc in a process pool, without any figure or
+        prompt. The time ranges come from the config file (see BATCH_CONFIG). The
+        results are cached by file content and settings in the analysis_cache folder
+        next to dirc, so only new or changed files are analysed again, and the rows
+        of dirc in scan_data.csv or measure_data.csv are rebuilt from the cache.'''
+        if(not self.load_csv(dirc) or not self.check_csv_type()):
+            return
+        if(self.data_flag_dict['pid']):
+            print("PID data processing is not implemented yet")
+            return
+        data_type = 'measure' if self.data_flag_dict['measure'] else 'scan'
+        config = load_batch_config(config_file)
+        cache_dir = os.path.dirname(self.dirc) + '\\analysis_cache'
+        os.makedirs(cache_dir, exist_ok = True)
+        files = sorted(self.csv_list)
+        results = {}
+        tasks = []
+        keys = []
+        for file in files:
+            settings = batch_settings(config, data_type, file)
+            key = cache_key(self.dirc + '\\' + file, settings)
+            cached = load_cache(cache_dir, key) if config["cache"] else None
+            if(cached is None):
+                tasks.append((self.dirc, file, data_type, settings))
+                keys.append(key)
+            else:
+                results[file] = cached[0]
+        if(len(tasks) > 0):
+            with ProcessPoolExecutor(max_workers = workers) as pool:
+                for task, key, (row, spectra) in zip(tasks, keys, pool.map(batch_task, tasks)):
+                    results[task[1]] = row
+                    save_cache(cache_dir, key, row, spectra)
+        rows = [results[file] for file in files if results[file] is not None]
+        csv_dir = os.path.dirname(self.dirc) + '\\' + data_type + '_data.csv'
+        write_rows(csv_dir, SCAN_DATA_HEADER if data_type == 'scan' else MEASURE_DATA_HEADER,
+                   rows, os.path.split(self.dirc)[1])
+        print("%d of %d files saved to %s, %d analysed and %d from the cache" \
+            % (len(rows), len(files), csv_dir, len(tasks), len(files) - len(tasks)))
         
 if __name__ == '__main__':
     '''Currently not compatible with multiple frequency assessment'''
+    parser = argparse.ArgumentParser(description = 'Analysis of the measure and scan csv files, '
+                                     'interactive unless --batch is given')
+    parser.add_argument('--batch', metavar = 'DIR', help = 'directory of csv files analysed without any prompt')
+    parser.add_argument('--config', help = 'json file with the time ranges of the batch mode')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes, defaults to the cpu count')
+    args = parser.parse_args()
     data = data_analysis()
-    data.main()
+    if(args.batch is None):
+        data.main()
+    else:
+        data.batch(args.batch, args.config, args.workers)
         
 # TODO: add the axes labels and titles
 # TODO: add fft_plot
\ No newline at end of file
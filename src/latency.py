@@ -0,0 +1,104 @@
+'''Latency records of the cart_pendulum control loop. Every stage only appends its
+durations to an array, the percentiles and histograms are computed when the
+records are dumped next to the run export. A disabled log does nothing.'''
+import numpy as np
+import array, json, time
+
+# Stages recorded by the reader thread (per line or block) and the main loop (per frame)
+STAGES = {
+    "arrival": "host arrival minus board time of every sample, relative to the smallest (queueing delay, needs a board running in real time); "
+               "with block reads all the samples of a block share the arrival time of the block, so the spread within a block is included",
+    "parse": "parsing of a line or block by data_frame",
+    "append": "append_data() or append_block()",
+    "copy": "live_data.copy() of the reader buffer",
+    "plot": "init_plot() and real_time_plot(), the fft and the headless pace included",
+    "phase": "NR_update() or NR_phase_calc()",
+    "send": "send_message() of the NR amplitude and phase",
+    "sample_to_send": "arrival of the newest sample used by a frame to the NR message sent",
+}
+HIST_BINS = np.logspace(-6, 1, 71) # 1 us to 10 s, 10 bins per decade
+
+class latency_log():
+
+    '''Durations in seconds of every stage. The reader thread and the main loop
+    append to different arrays, so no lock is needed.'''
+
+    def __init__(self, enabled = True):
+        self.enabled = enabled
+        self.block_arrival = False # samples stamped per block, by the block or shared reader
+        self.clear()
+
+    def clear(self):
+        self.records = {stage: array.array('d') for stage in STAGES}
+        self.last_receive = None # host time the newest sample arrived
+        self.offset = None # host time minus board time of the first sample
+        self.frame_receive = None
+        self.lap_time = None
+
+    def record(self, stage, seconds):
+        if(self.enabled):
+            self.records[stage].append(seconds)
+
+    def samples(self, board_time, received, parsed, appended):
+        '''Reader thread: samples with the board times board_time (one or many)
+        received at the host time received, parsed and appended after'''
+        if(not self.enabled):
+            return
+        lag = received - np.atleast_1d(board_time)
+        if(self.offset is None):
+            self.offset = lag[0]
+        self.records["arrival"].extend((lag - self.offset).tolist())
+        self.records["parse"].append(parsed - received)
+        self.records["append"].append(appended - parsed)
+        self.last_receive = received
+
+    def frame(self):
+        '''Main loop: starts a frame, the newest sample is the last one received'''
+        if(self.enabled):
+            self.frame_receive = self.last_receive
+            self.lap_time = time.perf_counter()
+
+    def lap(self, stage):
+        '''Main loop: records the time since the last frame() or lap() as stage'''
+        if(self.enabled and self.lap_time is not None):
+            now = time.perf_counter()
+            self.records[stage].append(now - self.lap_time)
+            self.lap_time = now
+
+    def sent(self):
+        '''Main loop: the NR message is sent, ends the send stage and the
+        sample_to_send latency of the frame'''
+        if(self.enabled and self.lap_time is not None):
+            self.lap("send")
+            if(self.frame_receive is not None):
+                self.records["sample_to_send"].append(self.lap_time - self.frame_receive)
+
+    def summary(self):
+        '''Count, percentiles and histogram (over HIST_BINS) of every stage'''
+        summary = {}
+        for stage, records in self.records.items():
+            values = np.array(records, dtype = float) # a copy, the reader thread may still append
+            if(stage == "arrival" and len(values) > 0):
+                values = values - values.min()
+            if(len(values) == 0):
+                summary[stage] = {"count": 0, "description": STAGES[stage]}
+                continue
+            counts, _ = np.histogram(values, HIST_BINS)
+            summary[stage] = {
+                "description": STAGES[stage],
+                "count": len(values),
+                "mean_s": float(np.mean(values)),
+                "median_s": float(np.median(values)),
+                "p90_s": float(np.percentile(values, 90)),
+                "p99_s": float(np.percentile(values, 99)),
+                "max_s": float(np.max(values)),
+                "histogram": counts.tolist(),
+            }
+        return summary
+
+    def dump(self, file_name, module_name = ""):
+        '''Writes the summary and the histograms to a json file'''
+        with open(file_name, 'w') as file:
+            json.dump({"module_name": module_name, "block_arrival": self.block_arrival,
+                       "hist_bins_s": HIST_BINS.tolist(), "stages": self.summary()}, file, indent = 1)
+            file.close()
@@ -1,3 +1,4 @@
+import numpy as np
 # Initialisation of some constants and variables
 port = 'COM6' 
 baudrate = 230400
@@ -36,4 +37,36 @@ class data_frame():
                 self.position_velocity = float(data[4])
         except TypeError:
             pass
+    
+    def update_block(self, 
+                     lines,
+                     appendPos = True,
+                     appendVel = False):
+        '''Parse a block of lines from arduino.read_block() in one go. The samples
+        are stored in self.block with one row per sample and the columns time, angle
+        (, position (, angular_velocity, position_velocity)). Lines that are not
+        samples (e.g. DEBUG messages) are dropped instead of the whole block.'''
+        num_col = 2
+        if(appendPos):
+            num_col = 3
+        if(appendVel):
+            num_col = 5
+        if(len(lines) == 0):
+            self.block = np.zeros((0, num_col))
+            return
+        try:
+            self.block = np.loadtxt(lines, delimiter = ',', usecols = range(num_col), ndmin = 2)
+        except ValueError:
+            # Slow path, only taken when a non-numeric line is mixed into the block
+            rows = []
+            for line in lines:
+                try:
+                    row = [float(i) for i in line.split(',')[:num_col]]
+                except ValueError:
+                    continue
+                if(len(row) == num_col):
+                    rows.append(row)
+            self.block = np.array(rows, dtype = float).reshape(-1, num_col)
+        if(len(self.block) > 0):
+            self.update_data(self.block[-1], appendPos = appendPos, appendVel = appendVel)
          
\ No newline at end of file
@@ -0,0 +1,287 @@
+'''Replays a recorded run through the live processing of data_process (append_data,
+fft, NR_phase_calc, NR_update) without the board, the figure or any waiting. The
+phase and amplitude trajectories are what the console would have computed during
+the run, and every call is timed. Used to compare changes of the NR algorithm
+offline and to benchmark the live pipeline far above the sample rate of the rig.
+
+python replay.py <run.csv | run.bin | serial capture or log> [--module NR] [--fft_length 512] ...'''
+import numpy as np
+import time, os, csv, json, argparse
+from data_process import data, HEADLESS_FRAME_TIME
+from moment_data_process import data_frame
+from run_format import load_run
+from serial_capture import MAGIC, received_lines
+
+MODULES = ("measure", "freq_scan", "auto_freq_scan", "NR", "pid")
+
+def read_header(rows):
+    '''Settings of the run from the csv header rows (see data.csv_header())'''
+    settings = {}
+    for row in rows:
+        try:
+            if(row[0] == "start_time"):
+                settings["start_time"] = float(row[1])
+            elif(row[0] == "omega"):
+                settings["omega"] = float(row[1])
+            elif(row[0] == "multiple_omega"):
+                settings["omega_list"] = [float(i) for i in row[1:]]
+            elif(row[0] == "amplitude"):
+                settings["amp"] = float(row[1])
+                settings["amp_0"] = float(row[3])
+        except (IndexError, ValueError):
+            pass
+    return settings
+
+def parse_lines(lines):
+    '''Samples of the lines printed by the board, the other lines (menu, prompts,
+    DEBUG) are dropped like data_frame.update_block() does'''
+    rows = []
+    for line in lines:
+        try:
+            row = [float(i) for i in line.split(',')]
+        except ValueError:
+            continue
+        if(len(row) >= 2):
+            rows.append((row + [0.] * 5)[:5])
+    return np.array(rows, dtype = float).reshape(-1, 5)
+
+def load_samples(file_name):
+    '''Returns the settings found in the file and the samples, one row per sample
+    with the columns time (board time), angle, position, angular_velocity and
+    cart_velocity. Takes an exported run (the binary copy if it is there), a
+    serial capture (see serial_capture.py) or a text log of the serial lines.'''
+    basename, extension = os.path.splitext(file_name)
+    if(extension in ('.csv', '.bin', '.json')):
+        if(os.path.exists(basename + '.json') and os.path.exists(basename + '.bin')):
+            header, samples = load_run(basename)
+            samples = np.array(samples)
+        else:
+            with open(file_name, 'r') as file:
+                header = []
+                for row in csv.reader(file):
+                    header.append(row)
+                    if(len(row) > 0 and row[0] == "time"):
+                        break
+                samples = np.loadtxt(file, delimiter = ',', usecols = range(5), ndmin = 2)
+                file.close()
+        settings = read_header(header)
+        # the exported time is relative to the start_time
+        samples[:, 0] += settings.get("start_time", 0.)
+    else:
+        with open(file_name, 'rb') as file:
+            content = file.read()
+            file.close()
+        if(content.startswith(MAGIC)):
+            samples = parse_lines(received_lines(file_name))
+        else:
+            samples = parse_lines(content.decode('ASCII', 'replace').splitlines())
+        settings = {}
+    module_name = os.path.basename(basename).split('-')[0]
+    if(module_name in MODULES):
+        settings["module_name"] = module_name
+    return settings, samples
+
+class replay():
+
+    '''Feeds the samples of a run to a headless data class the way the reader thread
+    and the main loop of cart_pendulum do: every sample goes through append_data()
+    (or append_block() with batch_read), and every frame_time seconds of board time
+    the main loop computations run (headless_update() then NR_phase_calc() or
+    NR_update()). speed = None replays as fast as possible, otherwise speed times
+    faster than the recording.'''
+
+    def __init__(
+        self,
+        module_name = "NR",
+        fft_length = 512,
+        sampling_div = 0.04,
+        wait_to_stable = 1,
+        frame_time = HEADLESS_FRAME_TIME, # board time between two iterations of the main loop
+        NR_scan = False,
+        interpolation = True,
+        manual = False, # False for the automatic NR feedback of the console
+        lock_in = False,
+        batch_read = False,
+        speed = None,
+        ):
+        self.module_name = module_name
+        self.fft_length = fft_length
+        self.sampling_div = sampling_div
+        self.wait_to_stable = wait_to_stable
+        self.frame_time = frame_time
+        self.NR_scan = NR_scan
+        self.interpolation = interpolation
+        self.manual = manual
+        self.lock_in = lock_in
+        self.batch_read = batch_read
+        self.speed = speed
+        self.scan = module_name != "NR" or NR_scan
+        self.appendPos = module_name != "measure"
+        self.appendVel = module_name == "pid"
+        self.timings = {}
+        self.trajectory = []
+        self.messages = [] # amp,phase messages the console would have sent to the board
+
+    def timed(self, name, function, *args):
+        '''Calls function(*args) and records the call time under name'''
+        start = time.perf_counter()
+        result = function(*args)
+        self.timings.setdefault(name, []).append(time.perf_counter() - start)
+        return result
+
+    def init_data(self, settings):
+        '''Headless data class set up as the console does before the reader starts'''
+        self.datum = data(self.fft_length, self.sampling_div, self.wait_to_stable, headless = True)
+        self.datum.module_name = self.module_name
+        self.datum.omega = settings.get("omega", self.datum.omega)
+        self.datum.amp = settings.get("amp", self.datum.amp)
+        self.datum.amp_0 = settings.get("amp_0", self.datum.amp_0)
+        if(settings.get("omega_list") is not None):
+            self.datum.omega_list = np.asarray(settings["omega_list"])
+            self.datum.omega_num = len(self.datum.omega_list)
+            self.datum.omega = self.datum.omega_list[-1]
+        if(self.module_name in ("NR", "freq_scan", "auto_freq_scan")):
+            self.datum.flag_lock_in = self.lock_in
+            self.datum.init_phase_lists(self.scan)
+        self.df = data_frame()
+        self.NR_counter = 0
+
+    def append(self, samples):
+        '''The reader thread part, samples of one frame'''
+        if(self.batch_read):
+            self.df.block = samples[:, :2 + self.appendPos + 2 * self.appendVel]
+            self.df.update_data(samples[-1], self.appendPos, self.appendVel)
+            self.timed("append_block", self.datum.append_block, self.df, self.appendPos, self.appendVel)
+        else:
+            for row in samples:
+                self.df.update_data(row, self.appendPos, self.appendVel)
+                self.timed("append_data", self.datum.append_data, self.df, self.appendPos, self.appendVel)
+
+    def frame(self):
+        '''The main loop part, as in cart_pendulum.NR() and freq_scan()'''
+        datum = self.datum
+        self.timed("headless_update", datum.headless_update, self.module_name)
+        if(self.module_name == "NR"):
+            if(self.NR_counter >= self.wait_to_stable):
+                amp, phase = self.timed("NR_update", datum.NR_update, self.NR_scan,
+                                        self.interpolation, self.manual)
+                if(not self.manual and not self.NR_scan):
+                    self.messages.append((datum.time[datum.temp_index], amp, phase + np.pi))
+                self.NR_counter = 0
+            else:
+                if(datum.omega_list is None):
+                    self.timed("NR_phase_calc", datum.NR_phase_calc, datum.omega,
+                               self.NR_scan, self.interpolation)
+                self.NR_counter += 1
+        elif(self.module_name in ("freq_scan", "auto_freq_scan")):
+            if(datum.omega_list is None):
+                self.timed("NR_phase_calc", datum.NR_phase_calc, datum.omega, True, True)
+            else:
+                self.timed("NR_update", datum.NR_update, True, True)
+        else:
+            return
+        if(datum.omega_list is None):
+            if(datum.phase_list[-1][0] > 0 and (len(self.trajectory) == 0 \
+                or datum.phase_list[-1][0] != self.trajectory[-1][0])):
+                row = [datum.phase_list[-1][0], datum.phase_list[-1][1], datum.amp]
+                if(not self.scan):
+                    row.append(datum.phase_list_active[-1][1])
+                self.trajectory.append(row)
+        elif(datum.multi_phase_list[0][-1][0] > 0 and (len(self.trajectory) == 0 \
+            or datum.multi_phase_list[0][-1][0] != self.trajectory[-1][0])):
+            self.trajectory.append([datum.multi_phase_list[0][-1][0]] + \
+                [i[-1][1] for i in datum.multi_phase_list])
+
+    def run(self, samples, settings = None):
+        '''Replays the samples (one row per sample, board time first) and returns
+        the trajectory as an array'''
+        self.init_data(settings or {})
+        self.timings = {}
+        self.trajectory = []
+        self.messages = []
+        # frame boundaries in board time, the samples of a frame are appended at once
+        frame_index = np.floor((samples[:, 0] - samples[0, 0]) / self.frame_time).astype(int)
+        ends = np.append(np.flatnonzero(np.diff(frame_index)) + 1, len(samples))
+        start_wall = time.perf_counter()
+        start = 0
+        for end in ends:
+            if(self.speed is not None):
+                delay = start_wall + (samples[end - 1, 0] - samples[0, 0]) / self.speed - time.perf_counter()
+                if(delay > 0):
+                    time.sleep(delay)
+            self.append(samples[start:end])
+            self.frame()
+            start = end
+        self.wall_time = time.perf_counter() - start_wall
+        self.num_samples = len(samples)
+        return np.array(self.trajectory)
+
+    def summary(self):
+        '''Call counts and times in microseconds of every timed function'''
+        summary = {
+            "module_name": self.module_name,
+            "num_samples": self.num_samples,
+            "board_time": float(self.datum.time[self.datum.temp_index]),
+            "wall_time": self.wall_time,
+            "samples_per_second": self.num_samples / self.wall_time,
+            "calls": {},
+        }
+        for name, times in self.timings.items():
+            times = np.array(times) * 1e6
+            summary["calls"][name] = {
+                "count": len(times),
+                "total_s": float(np.sum(times) * 1e-6),
+                "mean_us": float(np.mean(times)),
+                "median_us": float(np.median(times)),
+                "p99_us": float(np.percentile(times, 99)),
+                "max_us": float(np.max(times)),
+            }
+        return summary
+
+    def export(self, basename):
+        '''Writes the trajectory to basename-replay.csv and the timings to
+        basename-replay.json'''
+        with open(basename + '-replay.csv', 'w', newline = '') as csvfile:
+            writer = csv.writer(csvfile)
+            if(self.datum.omega_list is not None):
+                writer.writerow(['time/s', *('phase/pi@%.3fHz' % i for i in self.datum.omega_list)])
+            elif(self.scan):
+                writer.writerow(['time/s', 'phase/pi', 'amplitude/steps'])
+            else:
+                writer.writerow(['time/s', 'phase/pi', 'amplitude/steps', 'phase_active/pi'])
+            writer.writerows(self.trajectory)
+            csvfile.close()
+        with open(basename + '-replay.json', 'w') as file:
+            json.dump(self.summary(), file, indent = 1)
+            file.close()
+
+if(__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description = "Replay a recorded run through the live processing")
+    parser.add_argument("file", help = "exported run (csv or bin), serial capture or text log of the serial lines")
+    parser.add_argument("--module", default = None, help = "module of the run, guessed from the file name otherwise")
+    parser.add_argument("--fft_length", type = int, default = 512)
+    parser.add_argument("--sampling_div", type = float, default = 0.04)
+    parser.add_argument("--wait_to_stable", type = int, default = 1)
+    parser.add_argument("--frame_time", type = float, default = HEADLESS_FRAME_TIME)
+    parser.add_argument("--omega", type = float, default = None, help = "driving frequency in Hz, read from the header otherwise")
+    parser.add_argument("--manual", action = "store_true", help = "no automatic NR feedback")
+    parser.add_argument("--lock_in", action = "store_true")
+    parser.add_argument("--batch_read", action = "store_true")
+    parser.add_argument("--speed", type = float, default = None, help = "replay speed, as fast as possible by default")
+    args = parser.parse_args()
+
+    settings, samples = load_samples(args.file)
+    if(args.omega is not None):
+        settings["omega"] = args.omega
+    player = replay(module_name = args.module or settings.get("module_name", "NR"),
+                    fft_length = args.fft_length,
+                    sampling_div = args.sampling_div,
+                    wait_to_stable = args.wait_to_stable,
+                    frame_time = args.frame_time,
+                    manual = args.manual,
+                    lock_in = args.lock_in,
+                    batch_read = args.batch_read,
+                    speed = args.speed)
+    player.run(samples, settings)
+    player.export(os.path.splitext(args.file)[0])
+    print(json.dumps(player.summary(), indent = 1))
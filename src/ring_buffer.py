@@ -0,0 +1,116 @@
+import numpy as np
+
+class ring_buffer():
+
+    '''Circular buffer storing all the recorded columns in a single 2-D array,
+    one row per field and one column per slot. The first `window` slots are
+    mirrored behind the end of the buffer, so the latest `window` samples can
+    always be read as a contiguous view without doubling the whole buffer.'''
+
+    def __init__(
+        self,
+        length,
+        fields = ('time', 'angle', 'position', 'angular_velocity', 'position_velocity'),
+        window = 512, # Maximum number of latest samples available as a view
+        ):
+        self.length = length
+        self.fields = list(fields)
+        self.window = min(window, length)
+        self.data = np.zeros((len(self.fields), length + self.window))
+        self.index = 0 # Total number of samples written since the last clear
+        self.temp_index = 0 # Slot of the latest sample
+
+    def __getitem__(self, field):
+        '''Returns the storage row of a single field, indexed by slot'''
+        return self.data[self.fields.index(field)]
+
+    def __len__(self):
+        '''Number of valid samples in the buffer'''
+        return min(self.index, self.length)
+
+    def clear(self):
+        '''Clears the buffer in place'''
+        self.data[:] = 0.
+        self.index = 0
+        self.temp_index = 0
+
+    def rows(self, fields = None):
+        '''Returns the row numbers of the given fields, all the fields by default'''
+        if(fields is None):
+            return list(range(len(self.fields)))
+        return [self.fields.index(field) for field in fields]
+
+    def append(self, values, fields = None):
+        '''Appends a single sample, values are in the order of fields'''
+        slot = self.index % self.length
+        for row, value in zip(self.rows(fields), values):
+            self.data[row, slot] = value
+            if(slot < self.window):
+                self.data[row, slot + self.length] = value
+        self.index += 1
+        self.temp_index = slot
+
+    def extend(self, block, fields = None):
+        '''Appends a block of samples at once, one row per sample and one
+        column per field'''
+        block = np.asarray(block, dtype = float)
+        if(len(block) == 0):
+            return
+        if(len(block) > self.length):
+            # Only the latest samples survive anyway
+            self.index += len(block) - self.length
+            block = block[-self.length:]
+        slots = (self.index + np.arange(len(block))) % self.length
+        rows = np.array(self.rows(fields))[:, None]
+        self.data[rows, slots] = block.T
+        mirror = slots < self.window
+        self.data[rows, slots[mirror] + self.length] = block.T[:, mirror]
+        self.index += len(block)
+        self.temp_index = slots[-1]
+
+    def write(self, field, slots, values):
+        '''Overwrites one field at the given slots, keeping the mirrored window
+        in step'''
+        slots = np.asarray(slots)
+        values = np.asarray(values, dtype = float)
+        row = self[field]
+        row[slots] = values
+        mirror = slots < self.window
+        row[slots[mirror] + self.length] = values[mirror]
+
+    def latest_slice(self, num):
+        '''Returns the slice of the storage holding the latest num samples in
+        chronological order. num is limited by the window length.'''
+        num = min(num, len(self), self.window)
+        end = self.temp_index + 1
+        if(end >= num):
+            return slice(end - num, end)
+        else:
+            return slice(end - num + self.length, end + self.length)
+
+    def latest(self, num, field = None):
+        '''Returns a view of the latest num samples of one or all the fields'''
+        if(field is None):
+            return self.data[:, self.latest_slice(num)]
+        return self[field][self.latest_slice(num)]
+
+    def unroll(self, field = None, index = None):
+        '''Returns the valid samples of one or all the fields in chronological order.
+        This is a view until the buffer wraps around, and a copy after that. index is
+        the number of samples to consider, defaults to all the written samples.'''
+        if(index is None):
+            index = self.index
+        if(field is None):
+            data = self.data
+        else:
+            data = self[field]
+        if(index <= self.length):
+            return data[..., :index]
+        start = index % self.length
+        return np.concatenate((data[..., start:self.length], data[..., :start]), axis = -1)
+
+    def physical(self, chrono_index, index = None):
+        '''Converts chronological indices of unroll() into slots of the storage'''
+        if(index is None):
+            index = self.index
+        return (index - min(index, self.length) + np.asarray(chrono_index)) % self.length
@@ -0,0 +1,40 @@
+'''Binary copy of a run: the samples as raw little-endian float64 in a .bin file,
+one row per sample, and the csv header rows plus the array layout in a .json
+sidecar. The .bin can be memory-mapped directly, nothing has to be parsed.'''
+import numpy as np
+import json
+
+DTYPE = '<f8'
+
+def write_metadata(basename, header, num_samples):
+    '''Writes the .json sidecar, header are the csv header rows with the column
+    names as the last row'''
+    metadata = {
+        "dtype": DTYPE,
+        "shape": [int(num_samples), len(header[-1])],
+        "columns": list(header[-1]),
+        "header": [[str(item) for item in row] for row in header[:-1]], # as written in the csv
+    }
+    with open(basename + '.json', 'w') as file:
+        json.dump(metadata, file, indent = 1)
+        file.close()
+
+def save_run(basename, header, samples):
+    '''Writes the samples (one row per sample) to basename.bin and the sidecar'''
+    samples = np.ascontiguousarray(samples, dtype = DTYPE)
+    samples.tofile(basename + '.bin')
+    write_metadata(basename, header, len(samples))
+
+def load_run(basename, mode = 'c'):
+    '''Returns the header rows and the samples memory-mapped with the shape
+    (num_samples, num_columns). The default copy-on-write mode allows changing the
+    array in memory without touching the file.'''
+    with open(basename + '.json', 'r') as file:
+        metadata = json.load(file)
+        file.close()
+    shape = tuple(metadata["shape"])
+    if(shape[0] == 0):
+        samples = np.zeros(shape, dtype = metadata["dtype"])
+    else:
+        samples = np.memmap(basename + '.bin', dtype = metadata["dtype"], mode = mode, shape = shape)
+    return metadata["header"] + [metadata["columns"]], samples
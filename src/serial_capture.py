@@ -0,0 +1,164 @@
+'''Raw capture of the serial traffic and a board replaying it. A capture file starts
+with MAGIC and holds one record per read or write: the host time (time.time()),
+the direction (RECEIVED or SENT), the number of bytes and the bytes themselves.
+tee_port records everything going through a port, replay_board plays the received
+bytes back through the serial.Serial interface used by the arduino class.'''
+import numpy as np
+import struct, time, threading
+
+MAGIC = b"PNDCAP1\n"
+RECORD = struct.Struct('<dBI') # time, direction, length
+RECEIVED = 0
+SENT = 1
+
+def read_capture(file_name):
+    '''Returns the records of a capture as a list of (time, direction, bytes)'''
+    with open(file_name, 'rb') as file:
+        content = file.read()
+        file.close()
+    if(not content.startswith(MAGIC)):
+        raise ValueError(file_name + " is not a serial capture")
+    records = []
+    offset = len(MAGIC)
+    while(offset + RECORD.size <= len(content)):
+        stamp, direction, length = RECORD.unpack_from(content, offset)
+        offset += RECORD.size
+        records.append((stamp, direction, content[offset:offset + length]))
+        offset += length
+    return records
+
+def received_lines(file_name):
+    '''Lines received from the board in a capture, without line endings'''
+    data = b"".join(i[2] for i in read_capture(file_name) if i[1] == RECEIVED)
+    return data.decode('ASCII', 'replace').splitlines()
+
+class tee_port():
+
+    '''Wraps a serial port and appends every byte read from or written to it to a
+    capture file, with the host time of the call. Everything else is passed to
+    the port.'''
+
+    def __init__(self, port, file_name):
+        self.port = port
+        self.file = open(file_name, 'ab')
+        if(self.file.tell() == 0):
+            self.file.write(MAGIC)
+        self.lock = threading.Lock() # reader and writer threads share the file
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+    def record(self, direction, data):
+        if(len(data) > 0):
+            with self.lock:
+                self.file.write(RECORD.pack(time.time(), direction, len(data)) + data)
+
+    def read(self, size = 1):
+        data = self.port.read(size)
+        self.record(RECEIVED, data)
+        return data
+
+    def readline(self):
+        data = self.port.readline()
+        self.record(RECEIVED, data)
+        return data
+
+    def write(self, data):
+        self.record(SENT, data)
+        return self.port.write(data)
+
+    def close(self):
+        self.port.close()
+        with self.lock:
+            self.file.close()
+
+class replay_board():
+
+    '''Stand-in of the serial port playing back the received bytes of a capture.
+    The chunks become available at their original host times, scaled down by speed
+    (None for everything at once). The bytes written by the host are kept in
+    self.sent, they do not change what is played back. Reading past the end of the
+    capture raises IOError.'''
+
+    def __init__(
+        self,
+        file_name,
+        speed = 1.,
+        timeout = None, # read timeout in seconds, as serial.Serial
+        ):
+        records = [i for i in read_capture(file_name) if i[1] == RECEIVED]
+        self.data = b"".join(i[2] for i in records)
+        self.ends = np.cumsum([len(i[2]) for i in records]) # available bytes after each chunk
+        stamps = np.array([i[0] for i in records])
+        self.release = (stamps - stamps[0]) / speed if (speed is not None and len(records) > 0) \
+            else np.zeros(len(records))
+        self.timeout = timeout
+        self.position = 0 # bytes already read by the host
+        self.sent = []
+        self.is_open = True
+        self.start = time.perf_counter()
+
+    def available(self):
+        '''Number of bytes played back so far'''
+        chunks = np.searchsorted(self.release, time.perf_counter() - self.start, side = 'right')
+        return int(self.ends[chunks - 1]) if chunks > 0 else 0
+
+    def wait(self, ready):
+        '''Sleeps until ready() is true, the timeout runs out or the capture ends'''
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while(not ready() and self.is_open):
+            chunks = np.searchsorted(self.release, time.perf_counter() - self.start, side = 'right')
+            if(chunks >= len(self.release)):
+                break # nothing more to come
+            delay = self.start + self.release[chunks] - time.perf_counter()
+            if(deadline is not None):
+                delay = min(delay, deadline - time.perf_counter())
+                if(delay <= 0 and time.perf_counter() >= deadline):
+                    break
+            time.sleep(max(delay, 0.))
+
+    def check_end(self):
+        '''Raises IOError once everything is played back and read, like a port of
+        a disconnected board, so the host does not wait forever'''
+        if(self.position >= len(self.data)):
+            raise IOError("End of the serial capture.")
+
+    @property
+    def in_waiting(self):
+        self.check_end()
+        return self.available() - self.position
+
+    def read(self, size = 1):
+        self.check_end()
+        self.wait(lambda: self.available() - self.position >= size)
+        end = min(self.position + size, self.available())
+        data = self.data[self.position:end]
+        self.position = end
+        return data
+
+    def readline(self):
+        self.check_end()
+        self.wait(lambda: self.data.find(b"\n", self.position, self.available()) >= 0)
+        available = self.available()
+        end = self.data.find(b"\n", self.position, available) + 1
+        if(end == 0):
+            end = available
+        data = self.data[self.position:end]
+        self.position = end
+        return data
+
+    def write(self, data):
+        self.sent.append((time.perf_counter() - self.start, data))
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.position = self.available()
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
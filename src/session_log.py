@@ -0,0 +1,114 @@
+'''Streaming recorder of the samples, the run is written to disk while it is acquired'''
+import numpy as np
+import threading, queue, csv, io, os, shutil
+from run_format import write_metadata, DTYPE
+
+FLUSH_TIME = 1. # Seconds after which the waiting samples are written even if the chunk is not full
+
+class session_log():
+
+    '''Appends the samples to a csv file with the layout of data.export_csv(). The
+    reader thread only puts the parsed blocks into a queue, a background thread
+    formats and writes them in chunks. During the run the samples go to the part
+    file (filename + '.part', a csv file with the header known at the start), so the
+    run is kept if the program crashes. close() writes the final header followed by
+    the samples to filename and removes the part file.'''
+
+    def __init__(
+        self,
+        filename,
+        header, # list of header rows, the last one names the columns
+        num_header = None, # number of header rows of the file, defaults to len(header)
+        chunk_rows = 1024, # number of samples written at once
+        binary = True, # also append the samples to a .bin file, see run_format
+        ):
+        self.filename = filename
+        self.part_name = filename + '.part'
+        self.basename = filename[:-4] if filename.endswith('.csv') else filename
+        self.header = header
+        self.num_header = len(header) if num_header is None else num_header
+        self.chunk_rows = chunk_rows
+        self.file = open(self.part_name, 'wb')
+        self.file.write(self.header_lines(header))
+        self.header_size = self.file.tell() # bytes before the first sample
+        self.file.flush()
+        self.binary = open(self.basename + '.bin', 'wb') if binary else None
+        self.num_samples = 0
+        self.queue = queue.Queue()
+        self.closed = False
+        self.writer = threading.Thread(target = self.thread_writer, daemon = True)
+        self.writer.start()
+
+    def header_lines(self, header):
+        '''Formats the header rows as csv.writer does in export_csv(), blank rows are
+        inserted before the last one to fill the number of header rows'''
+        if(len(header) > self.num_header):
+            raise ValueError("%d header rows do not fit in the %d reserved" % (len(header), self.num_header))
+        rows = header[:-1] + [[]] * (self.num_header - len(header)) + header[-1:]
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        return text.getvalue().encode('utf-8')
+
+    def write(self, block):
+        '''Queues a block of samples, one row per sample. Called by the reader thread.'''
+        if(not self.closed):
+            self.queue.put(np.array(block, dtype = float, ndmin = 2))
+
+    def thread_writer(self):
+        '''Writes the queued samples in chunks until close() is called'''
+        chunk = []
+        count = 0
+        flag_close = False
+        while(not flag_close):
+            flag_timeout = False
+            try:
+                block = self.queue.get(timeout = FLUSH_TIME)
+                if(block is None): # put by close()
+                    flag_close = True
+                else:
+                    chunk.append(block)
+                    count += len(block)
+            except queue.Empty:
+                flag_timeout = True
+            if(count > 0 and (count >= self.chunk_rows or flag_timeout or flag_close)):
+                chunk = np.concatenate(chunk)
+                np.savetxt(self.file, chunk, fmt = '%.12g',
+                           delimiter = ',', newline = '\r\n')
+                self.file.flush()
+                if(self.binary is not None):
+                    chunk.astype(DTYPE).tofile(self.binary)
+                    self.binary.flush()
+                self.num_samples += len(chunk)
+                chunk = []
+                count = 0
+
+    def close(self, header = None):
+        '''Writes the remaining samples, then the final header and the samples to the
+        csv file, through a temporary file. Safe to call more than once.'''
+        if(self.closed):
+            return
+        self.closed = True
+        self.queue.put(None) # marks the end
+        self.writer.join()
+        self.file.close()
+        lines = None
+        if(header is not None):
+            try:
+                lines = self.header_lines(header)
+            except ValueError as error:
+                print(error, "\nKeeping the header written at the start of the run.")
+        if(lines is None):
+            os.replace(self.part_name, self.filename)
+        else:
+            with open(self.filename + '.tmp', 'wb') as file, open(self.part_name, 'rb') as part:
+                file.write(lines)
+                part.seek(self.header_size)
+                shutil.copyfileobj(part, file, 1 << 20)
+                file.close()
+                part.close()
+            os.replace(self.filename + '.tmp', self.filename)
+            os.remove(self.part_name)
+        if(self.binary is not None):
+            self.binary.close()
+            write_metadata(self.basename, header if lines is not None else self.header,
+                           self.num_samples)
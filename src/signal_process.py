@@ -0,0 +1,285 @@
+'''Signal processing routines shared by the live data processing (data_process.py)
+and the offline analysis (final_data_analysis/csv_process.py)'''
+import numpy as np
+
+def previous_index(time, sampling_div, first = 0):
+    '''For every sample from first on, the index of the latest sample at least
+    sampling_div earlier (-1 if there is none). time has to be in chronological
+    order. The comparison is the one of the original fft_index_list() loop, so the
+    rounding of time - sampling_div cannot pick a different sample.'''
+    current = np.arange(first, len(time))
+    previous = np.searchsorted(time, time[first:] - sampling_div, side = 'right') - 1
+    while(True):
+        late = (previous >= 0) & (time[current] - time[np.maximum(previous, 0)] < sampling_div)
+        early = (previous + 1 < current) & (time[current] - time[np.minimum(previous + 1, current)] >= sampling_div)
+        if(not (np.any(late) or np.any(early))):
+            return previous
+        previous = previous - late + early
+
+def uniform_index_list(time, fft_length, sampling_div):
+    '''Since the sampled data might not be evenly spaced, pick almost evenly spaced
+    data points as the original loop did: going back from the latest sample, the
+    next point is the latest sample at least sampling_div before the point picked
+    last. The first sample is never picked, as in the loop. time has to be in
+    chronological order. Returns at most fft_length indices in ascending order and
+    the average spacing between them.'''
+    if(len(time) == 0):
+        return np.zeros(0, dtype = int), sampling_div
+    last = len(time) - 1
+    tail = min(len(time), 2 * fft_length)
+    while(True):
+        # the previous indices are only needed for the samples of the tail
+        first = len(time) - tail
+        previous = previous_index(time, sampling_div, first).tolist()
+        index_list = [last]
+        index = last
+        while(len(index_list) < fft_length and index >= first):
+            index = previous[index - first]
+            if(index < 1):
+                break
+            index_list.append(index)
+        if(len(index_list) == fft_length or index < 1 or first == 0):
+            break
+        tail = min(len(time), 2 * tail)
+    index_list = np.array(index_list[::-1], dtype = int)
+    if(len(index_list) > 1):
+        avg_spacing = (time[index_list[-1]] - time[index_list[0]]) / (len(index_list) - 1)
+    else:
+        avg_spacing = sampling_div
+    return index_list, avg_spacing
+
+def rectify_phase(phase):
+    '''Vectorised version of data_phy.phase_rectify(), shifts the phases to be
+    between 0.5 * pi and -1.5 * pi'''
+    phase = np.asarray(phase, dtype = float)
+    phase = phase - 2 * np.pi * np.trunc(phase / (2 * np.pi))
+    phase = np.where(phase > 0.5 * np.pi, phase - 2 * np.pi, phase)
+    return np.where(phase <= -1.5 * np.pi, phase + 2 * np.pi, phase)
+
+def interpolated_phase(fft_freq, fft_signal, fft_reference, omega, interpolation = True):
+    '''Phase of fft_signal relative to fft_reference (plus pi, rectified) at every
+    frequency in omega at once. Since omega might not be in the fft_freq array, the
+    phase is linearly interpolated between the closest bin and its neighbour on the
+    side of omega.'''
+    omega = np.atleast_1d(np.asarray(omega, dtype = float))
+    close_ind = np.argmin(np.abs(fft_freq[None, :] - omega[:, None]), axis = 1)
+    neighbour = np.where(fft_freq[close_ind] < omega, close_ind + 1, close_ind - 1)
+    neighbour = np.clip(neighbour, 0, len(fft_freq) - 1)
+    bins = np.concatenate((close_ind, neighbour))
+    delta = rectify_phase(np.angle(fft_signal[bins]) - np.angle(fft_reference[bins]) + np.pi)
+    phase_0, phase_1 = delta[:len(omega)], delta[len(omega):]
+    if(not interpolation):
+        return phase_0
+    span = fft_freq[neighbour] - fft_freq[close_ind]
+    exact = (fft_freq[close_ind] == omega) | (span == 0)
+    weight = np.where(exact, 0., (omega - fft_freq[close_ind]) / np.where(span == 0, 1., span))
+    return phase_0 + weight * (phase_1 - phase_0)
+
+class lock_in():
+    
+    '''Sliding single-frequency DFT (lock-in) of several channels at a set of
+    frequencies. A running cumulative sum of x * exp(-2i * pi * f * t) * dt is kept
+    for every sample, dt being the time since the previous sample, so unevenly
+    spaced samples are weighted by the time they stand for. The complex amplitude
+    over the latest window is the difference of two cumulative sums, the older one
+    interpolated in time at the start of the window. The window of each frequency
+    is the largest whole number of periods within window_time, so an offset does
+    not leak into it. Each new sample costs O(1) per channel and frequency.
+    Unlike the fft of the window, the sum is taken at the frequency itself, there
+    are no bins to interpolate between.'''
+    
+    def __init__(
+        self,
+        freq, # frequency or list of frequencies in Hz
+        window_time, # longest window in seconds
+        num_channel = 3,
+        length = 4 * 8192, # number of samples kept, has to cover the window
+        ):
+        self.freq = np.atleast_1d(np.asarray(freq, dtype = float))
+        periods = np.floor(window_time * self.freq)
+        self.window = np.where(periods >= 1, periods / np.where(self.freq > 0, self.freq, 1.), window_time)
+        self.length = length
+        self.time = np.zeros(length)
+        self.cumsum = np.zeros((length, num_channel, len(self.freq)), dtype = complex)
+        self.total = np.zeros((num_channel, len(self.freq)), dtype = complex)
+        self.index = 0 # number of samples added
+        self.start = np.zeros(len(self.freq), dtype = int) # first sample inside each window
+        self.first_time = 0.
+    
+    def update(self, time, values):
+        '''Adds one sample or a block of samples, time has the shape (n,) and values
+        the shape (n, num_channel)'''
+        time = np.atleast_1d(np.asarray(time, dtype = float))
+        values = np.asarray(values, dtype = float).reshape(len(time), -1)
+        if(self.index == 0):
+            self.first_time = time[0]
+        last_time = self.time[(self.index - 1) % self.length] if self.index > 0 else time[0]
+        dt = np.diff(time, prepend = last_time)
+        kernel = np.exp(-2j * np.pi * np.outer(time, self.freq)) * dt[:, None]
+        cumsum = self.total + np.cumsum(values[:, :, None] * kernel[:, None, :], axis = 0)
+        self.total = cumsum[-1]
+        if(len(time) > self.length):
+            self.index += len(time) - self.length
+            time = time[-self.length:]
+            cumsum = cumsum[-self.length:]
+        slots = (self.index + np.arange(len(time))) % self.length
+        self.time[slots] = time
+        self.cumsum[slots] = cumsum
+        self.index += len(time)
+        # Slide the start of every window, every sample is passed only once
+        threshold = time[-1] - self.window
+        self.start = np.maximum(self.start, self.index - self.length + 1)
+        for column in range(len(self.freq)):
+            while(self.start[column] < self.index - 1 and \
+                self.time[self.start[column] % self.length] < threshold[column]):
+                self.start[column] += 1
+    
+    def spectrum(self):
+        '''Complex amplitudes over the current windows, with the shape
+        (num_channel, num_freq)'''
+        if(self.index == 0):
+            return self.total.copy()
+        threshold = self.time[(self.index - 1) % self.length] - self.window
+        columns = np.arange(len(self.freq))
+        before = (self.start - 1) % self.length
+        after = self.start % self.length
+        # cumulative sum at the start of the window, between the samples around it
+        span = self.time[after] - self.time[before]
+        frac = np.clip((threshold - self.time[before]) / np.where(span > 0, span, 1.), 0., 1.)
+        frac = np.where(span > 0, frac, 0.)
+        base = self.cumsum[before, :, columns] + frac[:, None] * \
+            (self.cumsum[after, :, columns] - self.cumsum[before, :, columns])
+        base = np.where((self.start > 0)[:, None], base, 0.)
+        return self.total - base.T
+    
+    def duration(self):
+        '''Length in seconds of the current windows'''
+        if(self.index == 0):
+            return np.zeros(len(self.freq))
+        end = self.time[(self.index - 1) % self.length]
+        return np.where(self.start > 0, self.window, end - self.first_time)
+    
+    def amplitude(self):
+        '''Amplitudes of the sinusoids at the lock-in frequencies, with the shape
+        (num_channel, num_freq)'''
+        return 2 * np.abs(self.spectrum()) / np.maximum(self.duration(), 1e-12)
+
+class sine_fit():
+    
+    '''Linear least squares fit of y = a * sin(2 * pi * omega * t) + b * cos(2 * pi * omega * t)
+    at a known omega. Cumulative sums of the normal equation terms are kept for every
+    sample, so adding samples and fitting any of the latest windows are both O(1)
+    without iterative optimisation.'''
+    
+    def __init__(
+        self,
+        omega, # frequency in Hz
+        length = 512, # number of samples kept, the longest window is length - 1
+        ):
+        self.omega = omega
+        self.length = length
+        self.cumsum = np.zeros((length, 6)) # sin*sin, sin*cos, cos*cos, y*sin, y*cos, y*y
+        self.total = np.zeros(6)
+        self.index = 0 # number of samples added
+    
+    def update(self, time, y):
+        '''Adds one sample or a block of samples'''
+        phi = 2 * np.pi * self.omega * np.atleast_1d(np.asarray(time, dtype = float))
+        y = np.atleast_1d(np.asarray(y, dtype = float))
+        sin, cos = np.sin(phi), np.cos(phi)
+        terms = np.column_stack((sin * sin, sin * cos, cos * cos, y * sin, y * cos, y * y))
+        cumsum = self.total + np.cumsum(terms, axis = 0)
+        self.total = cumsum[-1]
+        if(len(cumsum) > self.length):
+            self.index += len(cumsum) - self.length
+            cumsum = cumsum[-self.length:]
+        slots = (self.index + np.arange(len(cumsum))) % self.length
+        self.cumsum[slots] = cumsum
+        self.index += len(cumsum)
+    
+    def fit(self, num):
+        '''Fits the latest num samples, returns a, b and their covariance matrix,
+        or None if the fit is not determined'''
+        num = min(num, self.index, self.length - 1)
+        sums = self.total.copy()
+        if(self.index > num):
+            sums -= self.cumsum[(self.index - num - 1) % self.length]
+        ss, sc, cc, ys, yc, yy = sums
+        det = ss * cc - sc * sc
+        if(num <= 2 or det <= 0):
+            return None
+        a = (cc * ys - sc * yc) / det
+        b = (ss * yc - sc * ys) / det
+        residual = max(yy - a * ys - b * yc, 0.)
+        cov = residual / (num - 2) / det * np.array([[cc, -sc], [-sc, ss]])
+        return a, b, cov
+    
+    def delay(self, num):
+        '''Delay time of the latest num samples with respect to sin(2 * pi * omega * t)
+        and its standard error. The delay is within half a period.'''
+        result = self.fit(num)
+        if(result is None):
+            return 0., 0.
+        a, b, cov = result
+        # a * sin + b * cos = R * sin(phi + theta), with tan(theta) = b / a
+        theta = np.arctan2(b, a)
+        r2 = a * a + b * b
+        theta_var = (b * b * cov[0, 0] + a * a * cov[1, 1] - 2 * a * b * cov[0, 1]) / r2 ** 2
+        return theta / (2 * np.pi * self.omega), np.sqrt(theta_var) / (2 * np.pi * self.omega)
+
+def sine_delay(time, y, omega):
+    '''One-off version of sine_fit.delay() over all the given samples'''
+    fitter = sine_fit(omega, len(time) + 1)
+    fitter.update(time, y)
+    return fitter.delay(len(time))
+
+def rolling_phase(time, signal, reference, omega, fft_length, sampling_div, ends,
+                  interpolation = True, chunk = 256):
+    '''Phase of signal relative to reference at omega, as given by an fft of the
+    uniformly resampled window (uniform_index_list) of the samples before each index
+    in ends, and interpolated_phase. The greedy picks of all the windows of a chunk
+    are followed back together from previous_index(), and only the two bins around
+    omega are needed, so they are computed as direct sums. The windows that are not
+    full are done one by one as before.'''
+    ends = np.asarray(ends, dtype = int)
+    phases = np.zeros(len(ends))
+    if(len(ends) == 0):
+        return phases
+    previous = previous_index(time[:ends.max()], sampling_div)
+    for first in range(0, len(ends), chunk):
+        end = ends[first : first + chunk]
+        index = np.zeros((len(end), fft_length), dtype = int)
+        index[:, -1] = end - 1
+        for k in range(fft_length - 1, 0, -1):
+            index[:, k - 1] = previous[np.maximum(index[:, k], 0)]
+        # uniform_index_list stops before the first sample
+        regular = np.all(index >= 1, axis = 1)
+        for i in np.flatnonzero(~regular):
+            window, avg = uniform_index_list(time[:end[i]], fft_length, sampling_div)
+            fft_freq = np.fft.fftfreq(len(window), avg)
+            phases[first + i] = interpolated_phase(fft_freq, np.fft.fft(signal[window]),
+                                                   np.fft.fft(reference[window]), omega, interpolation)[0]
+        index = index[regular]
+        if(len(index) == 0):
+            continue
+        n = fft_length
+        avg = (time[index[:, -1]] - time[index[:, 0]]) / max(n - 1, 1)
+        # Closest bin to omega among the fftfreq(n, avg) bins and its neighbour on the side of omega
+        position = omega * n * avg
+        close_ind = np.clip(np.ceil(position - 0.5).astype(int), 0, (n - 1) // 2)
+        close_freq = close_ind / (n * avg)
+        neighbour = np.clip(np.where(close_freq < omega, close_ind + 1, close_ind - 1), 0, n - 1)
+        neighbour_freq = np.where(neighbour <= (n - 1) // 2, neighbour, neighbour - n) / (n * avg)
+        bins = np.stack((close_ind, neighbour), axis = 1)
+        kernel = np.exp(-2j * np.pi * bins[:, :, None] * np.arange(n)[None, None, :] / n)
+        fft_signal = np.einsum('wbn,wn->wb', kernel, signal[index])
+        fft_reference = np.einsum('wbn,wn->wb', kernel, reference[index])
+        delta = rectify_phase(np.angle(fft_signal) - np.angle(fft_reference) + np.pi)
+        phase_0, phase_1 = delta[:, 0], delta[:, 1]
+        if(interpolation):
+            span = neighbour_freq - close_freq
+            exact = (close_freq == omega) | (span == 0)
+            weight = np.where(exact, 0., (omega - close_freq) / np.where(span == 0, 1., span))
+            phase_0 = phase_0 + weight * (phase_1 - phase_0)
+        phases[first + np.flatnonzero(regular)] = phase_0
+    return phases
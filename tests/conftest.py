@@ -0,0 +1,5 @@
+import os, sys
+os.environ.setdefault('PENDULUM_HEADLESS', '1') # no window for the figures
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, 'final_data_analysis'))
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pytest
+from arduino_manager import arduino
+from data_process import data, live_data
+from moment_data_process import data_frame
+from Pendulum_Control_Console import cart_pendulum
+from serial_capture import MAGIC, RECORD, RECEIVED
+
+NUM_SAMPLES = 200
+MENU = ["Cart pendulum functions: ", "Enter 0 to reset the arduino board."]
+SPEED = 10. # of the replay, the 10 s of samples take 1 s
+
+def expected_samples():
+    time = 3. + 0.05 * np.arange(NUM_SAMPLES)
+    return np.column_stack((time, np.round(np.sin(time), 4), np.round(100. * np.cos(time), 2)))
+
+def write_capture(file_name):
+    '''Capture of a stream of samples up to the kill switch, some lines split over
+    two reads, the menu after the kill switch in the same read as it'''
+    records = [(0., b"Connected.\r\n")]
+    for i, (time, angle, position) in enumerate(expected_samples()):
+        line = ("%.3f,%.4f,%.2f\r\n" % (time, angle, position)).encode('ASCII')
+        if(i % 7 == 3):
+            records += [(time - 2.9, line[:6]), (time - 2.89, line[6:])]
+        else:
+            records.append((time - 2.9, line))
+    records.append((records[-1][0] + 0.05, b"".join(i.encode('ASCII') + b"\r\n" for i in ["Kill switch hit."] + MENU)))
+    records.append((records[-1][0] + 100., b"Still connected.\r\n")) # the capture does not end during the test
+    with open(file_name, 'wb') as file:
+        file.write(MAGIC)
+        for stamp, content in records:
+            file.write(RECORD.pack(1000. + stamp, RECEIVED, len(content)) + content)
+        file.close()
+
+def replay_run(capture, acquisition):
+    '''Runs the reader of cart_pendulum until the kill switch, returns the arduino
+    class and the recorded samples'''
+    board = arduino('x', 1, replay = capture, replay_speed = SPEED, acquisition = acquisition)
+    board.initiate()
+    cart = cart_pendulum(board, data(128, 0.05, headless = True), live_data(128, 0.05, 1, headless = True),
+                         data_frame())
+    cart.thread_reader(appendPos = True)
+    assert board.receive.rstrip() == "Kill switch hit."
+    assert cart.temp_datum.flag_close_event
+    return board, cart.data.buffer.unroll()[:3].T.copy()
+
+@pytest.fixture
+def capture(tmp_path):
+    file_name = str(tmp_path / 'run.cap')
+    write_capture(file_name)
+    return file_name
+
+@pytest.mark.parametrize("start_method", [True, 'spawn'])
+def test_acquisition_matches_the_in_process_reader(capture, start_method):
+    board, reference = replay_run(capture, False)
+    board.board.close()
+    expected = expected_samples()
+    expected[:, 0] -= expected[0, 0]
+    np.testing.assert_allclose(reference, expected, atol = 1e-9)
+
+    board, samples = replay_run(capture, start_method)
+    process, ring_name = board.board.process, board.board.ring.name
+    assert process.is_alive()
+    np.testing.assert_array_equal(samples, reference)
+    assert board.board.ring.index > NUM_SAMPLES // 2 # most of them went through the shared ring
+    # reconnect() reads the menu after the kill switch as text again
+    board.board.stream(None)
+    for line in MENU:
+        board.read_single(prt = False)
+        assert board.receive.rstrip() == line.rstrip()
+    board.board.close()
+    assert not process.is_alive()
+    assert process.exitcode == 0 # closed, not terminated
+    if(os.path.isdir('/dev/shm')):
+        assert ring_name.lstrip('/') not in os.listdir('/dev/shm')
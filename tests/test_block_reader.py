@@ -0,0 +1,51 @@
+import numpy as np
+from arduino_manager import arduino
+from data_process import data, live_data
+from moment_data_process import data_frame
+from Pendulum_Control_Console import cart_pendulum
+
+MENU = [b"Cart pendulum functions: \r\n", b"Enter 0 to reset the arduino board.\r\n"]
+
+class chunk_port():
+
+    '''Serial port handing out the given chunks one read at a time'''
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    @property
+    def in_waiting(self):
+        return len(self.chunks[0]) if self.chunks else 0
+
+    def read(self, size = 1):
+        if(not self.chunks):
+            return b""
+        data, self.chunks[0] = self.chunks[0][:size], self.chunks[0][size:]
+        if(len(self.chunks[0]) == 0):
+            self.chunks.pop(0)
+        return data
+
+def block_reader(chunks):
+    board = arduino('x', 1)
+    board.board = chunk_port(chunks)
+    cart = cart_pendulum(board, data(128, 0.05, headless = True), live_data(128, 0.05, 1, headless = True),
+                         data_frame(), batch_read = True)
+    cart.thread_reader(appendPos = True)
+    return board, cart
+
+def test_line_split_across_chunks():
+    board, cart = block_reader([b"1.000,0.1000,10.00\r\n2.000,0.2", b"000,20.00\r\n3.000,0.3000,30.00\r\n",
+                                b"Kill switch hit.\r\n"])
+    assert np.allclose(cart.data.buffer.unroll('time'), [0., 1., 2.]) # relative to the first sample
+    assert np.allclose(cart.data.buffer.unroll('angle'), [0.1, 0.2, 0.3])
+    assert np.allclose(cart.data.buffer.unroll('position'), [10., 20., 30.])
+    assert cart.temp_datum.flag_close_event
+
+def test_menu_after_kill_in_the_same_chunk():
+    board, cart = block_reader([b"1.000,0.1000,10.00\r\n2.000,0.2000,20.00\r\nKill switch hit.\r\n" + b"".join(MENU)])
+    assert np.allclose(cart.data.buffer.unroll('time'), [0., 1.])
+    assert board.receive == "Kill switch hit."
+    # the menu is still read by reconnect()
+    for line in MENU:
+        board.read_single(prt = False)
+        assert board.receive.rstrip() == line.decode('ASCII').rstrip()
@@ -0,0 +1,91 @@
+import os, csv
+import numpy as np
+import pytest
+from csv_process import data_analysis, cache_key
+from run_format import save_run
+
+HEADER = [["special_info", ""], ["start_time", "12.5"], ["omega", "1.0"],
+          ["amplitude", "50.0", "amp_0", "50.0"], ["phase/pi", "-0.5"],
+          ["time", "angle", "position", "angular_velocity", "cart_velocity"]]
+
+def write_run(dirc, file_name, samples, binary = True):
+    '''Writes a run as export_csv() does, the folder is joined with '\\' as in
+    csv_process on any system'''
+    basename = os.path.splitext(dirc + '\\' + file_name)[0]
+    with open(basename + '.csv', 'w', newline = '') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerows(HEADER)
+        writer.writerows(samples)
+        csvfile.close()
+    if(binary):
+        save_run(basename, HEADER, samples)
+    return basename
+
+def analysis(dirc):
+    result = data_analysis()
+    result.interactive = False
+    result.dirc = dirc
+    return result
+
+def run_files(basename):
+    return [basename + i for i in ('.csv', '.bin', '.json') if os.path.exists(basename + i)]
+
+def samples_of(time):
+    samples = np.zeros((len(time), 5))
+    samples[:, 0] = time
+    samples[:, 1] = np.sin(time)
+    return samples
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_negative_time_stamp_removes_the_whole_run(tmp_path, binary):
+    dirc = str(tmp_path / 'runs')
+    basename = write_run(dirc, 'measure-1.csv', samples_of(np.arange(-1., 5., 0.05)), binary)
+    assert analysis(dirc).read_csv('measure-1.csv') is False
+    assert run_files(basename) == []
+
+def test_empty_run_removes_the_whole_run(tmp_path):
+    dirc = str(tmp_path / 'runs')
+    basename = write_run(dirc, 'measure-2.csv', np.zeros((3, 5)))
+    result = analysis(dirc)
+    assert result.read_csv('measure-2.csv') is True
+    with pytest.raises(FileNotFoundError):
+        result.clean_data('measure-2.csv')
+    assert run_files(basename) == []
+
+@pytest.mark.parametrize("filled", [40, 64])
+def test_doubled_export_keeps_the_zero_first_sample(tmp_path, filled):
+    '''Older measure exports hold both halves of the doubled buffer, with sample 0
+    all zeros and the unfilled slots as rows of zeros'''
+    dirc = str(tmp_path / 'runs')
+    half = np.zeros((64, 5))
+    half[1:filled] = samples_of(np.arange(1, filled) * 0.05) + [0., 0., 1., 0., 0.]
+    write_run(dirc, 'measure-3.csv', np.concatenate((half, half)), binary = False)
+    result = analysis(dirc)
+    assert result.read_csv('measure-3.csv') is True
+    assert result.count == 2 * filled
+    data = result.clean_data('measure-3.csv')
+    assert data.shape == (5, filled)
+    np.testing.assert_allclose(data[0], np.arange(filled) * 0.05)
+    np.testing.assert_array_equal(data[1:, 0], 0.)
+
+def test_trailing_empty_slots_are_dropped(tmp_path):
+    dirc = str(tmp_path / 'runs')
+    samples = np.concatenate((samples_of(np.arange(30) * 0.05), np.zeros((5, 5))))
+    write_run(dirc, 'measure-4.csv', samples, binary = False)
+    result = analysis(dirc)
+    assert result.read_csv('measure-4.csv') is True
+    assert result.count == 30
+    np.testing.assert_allclose(result.clean_data('measure-4.csv')[0], np.arange(30) * 0.05)
+
+def test_cache_key_covers_the_binary_copy(tmp_path):
+    dirc = str(tmp_path / 'runs')
+    samples = samples_of(np.arange(50) * 0.05)
+    basename = write_run(dirc, 'scan-1.csv', samples)
+    settings = {"start_time": 5., "end_time": None}
+    key = cache_key(basename + '.csv', settings)
+    assert cache_key(basename + '.csv', settings) == key
+    # only the binary copy, which read_csv() reads, is changed
+    samples[10, 1] = 2.
+    save_run(basename, HEADER, samples)
+    assert cache_key(basename + '.csv', settings) != key
+    assert cache_key(basename + '.csv', dict(settings, start_time = 6.)) != cache_key(basename + '.csv', settings)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from ring_buffer import ring_buffer
+
+LENGTH = 7
+WINDOW = 3
+
+def filled(num, block = None):
+    '''Buffer and plain list reference after num samples, appended one by one or
+    in blocks of the given size'''
+    buffer = ring_buffer(LENGTH, fields = ('time', 'angle'), window = WINDOW)
+    reference = []
+    samples = [(float(i), 10. * i) for i in range(num)]
+    if(block is None):
+        for sample in samples:
+            buffer.append(sample)
+    else:
+        for start in range(0, num, block):
+            buffer.extend(samples[start : start + block])
+    reference += samples
+    return buffer, reference[-LENGTH:]
+
+def check_mirror(buffer):
+    assert np.array_equal(buffer.data[:, :WINDOW], buffer.data[:, LENGTH:])
+
+@pytest.mark.parametrize("num", [0, 1, LENGTH - 1, LENGTH, LENGTH + 1, 3 * LENGTH + 2])
+def test_append_wraps_around(num):
+    buffer, reference = filled(num)
+    assert len(buffer) == len(reference)
+    assert buffer.index == num
+    assert np.array_equal(buffer.unroll('time'), [i[0] for i in reference])
+    assert np.array_equal(buffer.unroll(), np.array(reference).reshape(-1, 2).T)
+    if(num > 0):
+        assert buffer['time'][buffer.temp_index] == reference[-1][0]
+    check_mirror(buffer)
+
+@pytest.mark.parametrize("num, block", [(LENGTH + 3, 4), (2 * LENGTH + 1, 5), (3 * LENGTH, LENGTH + 2)])
+def test_extend_across_the_seam(num, block):
+    buffer, reference = filled(num, block)
+    appended, _ = filled(num)
+    assert buffer.index == num
+    assert buffer.temp_index == appended.temp_index
+    assert np.array_equal(buffer.data, appended.data)
+    assert np.array_equal(buffer.unroll('angle'), [i[1] for i in reference])
+    check_mirror(buffer)
+
+@pytest.mark.parametrize("num", [2, WINDOW, LENGTH + 1, 2 * LENGTH + 2])
+def test_latest_slice(num):
+    buffer, reference = filled(num)
+    for latest in range(1, WINDOW + 2):
+        view = buffer.latest(latest, 'time')
+        expected = [i[0] for i in reference[-min(latest, WINDOW):]]
+        assert np.array_equal(view, expected)
+        # a view of the storage, not a copy
+        assert view.base is buffer.data or view.base is buffer.data.base
+
+def test_latest_slice_of_the_whole_capacity():
+    buffer = ring_buffer(LENGTH, fields = ('time', 'angle'), window = LENGTH)
+    for i in range(2 * LENGTH + 3):
+        buffer.append((float(i), 0.))
+        expected = np.arange(max(0, i + 1 - LENGTH), i + 1)
+        assert np.array_equal(buffer.latest(LENGTH, 'time'), expected)
+        assert np.array_equal(buffer.latest(LENGTH, 'time'), buffer.unroll('time'))
+
+def test_write_keeps_the_mirror():
+    buffer, _ = filled(LENGTH + 2)
+    buffer.write('angle', [0, 1, LENGTH - 1], [-1., -2., -3.])
+    check_mirror(buffer)
+    assert buffer['angle'][LENGTH - 1] == -3.
+
+@pytest.mark.parametrize("num", [5, LENGTH, 2 * LENGTH + 4])
+def test_unroll_of_a_snapshot_index_and_physical(num):
+    buffer, reference = filled(num)
+    # one sample appended by the reader thread after the snapshot
+    buffer.append((float(num), 10. * num))
+    time = buffer.unroll('time', num)
+    if(num < LENGTH):
+        assert np.array_equal(time, [i[0] for i in reference])
+    else:
+        # the oldest slot of the snapshot now holds the new sample
+        assert np.array_equal(time[1:], [i[0] for i in reference[1:]])
+    slots = buffer.physical(np.arange(len(time)), num)
+    assert np.array_equal(buffer['time'][slots], time)
+
+def test_clear():
+    buffer, _ = filled(LENGTH + 2)
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.index == 0
+    assert len(buffer.unroll()) == 2 and buffer.unroll().shape[1] == 0
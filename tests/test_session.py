@@ -0,0 +1,47 @@
+import os, glob, re
+import numpy as np
+import pandas as pd
+import pytest
+from data_process import data, live_data
+from moment_data_process import data_frame
+
+def recorded_run(tmp_path, copy):
+    datum = data(64, 0.05, headless = True, buffer_length = 256)
+    temp_datum = live_data(64, 0.05, 1, headless = True)
+    datum.path = temp_datum.path = str(tmp_path / 'run')
+    datum.open_session("measure")
+    df = data_frame()
+    for i in range(100):
+        df.update_data([0.05 * i, 0.1 * np.sin(i), 0.], appendPos = False)
+        datum.append_data(df, appendPos = False)
+    if(copy):
+        temp_datum.copy(datum)
+    temp_datum.fft_freq = []
+    return datum, temp_datum
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_export_completes_the_session(tmp_path, capsys, copy):
+    datum, temp_datum = recorded_run(tmp_path, copy)
+    session = datum.session
+    temp_datum.export_csv("measure", input_spec_info = False, session = datum.session)
+    assert session.closed
+    exported = re.findall(r"Exported to (.*)\n", capsys.readouterr().out)[0]
+    assert exported == session.basename
+    assert os.path.exists(exported + '.csv') and os.path.exists(exported + '.bin')
+    # no second copy of the run
+    runs = [i for i in glob.glob(str(tmp_path / '*.csv')) if 'fft' not in i]
+    assert runs == [session.filename]
+    with open(session.filename) as file:
+        lines = file.read().splitlines()
+    assert lines[1].startswith("start_time") and len(lines) == 6 + 100
+
+def test_export_is_a_plain_csv(tmp_path):
+    datum, temp_datum = recorded_run(tmp_path, True)
+    session = datum.session
+    temp_datum.export_csv("measure", input_spec_info = False, session = datum.session)
+    assert not os.path.exists(session.part_name)
+    samples = pd.read_csv(session.filename, skiprows = 6, header = None)
+    assert samples.shape == (100, 5)
+    np.testing.assert_allclose(samples[0], 0.05 * np.arange(100))
+    columns = pd.read_csv(session.filename, skiprows = 5, nrows = 0)
+    assert list(columns.columns) == ["time", "angle", "position", "angular_velocity", "cart_velocity"]
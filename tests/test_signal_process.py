@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from signal_process import uniform_index_list, rolling_phase, interpolated_phase
+
+def loop_index_list(time, fft_length, sampling_div):
+    '''The fft_index_list() loop of csv_process before it was vectorised. Its last
+    index held the current time instead of the latest index.'''
+    current_time = time[len(time) - 1]
+    time_stamp = current_time
+    index = fft_length - 2
+    index_list = np.zeros(fft_length, dtype = int)
+    index_list[fft_length - 1] = current_time
+    for i in range(len(time) - 1, 0, -1):
+        if index < 0:
+            avg_spacing = (current_time - time_stamp) / (fft_length - index - 2)
+            return index_list, avg_spacing
+        if(time_stamp - time[i] >= sampling_div):
+            index_list[index] = i
+            time_stamp = time[i]
+            index -= 1
+    avg_spacing = (current_time - time_stamp) / (fft_length - index - 2)
+    if index >= 0:
+        return index_list[index + 1 : fft_length], avg_spacing
+    return index_list, avg_spacing
+
+def jittered_time(num, step, jitter, seed = 0):
+    rng = np.random.default_rng(seed)
+    return 1000. + np.cumsum(step + rng.uniform(0., jitter, num))
+
+@pytest.mark.parametrize("fft_length, sampling_div, step, jitter", [
+    (512, 0.04, 0.04, 0.012), # the case of the review, 12 ms jitter
+    (256, 0.05, 0.05, 0.012),
+    (128, 0.05, 0.02, 0.012), # several samples per division
+    (64, 0.05, 0.05, 0.), # regular samples, the comparison is on the edge
+    ])
+@pytest.mark.parametrize("num", [100, 3000])
+def test_uniform_index_list_matches_the_loop(fft_length, sampling_div, step, jitter, num):
+    time = jittered_time(num, step, jitter)
+    if(jitter == 0.):
+        time = np.round(time, 3) # as printed by the board
+    index_list, avg_spacing = uniform_index_list(time, fft_length, sampling_div)
+    expected, expected_spacing = loop_index_list(time, fft_length, sampling_div)
+    assert np.array_equal(index_list[:-1], expected[:-1])
+    assert index_list[-1] == len(time) - 1
+    assert avg_spacing == pytest.approx(expected_spacing, rel = 1e-12)
+    assert np.all(np.diff(time[index_list]) >= sampling_div)
+
+def test_uniform_index_list_with_gaps():
+    # a gap longer than the tail the previous indices are computed for at first
+    time = np.concatenate((np.arange(0., 10., 0.04), 100. + np.arange(0., 2., 0.04)))
+    index_list, avg_spacing = uniform_index_list(time, 200, 0.04)
+    expected, expected_spacing = loop_index_list(time, 200, 0.04)
+    assert np.array_equal(index_list[:-1], expected[:-1])
+    assert avg_spacing == pytest.approx(expected_spacing)
+
+def window_phase(time, signal, reference, omega, fft_length, sampling_div, end, interpolation):
+    '''Phase of the window before end as csv_process computed it, one fft per window'''
+    window, avg = uniform_index_list(time[:end], fft_length, sampling_div)
+    fft_freq = np.fft.fftfreq(len(window), avg)
+    return interpolated_phase(fft_freq, np.fft.fft(signal[window]), np.fft.fft(reference[window]),
+                              omega, interpolation)[0]
+
+@pytest.mark.parametrize("step, sampling_div", [
+    (0.04, 0.04),
+    (0.02, 0.05), # several samples per division, the greedy picks drift off a regular grid
+    ])
+@pytest.mark.parametrize("interpolation", [True, False])
+def test_rolling_phase_matches_the_fft(step, sampling_div, interpolation):
+    time = jittered_time(600, step, 0.012, seed = 3)
+    omega, fft_length = 0.7, 64
+    signal = 0.3 * np.sin(2 * np.pi * omega * time - 1.) + 0.05
+    reference = 50. * np.sin(2 * np.pi * omega * time)
+    # the first windows are not full, and the chunks of 4 windows have a boundary
+    # between two consecutive ends
+    ends = np.concatenate((np.arange(10, 100, 9), np.arange(100, 600)))
+    phases = rolling_phase(time, signal, reference, omega, fft_length, sampling_div, ends,
+                           interpolation, chunk = 4)
+    expected = [window_phase(time, signal, reference, omega, fft_length, sampling_div, end, interpolation)
+                for end in ends]
+    np.testing.assert_allclose(phases, expected, rtol = 0., atol = 1e-9)
+
+def driven_samples(num, omega, phase, sampling_div = 0.05, offset = 0.05, seed = 1):
+    '''time, angle and position rows of a pendulum lagging the cart by phase,
+    with jittered timestamps and an angle offset'''
+    time = jittered_time(num, sampling_div, 2e-3, seed)
+    angle = 0.3 * np.sin(2 * np.pi * omega * time - phase) + offset
+    position = 50. * np.sin(2 * np.pi * omega * time)
+    return np.column_stack((time, angle, position))
+
+def scan_phase(samples, omega, fft_length, sampling_div, lock_in):
+    from data_process import data
+    from moment_data_process import data_frame
+    datum = data(fft_length, sampling_div, headless = True, buffer_length = 8192)
+    datum.omega = omega
+    datum.flag_lock_in = lock_in
+    datum.init_phase_lists(True)
+    df = data_frame()
+    df.block = samples
+    df.update_data(samples[-1])
+    datum.append_block(df)
+    assert datum.NR_phase_calc(omega, True, True)
+    assert (datum.lock_in is not None) == lock_in
+    return datum
+
+@pytest.mark.parametrize("omega", [0.8, 1.0, 1.37])
+@pytest.mark.parametrize("phase", [0.3, 1.6, 2.9])
+def test_lock_in_phase_matches_the_fft(omega, phase):
+    samples = driven_samples(2000, omega, phase, offset = 0.3)
+    expected = np.angle(np.exp(1j * (np.pi - phase)))
+    fft_phase = scan_phase(samples, omega, 512, 0.05, False).phase
+    lock_in_phase = scan_phase(samples, omega, 512, 0.05, True).phase
+    # the same phase up to the rectification
+    assert np.angle(np.exp(1j * (fft_phase - expected))) == pytest.approx(0., abs = 1e-3)
+    assert np.angle(np.exp(1j * (lock_in_phase - expected))) == pytest.approx(0., abs = 1e-3)
+
+def test_lock_in_amplitude_and_window():
+    from signal_process import lock_in
+    samples = driven_samples(3000, 1.37, 0.4)
+    estimator = lock_in([1.37, 0.9], 512 * 0.05, num_channel = 2)
+    # one by one and in blocks give the same sums
+    for row in samples[:1000]:
+        estimator.update(row[0], row[1:])
+    estimator.update(samples[1000:, 0], samples[1000:, 1:])
+    assert np.allclose(estimator.window * estimator.freq, np.floor(512 * 0.05 * estimator.freq))
+    assert np.allclose(estimator.duration(), estimator.window)
+    assert estimator.amplitude()[:, 0] == pytest.approx([0.3, 50.], rel = 2e-3)
+    # nothing at the other frequency, the offset does not leak
+    assert estimator.amplitude()[0, 1] < 2e-3